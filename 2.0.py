@@ -1,145 +1,3811 @@
-import keyboard
+try:
+    import keyboard
+except ImportError:
+    keyboard = None
 import time
+import errno
 import os
 import sys
 import random
 import subprocess
+import socket
+import struct
+import select
+import threading
+import statistics
+import json
+import csv
+import re
+import gzip
+import queue
+import ctypes
+import zipfile
+import lzma
+import bz2
+import shutil
+import tempfile
+import mmap
+import atexit
+import argparse
+import copy
+import bisect
+import shlex
+import tarfile
+import zlib
+import ctypes.util
+from collections import deque
+from itertools import accumulate
+from array import array
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from pathlib import Path
 import hashlib
-from urllib.parse import urlparse
+import http.client
+import urllib.request
+import urllib.error
+from urllib.parse import urlparse, urljoin
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # 跨平台清屏方法
 def clear_screen():
     os.system('cls' if os.name == 'nt' else 'clear')
 
+# 界面动画与提示停顿；FLASH_FAST=1 或批处理模式下跳过
+UI_DELAYS = os.environ.get('FLASH_FAST', '0') in ('0', '')
+
+def ui_sleep(seconds):
+    if UI_DELAYS:
+        time.sleep(seconds)
+
 # Windows终端颜色支持
 if sys.platform.startswith('win'):
     from ctypes import windll
     kernel32 = windll.kernel32
     kernel32.SetConsoleMode(kernel32.GetStdHandle(-11), 7)
 
-# 法律声明
-def legal_notice():
-    print("--------------------------")
-    print("|  高级刷机工具 v4.0.0  |")
-    print("|  保留核心刷机功能     |")
-    print("|  集成50+ ADB功能     |")
-    print("--------------------------")
+# 法律声明
+def legal_notice():
+    print("--------------------------")
+    print("|  高级刷机工具 v4.0.0  |")
+    print("|  保留核心刷机功能     |")
+    print("|  集成50+ ADB功能     |")
+    print("--------------------------")
+
+# 未启用埋点时返回的空区间，所有方法都不做任何事
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def add_bytes(self, count):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+# 一次操作的耗时区间
+class TelemetrySpan:
+    __slots__ = ('telemetry', 'operation', 'attrs', 'start', 'end', 'status', 'bytes', 'span_id', 'parent_id')
+
+    def __init__(self, telemetry, operation, attrs):
+        self.telemetry = telemetry
+        self.operation = operation
+        self.attrs = attrs
+        self.status = 'ok'
+        self.bytes = 0
+        self.start = self.end = None
+        self.span_id = self.parent_id = None
+
+    def __enter__(self):
+        stack = self.telemetry._stack()
+        self.span_id = next(self.telemetry._ids)
+        self.parent_id = stack[-1].span_id if stack else None
+        stack.append(self)
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.monotonic()
+        if exc_type is not None and self.status == 'ok':
+            self.status = 'error'
+            self.attrs['error'] = f"{exc_type.__name__}: {exc}"
+        stack = self.telemetry._stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        self.telemetry._record(self)
+        return False
+
+    def set(self, status=None, **attrs):
+        """设置状态（ok/error）及附加属性"""
+        if status is not None:
+            self.status = status
+        self.attrs.update(attrs)
+
+    def add_bytes(self, count):
+        self.bytes += count
+
+# 运行时埋点 - 记录各操作的耗时区间和延迟直方图，导出为JSON Lines与Prometheus文本文件
+class Telemetry:
+    BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+    def __init__(self, enabled=None, output_dir=None, keep_spans=10000):
+        if enabled is None:
+            enabled = os.environ.get('FLASH_TELEMETRY', '0') not in ('0', '')
+        self.enabled = enabled
+        self.output_dir = Path(output_dir or os.environ.get('FLASH_TELEMETRY_DIR', 'logs/telemetry'))
+        self.spans = deque(maxlen=keep_spans)
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._ids = iter(range(1, sys.maxsize))
+        self._jsonl = None
+        self._started = time.time()
+
+    def span(self, operation, **attrs):
+        """with TELEMETRY.span('adb_command', serial=...) as span: ...；未启用时返回空区间"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return TelemetrySpan(self, operation, attrs)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, span):
+        duration = span.end - span.start
+        line = {'span_id': span.span_id, 'parent_id': span.parent_id, 'operation': span.operation,
+                'start': span.start, 'end': span.end, 'duration': duration, 'status': span.status,
+                'bytes': span.bytes, 'thread': threading.current_thread().name}
+        line.update(span.attrs)
+        with self._lock:
+            self.spans.append(line)
+            histogram = self.histograms.get(span.operation)
+            if histogram is None:
+                histogram = self.histograms[span.operation] = {
+                    'buckets': [0] * (len(self.BUCKETS) + 1), 'sum': 0.0, 'count': 0, 'errors': 0, 'bytes': 0}
+            histogram['buckets'][bisect.bisect_left(self.BUCKETS, duration)] += 1
+            histogram['sum'] += duration
+            histogram['count'] += 1
+            histogram['bytes'] += span.bytes
+            if span.status != 'ok':
+                histogram['errors'] += 1
+            self._write_line(line)
+
+    def _write_line(self, line):
+        if self._jsonl is False:
+            return
+        try:
+            if self._jsonl is None:
+                self.output_dir.mkdir(parents=True, exist_ok=True)
+                self._jsonl = open(self.output_dir / "spans.jsonl", 'a', encoding='utf-8')
+            self._jsonl.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+        except OSError:
+            # 日志目录不可写时只保留内存中的数据
+            self._jsonl = False
+
+    def quantile(self, operation, q):
+        """按直方图估算分位数（取所在桶的上界）"""
+        histogram = self.histograms.get(operation)
+        if not histogram or not histogram['count']:
+            return None
+        target = q * histogram['count']
+        seen = 0
+        for bound, count in zip(self.BUCKETS + (float('inf'),), histogram['buckets']):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        """各操作的次数、错误数、平均耗时和p50/p95"""
+        with self._lock:
+            operations = sorted(self.histograms)
+        return {op: {'count': self.histograms[op]['count'], 'errors': self.histograms[op]['errors'],
+                     'mean': self.histograms[op]['sum'] / self.histograms[op]['count'],
+                     'p50': self.quantile(op, 0.5), 'p95': self.quantile(op, 0.95),
+                     'bytes': self.histograms[op]['bytes']} for op in operations}
+
+    @staticmethod
+    def escape_label(value):
+        """按Prometheus文本格式转义标签值中的反斜杠、双引号和换行"""
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def export_prometheus(self, path=None):
+        """写出Prometheus文本文件（node_exporter textfile collector格式，原子替换）"""
+        path = Path(path) if path else self.output_dir / "flash_tool.prom"
+        lines = ["# HELP flash_operation_duration_seconds 各操作耗时",
+                 "# TYPE flash_operation_duration_seconds histogram"]
+        with self._lock:
+            histograms = {op: dict(h, buckets=list(h['buckets'])) for op, h in self.histograms.items()}
+        for op in sorted(histograms):
+            h = histograms[op]
+            label = self.escape_label(op)
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS, h['buckets']):
+                cumulative += count
+                lines.append(f'flash_operation_duration_seconds_bucket{{operation="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'flash_operation_duration_seconds_bucket{{operation="{label}",le="+Inf"}} {h["count"]}')
+            lines.append(f'flash_operation_duration_seconds_sum{{operation="{label}"}} {h["sum"]:.6f}')
+            lines.append(f'flash_operation_duration_seconds_count{{operation="{label}"}} {h["count"]}')
+        for name, key, help_text in (("flash_operation_errors_total", 'errors', "失败的操作次数"),
+                                     ("flash_operation_bytes_total", 'bytes', "各操作传输的字节数")):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for op in sorted(histograms):
+                lines.append(f'{name}{{operation="{self.escape_label(op)}"}} {histograms[op][key]}')
+        lines.append("# HELP flash_tool_start_time_seconds 进程启动时间")
+        lines.append("# TYPE flash_tool_start_time_seconds gauge")
+        lines.append(f"flash_tool_start_time_seconds {self._started:.0f}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+        return path
+
+    def flush(self):
+        """退出时调用：刷新JSON Lines并写出Prometheus文件"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._jsonl:
+                self._jsonl.flush()
+        try:
+            self.export_prometheus()
+        except OSError:
+            pass
+
+TELEMETRY = Telemetry()
+atexit.register(TELEMETRY.flush)
+
+# ADB协议错误（服务端返回FAIL或数据不完整）
+class ADBProtocolError(Exception):
+    pass
+
+# ADB主机协议客户端 - 直接连接adb server套接字，避免每条命令启动adb进程
+class ADBClient:
+    SHELL_V2_STDOUT = 1
+    SHELL_V2_STDERR = 2
+    SHELL_V2_EXIT = 3
+
+    def __init__(self, host=None, port=None, pool_size=4, timeout=30):
+        self.host = host or os.environ.get('ADB_SERVER_HOST', '127.0.0.1')
+        self.port = int(port or os.environ.get('ANDROID_ADB_SERVER_PORT', 5037))
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._pool = []
+        self._lock = threading.Lock()
+        self._features = {}
+
+    # ---- 连接池 ----
+    def _connect(self):
+        """建立到adb server的新连接"""
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _is_alive(self, sock):
+        """空闲连接可读即表示对端已关闭"""
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return True
+            return sock.recv(1, socket.MSG_PEEK) != b''
+        except (OSError, ValueError):
+            return False
+
+    def _acquire(self, timeout=None):
+        """从连接池取出可用连接，没有则新建"""
+        sock = None
+        with self._lock:
+            while self._pool:
+                candidate = self._pool.pop()
+                if self._is_alive(candidate):
+                    sock = candidate
+                    break
+                candidate.close()
+        if sock is None:
+            sock = self._connect()
+        sock.settimeout(timeout or self.timeout)
+        return sock
+
+    def warm_up(self, count=None):
+        """预先建立连接，降低首批命令的延迟"""
+        count = self.pool_size if count is None else min(count, self.pool_size)
+        while len(self._pool) < count:
+            sock = self._connect()
+            with self._lock:
+                self._pool.append(sock)
+
+    def close(self):
+        """关闭连接池中的所有连接"""
+        with self._lock:
+            for sock in self._pool:
+                sock.close()
+            self._pool = []
+
+    # ---- 协议基础 ----
+    def _recv_exact(self, sock, size):
+        """读取固定长度的数据"""
+        buf = bytearray()
+        while len(buf) < size:
+            chunk = sock.recv(size - len(buf))
+            if not chunk:
+                raise ADBProtocolError("连接被adb server关闭")
+            buf += chunk
+        return bytes(buf)
+
+    def _recv_all(self, sock):
+        """读取数据直到对端关闭连接"""
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    def _read_length_prefixed(self, sock):
+        """读取以4位十六进制长度开头的数据"""
+        length = int(self._recv_exact(sock, 4), 16)
+        return self._recv_exact(sock, length) if length else b''
+
+    def _send_request(self, sock, request):
+        """发送请求并检查OKAY/FAIL应答"""
+        payload = request.encode('utf-8')
+        sock.sendall(b'%04x' % len(payload) + payload)
+        status = self._recv_exact(sock, 4)
+        if status == b'OKAY':
+            return
+        if status == b'FAIL':
+            raise ADBProtocolError(self._read_length_prefixed(sock).decode('utf-8', 'replace'))
+        raise ADBProtocolError(f"未知应答: {status!r}")
+
+    def _switch_transport(self, sock, serial):
+        """将连接切换到指定设备 (host:transport:<serial>)"""
+        self._send_request(sock, f"host:transport:{serial}" if serial else "host:transport-any")
+
+    # ---- 主机服务 ----
+    def host_query(self, request, timeout=None):
+        """执行host:类请求并返回应答数据"""
+        sock = self._acquire(timeout)
+        try:
+            self._send_request(sock, request)
+            data = self._read_length_prefixed(sock)
+        finally:
+            # adb server应答后即关闭连接，放回连接池会与对端的关闭竞争，下一个请求可能读到空数据
+            sock.close()
+        return data.decode('utf-8', 'replace')
+
+    def version(self):
+        """adb server协议版本"""
+        return int(self.host_query("host:version"), 16)
+
+    def devices(self, long_format=False):
+        """设备列表，格式与 adb devices 的输出一致"""
+        data = self.host_query("host:devices-l" if long_format else "host:devices")
+        return "List of devices attached\n" + data
+
+    def get_state(self, serial=None, timeout=None):
+        """设备状态 (device/bootloader/offline...)"""
+        return self.host_query(f"host-serial:{serial}:get-state" if serial else "host:get-state", timeout)
+
+    def features(self, serial=None):
+        """设备支持的特性集合（结果按设备缓存）"""
+        key = serial or ''
+        if key not in self._features:
+            request = f"host-serial:{serial}:features" if serial else "host:features"
+            try:
+                self._features[key] = set(self.host_query(request).split(','))
+            except ADBProtocolError:
+                # 旧版server或设备未找到，按不支持处理且不缓存
+                return set()
+        return self._features[key]
+
+    # ---- 设备服务 ----
+    def open_stream(self, service, serial=None, timeout=None):
+        """切换到设备并打开服务，返回可直接读写的套接字（用于流式输出）"""
+        sock = self._acquire(timeout)
+        try:
+            self._switch_transport(sock, serial)
+            self._send_request(sock, service)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    def shell(self, command, serial=None, timeout=None):
+        """执行shell命令，返回 (退出码, stdout, stderr)；不支持shell_v2的设备退出码为None"""
+        if 'shell_v2' not in self.features(serial):
+            sock = self.open_stream(f"shell:{command}", serial, timeout)
+            try:
+                return None, self._recv_all(sock), b''
+            finally:
+                sock.close()
+
+        sock = self.open_stream(f"shell,v2,raw:{command}", serial, timeout)
+        stdout, stderr, exit_code = [], [], None
+        try:
+            while exit_code is None:
+                first = sock.recv(1)
+                if not first:
+                    break
+                header = first + self._recv_exact(sock, 4)
+                packet_id, length = struct.unpack('<BI', header)
+                payload = self._recv_exact(sock, length) if length else b''
+                if packet_id == self.SHELL_V2_STDOUT:
+                    stdout.append(payload)
+                elif packet_id == self.SHELL_V2_STDERR:
+                    stderr.append(payload)
+                elif packet_id == self.SHELL_V2_EXIT:
+                    exit_code = payload[0] if payload else 0
+        finally:
+            sock.close()
+        return exit_code, b''.join(stdout), b''.join(stderr)
+
+    def exec_out(self, command, serial=None, timeout=None):
+        """通过exec:服务执行命令，返回原始二进制输出"""
+        sock = self.open_stream(f"exec:{command}", serial, timeout)
+        try:
+            return self._recv_all(sock)
+        finally:
+            sock.close()
+
+    def reboot(self, target='', serial=None, timeout=None):
+        """重启设备 (target可为 recovery/bootloader/sideload)"""
+        sock = self.open_stream(f"reboot:{target}", serial, timeout)
+        try:
+            return self._recv_all(sock)
+        finally:
+            sock.close()
+
+# 设备数据流 - 统一封装原生协议套接字与adb子进程两种来源，供长时间运行的读取/写入使用
+class DeviceStream:
+    def __init__(self, sock=None, process=None):
+        self.sock = sock
+        self.process = process
+        self._reader = sock.makefile('rb') if sock is not None else process.stdout
+
+    def read(self, size=-1):
+        return self._reader.read(size)
+
+    def read1(self, size=65536):
+        """读取当前可用的数据（至少1字节，结束时返回空）"""
+        if self.sock is not None:
+            return self.sock.recv(size)
+        return self._reader.read1(size)
+
+    def readinto(self, buffer):
+        return self._reader.readinto(buffer)
+
+    def readline(self):
+        return self._reader.readline()
+
+    def __iter__(self):
+        return iter(self._reader.readline, b'')
+
+    def write(self, data):
+        if self.sock is not None:
+            self.sock.sendall(data)
+        else:
+            self.process.stdin.write(data)
+        return len(data)
+
+    def close_write(self):
+        """关闭写方向，通知设备端输入结束"""
+        if self.sock is not None:
+            self.sock.shutdown(socket.SHUT_WR)
+        elif self.process.stdin:
+            self.process.stdin.close()
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self._reader.close()
+                self.sock.close()
+            except OSError:
+                pass
+        elif self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# ADB功能管理器
+class ADBManager:
+    # 交给宿主shell处理的字符（重定向、引号、管道、命令分隔），含有这些字符的命令仍走adb进程以保持原有语义
+    HOST_SHELL_CHARS = set('<>"\'`$|&;')
+
+    def __init__(self):
+        self.connected_devices = []
+        self.current_device = None
+        self.use_native = os.environ.get('FLASH_ADB_NATIVE', '1') != '0'
+        self.client = ADBClient()
+        
+    def run_adb_command(self, command, device_specific=True, serial=None, timeout=30):
+        """执行ADB命令（serial为空时使用当前选择的设备）"""
+        if serial is None and device_specific:
+            serial = self.current_device
+        with TELEMETRY.span('adb_command', serial=serial, command=command) as span:
+            result = None
+            if self.use_native:
+                result = self._run_native(command, serial, timeout)
+                span.set(transport='native')
+            if result is None:
+                result = self._run_subprocess(command, serial, timeout)
+                span.set(transport='subprocess')
+            # 统计传输的字节数而不是解码后的字符数
+            span.add_bytes(len(result.encode('utf-8', 'replace')))
+            if result.startswith("Error"):
+                span.set(status='error', error=result)
+            return result
+
+    def _run_subprocess(self, command, serial, timeout=30):
+        """通过adb进程执行命令"""
+        try:
+            full_command = "adb"
+            if serial:
+                full_command += f" -s {serial}"
+            full_command += f" {command}"
+            
+            result = subprocess.run(full_command, shell=True, capture_output=True, text=True, timeout=timeout)
+            return result.stdout.strip() if result.returncode == 0 else f"Error: {result.stderr.strip()}"
+        except subprocess.TimeoutExpired:
+            return "Error: Command timeout"
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    def _run_native(self, command, serial, timeout=30):
+        """通过ADB主机协议执行命令；不支持的命令或server不可用时返回None"""
+        name, _, args = command.strip().partition(' ')
+        args = args.strip()
+        if self.HOST_SHELL_CHARS & set(args):
+            return None
+        try:
+            if name == 'devices':
+                return self.client.devices(long_format=(args == '-l')).strip()
+            if name == 'get-state' and not args:
+                return self.client.get_state(serial, timeout).strip()
+            if name == 'reboot':
+                self.client.reboot(args, serial, timeout)
+                return ""
+            if name == 'exec-out' and args:
+                return self.client.exec_out(args, serial, timeout).decode('utf-8', 'replace').strip()
+            if name in ('shell', 'logcat') and (args or name == 'logcat'):
+                exit_code, stdout, stderr = self.client.shell(args if name == 'shell' else f"logcat {args}", serial, timeout)
+                if exit_code:
+                    return f"Error: {stderr.decode('utf-8', 'replace').strip()}"
+                return stdout.decode('utf-8', 'replace').strip()
+        except ADBProtocolError as e:
+            return f"Error: {e}"
+        except socket.timeout:
+            return "Error: Command timeout"
+        except ConnectionRefusedError:
+            # adb server未启动时交给adb进程处理（它会自动拉起server）
+            return None
+        except OSError as e:
+            # 请求可能已送达设备，不能再经adb进程重复执行
+            return f"Error: {str(e)}"
+        return None
+
+    def run_shell(self, script, serial=None, timeout=30):
+        """在设备shell中原样执行脚本（不经过宿主shell解析），返回格式与run_adb_command相同"""
+        serial = serial or self.current_device
+        if self.use_native:
+            try:
+                exit_code, stdout, stderr = self.client.shell(script, serial, timeout)
+                if exit_code:
+                    return f"Error: {stderr.decode('utf-8', 'replace').strip()}"
+                return stdout.decode('utf-8', 'replace').strip()
+            except ADBProtocolError as e:
+                return f"Error: {e}"
+            except socket.timeout:
+                return "Error: Command timeout"
+            except ConnectionRefusedError:
+                pass
+            except OSError as e:
+                return f"Error: {str(e)}"
+        args = ["adb"] + (["-s", serial] if serial else []) + ["shell", script]
+        try:
+            result = subprocess.run(args, capture_output=True, text=True, timeout=timeout)
+            return result.stdout.strip() if result.returncode == 0 else f"Error: {result.stderr.strip()}"
+        except subprocess.TimeoutExpired:
+            return "Error: Command timeout"
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    def open_stream(self, command, serial=None, service='shell', writable=False):
+        """打开到设备的长连接数据流（service为shell或exec），用于持续输出或大量数据传输"""
+        serial = serial or self.current_device
+        if self.use_native:
+            try:
+                sock = self.client.open_stream(f"{service}:{command}", serial)
+                sock.settimeout(None)
+                return DeviceStream(sock=sock)
+            except ConnectionRefusedError:
+                pass
+            except (ADBProtocolError, OSError) as e:
+                # 设备不存在、多台设备未指定等错误统一为RuntimeError，由调用方显示错误
+                raise RuntimeError(f"打开数据流失败: {e}") from e
+        adb_service = 'shell' if service == 'shell' else 'exec-out' if not writable else 'exec-in'
+        args = ["adb"] + (["-s", serial] if serial else []) + [adb_service, command]
+        try:
+            process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                       stdin=subprocess.PIPE if writable else subprocess.DEVNULL)
+        except OSError as e:
+            raise RuntimeError(f"启动adb失败: {e}") from e
+        return DeviceStream(process=process)
+
+    def snapshot(self, serial=None, timeout=30):
+        """一次shell调用采集设备全部系统信息并解析为结构化数据"""
+        serial = serial or self.current_device
+        start = time.perf_counter()
+        token = f"@@SNAP{random.randint(100000, 999999)}@@"
+        output = self.run_shell(DeviceSnapshot.build_script(token), serial, timeout)
+        snapshot = DeviceSnapshot.parse(output, token)
+        snapshot['serial'] = serial
+        snapshot['timestamp'] = time.time()
+        snapshot['elapsed'] = time.perf_counter() - start
+        return snapshot
+
+    def snapshot_devices(self, devices=None, max_workers=8, timeout=30):
+        """并行采集多台设备的快照，按设备序列号排序返回"""
+        if devices is None:
+            devices = self.check_devices()
+        if not devices:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(devices)))) as pool:
+            snapshots = list(pool.map(lambda serial: self.snapshot(serial, timeout), devices))
+        return sorted(snapshots, key=lambda snap: snap['serial'] or '')
+
+    def compare_latency(self, command="shell echo ping", rounds=20):
+        """对比原生协议与adb进程两种方式的往返延迟（毫秒），至少测一轮"""
+        serial = self.current_device
+        rounds = max(1, rounds)
+        results = {}
+        for mode, runner in (('native', self._run_native), ('subprocess', self._run_subprocess)):
+            samples = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                output = runner(command, serial)
+                samples.append((time.perf_counter() - start) * 1000)
+                if output is None:
+                    break
+            if output is None:
+                results[mode] = None
+                continue
+            results[mode] = {
+                'mean_ms': statistics.mean(samples),
+                'median_ms': statistics.median(samples),
+                'min_ms': min(samples),
+                'max_ms': max(samples),
+                'rounds': len(samples)
+            }
+        if results.get('native') and results.get('subprocess'):
+            results['speedup'] = results['subprocess']['median_ms'] / max(results['native']['median_ms'], 1e-6)
+        return results
+    
+    def check_devices(self):
+        """检查连接的设备"""
+        output = self.run_adb_command("devices", False)
+        devices = []
+        for line in output.split('\n')[1:]:
+            if line.strip() and '\tdevice' in line:
+                devices.append(line.split('\t')[0])
+        self.connected_devices = devices
+        return devices
+
+    def device_details(self):
+        """解析 devices -l，返回 {序列号: {'usb':..., 'product':..., 'model':..., 'transport': ...}}"""
+        output = self.run_adb_command("devices -l", False)
+        details = {}
+        for line in output.split('\n')[1:]:
+            fields = line.split()
+            if len(fields) < 2 or fields[1] != 'device':
+                continue
+            info = dict(field.split(':', 1) for field in fields[2:] if ':' in field)
+            info['transport'] = 'usb' if 'usb' in info else 'network'
+            details[fields[0]] = info
+        return details
+    
+    def select_device(self):
+        """选择设备"""
+        devices = self.check_devices()
+        if not devices:
+            print("未找到连接的设备")
+            return False
+        
+        print("\n连接的设备:")
+        for i, device in enumerate(devices, 1):
+            print(f"{i}. {device}")
+        
+        try:
+            choice = input("\n选择设备 (输入编号): ").strip()
+            if choice.isdigit() and 1 <= int(choice) <= len(devices):
+                self.current_device = devices[int(choice) - 1]
+                print(f"已选择设备: {self.current_device}")
+                return True
+        except:
+            pass
+        
+        return False
+
+    def iter_fan_out(self, command, devices=None, max_workers=8, timeout=30):
+        """在多台设备上并发执行同一命令，按完成顺序逐个返回结果"""
+        if devices is None:
+            devices = self.check_devices()
+        if not devices:
+            return
+
+        def run_one(serial):
+            start = time.perf_counter()
+            output = self.run_adb_command(command, serial=serial, timeout=timeout)
+            return {
+                'serial': serial,
+                'ok': not output.startswith("Error:"),
+                'output': output,
+                'elapsed': time.perf_counter() - start
+            }
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(devices)))) as pool:
+            futures = {pool.submit(run_one, serial): serial for serial in devices}
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except Exception as e:
+                    yield {'serial': futures[future], 'ok': False, 'output': f"Error: {str(e)}", 'elapsed': 0.0}
+
+    def fan_out(self, command, devices=None, max_workers=8, timeout=30, on_result=None):
+        """批量执行命令并汇总成功/失败情况，on_result在每台设备完成时回调"""
+        start = time.perf_counter()
+        results = []
+        for result in self.iter_fan_out(command, devices, max_workers, timeout):
+            results.append(result)
+            if on_result:
+                on_result(result)
+        succeeded = [r['serial'] for r in results if r['ok']]
+        failed = [r['serial'] for r in results if not r['ok']]
+        return {
+            'command': command,
+            'total': len(results),
+            'succeeded': succeeded,
+            'failed': failed,
+            'results': results,
+            'elapsed': time.perf_counter() - start
+        }
+
+# 设备快照 - 把多条信息命令合并为一个shell脚本，用分隔标记切分输出后分别解析
+class DeviceSnapshot:
+    SECTIONS = (
+        ('props', 'getprop'),
+        ('cpu', 'cat /proc/cpuinfo'),
+        ('memory', 'cat /proc/meminfo'),
+        ('storage', 'df -h'),
+        ('network', 'ifconfig 2>/dev/null || ip addr'),
+        ('screen_size', 'wm size'),
+        ('screen_density', 'wm density'),
+        ('battery', 'dumpsys battery'),
+    )
+
+    @classmethod
+    def build_script(cls, token):
+        """生成采集脚本，每段输出前打印 <token>名称"""
+        script = "; ".join(f"echo {token}{name}; {command}" for name, command in cls.SECTIONS)
+        # 以echo结尾，避免最后一条命令失败时整个快照被当作错误
+        return f"{script}; echo {token}end"
+
+    @classmethod
+    def split_sections(cls, output, token):
+        """按分隔标记切分输出"""
+        sections = {}
+        current = None
+        lines = []
+        for line in output.splitlines():
+            if line.startswith(token):
+                if current:
+                    sections[current] = "\n".join(lines)
+                current = line[len(token):].strip()
+                lines = []
+            elif current:
+                lines.append(line)
+        if current:
+            sections[current] = "\n".join(lines)
+        return sections
+
+    @classmethod
+    def parse(cls, output, token):
+        """解析快照输出，各段缺失时返回空结构"""
+        error = output if output.startswith("Error:") else None
+        sections = {} if error else cls.split_sections(output, token)
+        if not error and not sections:
+            error = "Error: 快照输出无法解析"
+        return {
+            'error': error,
+            'props': cls.parse_props(sections.get('props', '')),
+            'cpu': cls.parse_cpuinfo(sections.get('cpu', '')),
+            'memory': cls.parse_meminfo(sections.get('memory', '')),
+            'storage': cls.parse_df(sections.get('storage', '')),
+            'network': cls.parse_network(sections.get('network', '')),
+            'screen': cls.parse_screen(sections.get('screen_size', ''), sections.get('screen_density', '')),
+            'battery': cls.parse_key_values(sections.get('battery', ''))
+        }
+
+    @staticmethod
+    def parse_props(text):
+        """[key]: [value] -> dict"""
+        props = {}
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith('[') and ']: [' in line and line.endswith(']'):
+                key, _, value = line[1:-1].partition(']: [')
+                props[key] = value
+        return props
+
+    @staticmethod
+    def parse_cpuinfo(text):
+        """按空行分隔的处理器信息块"""
+        processors = []
+        common = {}
+        block = {}
+        for line in text.splitlines() + ['']:
+            if not line.strip():
+                if 'processor' in block:
+                    processors.append(block)
+                elif block:
+                    common.update(block)
+                block = {}
+                continue
+            key, _, value = line.partition(':')
+            block[key.strip()] = value.strip()
+        hardware = common.get('Hardware') or (processors[0].get('model name') or processors[0].get('Processor')
+                                              if processors else None)
+        return {'hardware': hardware, 'cores': len(processors), 'processors': processors, 'info': common}
+
+    @staticmethod
+    def parse_meminfo(text):
+        """MemTotal: 123 kB -> {'MemTotal': 123}（单位kB）"""
+        memory = {}
+        for line in text.splitlines():
+            key, _, value = line.partition(':')
+            parts = value.split()
+            if parts and parts[0].isdigit():
+                memory[key.strip()] = int(parts[0])
+        return memory
+
+    @staticmethod
+    def parse_df(text):
+        """df -h 输出 -> 挂载点列表"""
+        volumes = []
+        for line in text.splitlines()[1:]:
+            parts = line.split()
+            if len(parts) >= 6:
+                volumes.append({
+                    'filesystem': parts[0], 'size': parts[1], 'used': parts[2],
+                    'avail': parts[3], 'use%': parts[4], 'mounted_on': ' '.join(parts[5:])
+                })
+        return volumes
+
+    @staticmethod
+    def parse_network(text):
+        """兼容 ifconfig 与 ip addr 输出，返回 {网卡: [地址...]}"""
+        interfaces = {}
+        current = None
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            if not line[0].isspace():
+                # ifconfig: "wlan0     Link encap..."；ip addr: "3: wlan0: <...>"
+                parts = line.split()
+                name = parts[1] if parts[0].rstrip(':').isdigit() and len(parts) > 1 else parts[0]
+                current = name.rstrip(':').split('@')[0]
+                interfaces.setdefault(current, [])
+                continue
+            parts = line.split()
+            if current and parts and parts[0] in ('inet', 'inet6') and len(parts) > 1:
+                address = parts[1]
+                if address.startswith('addr:'):
+                    address = address[5:]
+                interfaces[current].append(address)
+        return interfaces
+
+    @staticmethod
+    def parse_screen(size_text, density_text):
+        """wm size / wm density，存在Override时以其为准"""
+        screen = {}
+        for text, key in ((size_text, 'size'), (density_text, 'density')):
+            for line in text.splitlines():
+                label, _, value = line.partition(':')
+                value = value.strip()
+                if label.strip().startswith('Physical'):
+                    screen.setdefault(key, value)
+                    screen[f'physical_{key}'] = value
+                elif label.strip().startswith('Override'):
+                    screen[key] = value
+        if 'x' in screen.get('size', ''):
+            width, _, height = screen['size'].partition('x')
+            if width.isdigit() and height.isdigit():
+                screen['width'], screen['height'] = int(width), int(height)
+        return screen
+
+    @staticmethod
+    def parse_key_values(text):
+        """缩进的 key: value 列表（dumpsys battery）"""
+        values = {}
+        for line in text.splitlines():
+            key, sep, value = line.partition(':')
+            if sep and key.startswith(' '):
+                values[key.strip()] = value.strip()
+        return values
+
+# 定长环形缓冲区 - 每个字段一个array('d')，容量固定，写满后覆盖最旧的样本
+class SampleRing:
+    def __init__(self, fields, capacity=3600):
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self.columns = {name: array('d', bytes(8 * capacity)) for name in self.fields}
+        self.count = 0
+        self.next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, values):
+        with self._lock:
+            for name in self.fields:
+                self.columns[name][self.next] = values.get(name, 0.0)
+            self.next = (self.next + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def rows(self):
+        """按时间顺序返回全部样本"""
+        with self._lock:
+            start = (self.next - self.count) % self.capacity
+            indexes = [(start + i) % self.capacity for i in range(self.count)]
+            return [{name: self.columns[name][i] for name in self.fields} for i in indexes]
+
+    def latest(self):
+        with self._lock:
+            if not self.count:
+                return None
+            i = (self.next - 1) % self.capacity
+            return {name: self.columns[name][i] for name in self.fields}
+
+# 设备性能采样器 - 每台设备保持一个shell会话持续输出 /proc 数据，CPU占用在主机端按差值计算
+class PerformanceSampler:
+    FIELDS = ('timestamp', 'uptime', 'cpu_percent', 'cpu_user', 'cpu_system', 'cpu_iowait',
+              'mem_total_kb', 'mem_available_kb', 'mem_used_percent', 'swap_used_kb')
+    MARK = '@@PERF'
+
+    def __init__(self, adb_manager, serial, interval=1.0, capacity=3600, process_every=5, top_n=10):
+        self.adb_manager = adb_manager
+        self.serial = serial
+        self.interval = interval
+        self.process_every = max(1, process_every)
+        self.top_n = top_n
+        self.ring = SampleRing(self.FIELDS, capacity)
+        self.core_percent = []
+        self.top_processes = []
+        self.error = None
+        self._stream = None
+        self._thread = None
+        self._running = False
+        self._last_cpu = None
+        self._last_cores = {}
+        self._last_procs = {}
+        self._last_proc_total = None
+
+    def build_script(self):
+        """设备端循环脚本：每轮输出 uptime、/proc/stat 的cpu行、meminfo，按需附带所有进程的stat"""
+        m = self.MARK
+        return (f"i=0; while true; do echo {m}S; cat /proc/uptime; grep ^cpu /proc/stat; cat /proc/meminfo; "
+                f"if [ $((i % {self.process_every})) -eq 0 ]; then echo {m}P; cat /proc/[0-9]*/stat 2>/dev/null; fi; "
+                f"echo {m}E; i=$((i+1)); sleep {self.interval}; done")
+
+    def start(self):
+        self._stream = self.adb_manager.open_stream(self.build_script(), self.serial)
+        self._running = True
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._stream:
+            self._stream.close()
+        if self._thread:
+            self._thread.join(2)
+
+    def _read_loop(self):
+        block = []
+        try:
+            for raw in self._stream:
+                line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+                if line == f"{self.MARK}S":
+                    block = []
+                elif line == f"{self.MARK}E":
+                    self._process_block(block)
+                else:
+                    block.append(line)
+        except (OSError, ValueError) as e:
+            if self._running:
+                self.error = str(e)
+        if self._running and not self.error:
+            self.error = "shell会话已结束"
+
+    @staticmethod
+    def _cpu_times(parts):
+        values = [int(v) for v in parts[1:9]]
+        values += [0] * (8 - len(values))
+        user, nice, system, idle, iowait, irq, softirq, steal = values
+        return {'total': sum(values), 'idle': idle + iowait, 'user': user + nice,
+                'system': system + irq + softirq, 'iowait': iowait}
+
+    def _process_block(self, lines):
+        sample = {'timestamp': time.time()}
+        cpu = None
+        memory = {}
+        cores = {}
+        procs = None
+        in_procs = False
+        for line in lines:
+            if line == f"{self.MARK}P":
+                in_procs = True
+                procs = {}
+                continue
+            if in_procs:
+                # pid (comm) state ppid ... utime(14) stime(15)
+                head, _, tail = line.rpartition(')')
+                pid, _, comm = head.partition(' (')
+                fields = tail.split()
+                if pid.strip().isdigit() and len(fields) > 12:
+                    procs[int(pid)] = (comm, int(fields[11]) + int(fields[12]))
+                continue
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == 'cpu':
+                cpu = self._cpu_times(parts)
+            elif parts[0].startswith('cpu') and parts[0][3:].isdigit():
+                cores[parts[0]] = self._cpu_times(parts)
+            elif parts[0].endswith(':') and len(parts) >= 2 and parts[1].isdigit():
+                memory[parts[0][:-1]] = int(parts[1])
+            elif 'uptime' not in sample and len(parts) == 2:
+                try:
+                    sample['uptime'] = float(parts[0])
+                except ValueError:
+                    pass
+
+        if cpu is None:
+            return
+        last = self._last_cpu
+        if last:
+            delta_total = max(cpu['total'] - last['total'], 1)
+            sample['cpu_percent'] = 100.0 * (delta_total - (cpu['idle'] - last['idle'])) / delta_total
+            sample['cpu_user'] = 100.0 * (cpu['user'] - last['user']) / delta_total
+            sample['cpu_system'] = 100.0 * (cpu['system'] - last['system']) / delta_total
+            sample['cpu_iowait'] = 100.0 * (cpu['iowait'] - last['iowait']) / delta_total
+            self.core_percent = []
+            for name in sorted(cores, key=lambda n: int(n[3:])):
+                prev = self._last_cores.get(name)
+                if prev:
+                    core_total = max(cores[name]['total'] - prev['total'], 1)
+                    self.core_percent.append(100.0 * (core_total - (cores[name]['idle'] - prev['idle'])) / core_total)
+        self._last_cpu = cpu
+        self._last_cores = cores
+
+        if procs is not None:
+            if self._last_proc_total is not None:
+                delta_total = max(cpu['total'] - self._last_proc_total, 1)
+                usage = []
+                for pid, (comm, ticks) in procs.items():
+                    prev = self._last_procs.get(pid)
+                    if prev and ticks >= prev[1]:
+                        usage.append((100.0 * (ticks - prev[1]) / delta_total, pid, comm))
+                usage.sort(reverse=True)
+                self.top_processes = [{'pid': pid, 'name': comm, 'cpu_percent': pct}
+                                      for pct, pid, comm in usage[:self.top_n]]
+            self._last_procs = procs
+            self._last_proc_total = cpu['total']
+
+        total = memory.get('MemTotal', 0)
+        available = memory.get('MemAvailable', memory.get('MemFree', 0))
+        sample['mem_total_kb'] = total
+        sample['mem_available_kb'] = available
+        sample['mem_used_percent'] = 100.0 * (total - available) / total if total else 0.0
+        sample['swap_used_kb'] = memory.get('SwapTotal', 0) - memory.get('SwapFree', 0)
+        if last:
+            self.ring.append(sample)
+
+    def export_csv(self, file_path):
+        rows = self.ring.rows()
+        with open(file_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=('serial',) + self.FIELDS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(dict(row, serial=self.serial))
+        return len(rows)
+
+    def export_json(self, file_path):
+        rows = self.ring.rows()
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump({'serial': self.serial, 'interval': self.interval, 'samples': rows,
+                       'top_processes': self.top_processes}, f, ensure_ascii=False)
+        return len(rows)
+
+# logcat过滤条件 - 标签白名单、最低优先级、正则（匹配标签或消息）
+class LogcatFilter:
+    PRIORITIES = 'VDIWEF'
+
+    def __init__(self, tags=None, min_priority='V', pattern=None):
+        self.tags = set(tags) if tags else None
+        self.min_level = self.PRIORITIES.find(min_priority.upper()) if min_priority else 0
+        self.min_level = max(self.min_level, 0)
+        self.pattern = re.compile(pattern) if pattern else None
+
+    def match(self, record):
+        if self.tags is not None and record['tag'] not in self.tags:
+            return False
+        if self.min_level and self.PRIORITIES.find(record['priority']) < self.min_level:
+            return False
+        if self.pattern and not (self.pattern.search(record['message']) or self.pattern.search(record['tag'])):
+            return False
+        return True
+
+# 按大小轮转的压缩日志文件（gzip，安装zstandard时可选zstd）
+class RotatingLogWriter:
+    def __init__(self, directory, prefix, max_bytes=64 * 1024 * 1024, keep=10, compression='gzip'):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.compression = 'zstd' if compression == 'zstd' and zstandard is not None else 'gzip'
+        self.files = []
+        self._raw = None
+        self._out = None
+        self._written = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _open(self):
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        suffix = '.log.zst' if self.compression == 'zstd' else '.log.gz'
+        path = self.directory / f"{self.prefix}_{stamp}_{len(self.files):03d}{suffix}"
+        if self.compression == 'zstd':
+            self._raw = open(path, 'wb')
+            self._out = zstandard.ZstdCompressor(level=3).stream_writer(self._raw)
+        else:
+            self._raw = None
+            self._out = gzip.open(path, 'wb', compresslevel=5)
+        self._written = 0
+        self.files.append(path)
+        # 只保留最近 keep 个文件
+        while len(self.files) > self.keep:
+            try:
+                os.remove(self.files.pop(0))
+            except OSError:
+                pass
+
+    def write(self, data):
+        if self._out is None or self._written >= self.max_bytes:
+            self.close()
+            self._open()
+        self._out.write(data)
+        self._written += len(data)
+
+    def close(self):
+        if self._out is not None:
+            self._out.close()
+            if self._raw is not None:
+                self._raw.close()
+            self._out = None
+
+# logcat采集管线 - 读取线程解析和过滤，写文件线程负责压缩，两者通过无界队列解耦以免丢行
+class LogcatCapture:
+    LINE_RE = re.compile(r'^(\d\d-\d\d) (\d\d:\d\d:\d\d\.\d+)\s+(\d+)\s+(\d+) ([VDIWEFS]) (.*?)\s*: (.*)$')
+
+    def __init__(self, adb_manager, serial, log_filter=None, ring_size=5000, output_dir="logs",
+                 max_bytes=64 * 1024 * 1024, keep=10, compression='gzip', buffers=None):
+        self.adb_manager = adb_manager
+        self.serial = serial
+        self.filter = log_filter or LogcatFilter()
+        self.ring = deque(maxlen=ring_size)
+        self.buffers = buffers
+        self.writer = RotatingLogWriter(Path(output_dir) / serial.replace(':', '_'), "logcat",
+                                        max_bytes, keep, compression) if output_dir else None
+        self.stats = {'lines': 0, 'accepted': 0, 'bytes': 0, 'started': None}
+        self.sequence = 0
+        self.error = None
+        # 读取线程更新stats与ring，界面线程读取；按批加锁
+        self._lock = threading.Lock()
+        self._queue = queue.SimpleQueue()
+        self._stream = None
+        self._threads = []
+        self._running = False
+
+    @classmethod
+    def parse_line(cls, line):
+        """解析 threadtime 格式的一行，无法识别的行返回None"""
+        m = cls.LINE_RE.match(line)
+        if not m:
+            return None
+        date, clock, pid, tid, priority, tag, message = m.groups()
+        return {'time': f"{date} {clock}", 'pid': int(pid), 'tid': int(tid),
+                'priority': priority, 'tag': tag, 'message': message}
+
+    def start(self):
+        command = "logcat -v threadtime"
+        if self.buffers:
+            command += "".join(f" -b {b}" for b in self.buffers)
+        self._stream = self.adb_manager.open_stream(command, self.serial)
+        self._running = True
+        self.stats['started'] = time.time()
+        self._threads = [threading.Thread(target=self._read_loop, daemon=True)]
+        if self.writer:
+            self._threads.append(threading.Thread(target=self._write_loop, daemon=True))
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        self._running = False
+        if self._stream:
+            self._stream.close()
+        for t in self._threads:
+            t.join(5)
+        if self.writer:
+            self.writer.close()
+
+    def _read_loop(self):
+        pending = b''
+        try:
+            while True:
+                data = self._stream.read1(256 * 1024)
+                if not data:
+                    break
+                with self._lock:
+                    self.stats['bytes'] += len(data)
+                lines = (pending + data).split(b'\n')
+                pending = lines.pop()
+                self._handle_lines(lines)
+        except (OSError, ValueError) as e:
+            if self._running:
+                self.error = str(e)
+        finally:
+            if pending:
+                self._handle_lines([pending])
+            self._queue.put(None)
+
+    def _handle_lines(self, lines):
+        accepted, records = [], []
+        for raw in lines:
+            line = raw.rstrip(b'\r').decode('utf-8', 'replace')
+            record = self.parse_line(line)
+            if record is None or not self.filter.match(record):
+                continue
+            records.append(record)
+            accepted.append(raw.rstrip(b'\r'))
+        with self._lock:
+            self.stats['lines'] += len(lines)
+            self.stats['accepted'] += len(accepted)
+            for record in records:
+                self.sequence += 1
+                self.ring.append((self.sequence, record))
+        if accepted and self.writer:
+            self._queue.put(b'\n'.join(accepted) + b'\n')
+
+    def _write_loop(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            self.writer.write(data)
+
+    def tail(self, after_sequence=0, limit=50):
+        """返回序号大于after_sequence的最近记录"""
+        with self._lock:
+            ring = list(self.ring)
+        records = [item for item in ring if item[0] > after_sequence]
+        return records[-limit:]
+
+    def snapshot_stats(self):
+        """读取线程仍在运行时取得一致的统计副本"""
+        with self._lock:
+            return dict(self.stats)
+
+    def rate(self):
+        """平均每秒读取的行数"""
+        stats = self.snapshot_stats()
+        if not stats['started']:
+            return 0.0
+        elapsed = time.time() - stats['started']
+        return stats['lines'] / elapsed if elapsed > 0 else 0.0
+
+# 设备应用清单 - 一次shell调用取得全部包（路径、UID、安装来源、versionCode、系统/停用标记），
+# 按包名排序建立索引；dumpsys package 只在查看详情时解析并缓存
+class PackageInventory:
+    MAX_AGE = 300
+    LIST_SCRIPT = ("echo {token}all; "
+                   "pm list packages -f -U -i --show-versioncode 2>/dev/null || pm list packages -f -U -i; "
+                   "echo {token}system; pm list packages -s; "
+                   "echo {token}disabled; pm list packages -d; "
+                   "echo {token}end")
+
+    def __init__(self, adb_manager, serial=None, max_age=None):
+        self.adb_manager = adb_manager
+        self.serial = serial
+        self.max_age = self.MAX_AGE if max_age is None else max_age
+        self.packages = {}
+        self.names = []
+        self.loaded_at = None
+        self.stats = {'refreshes': 0, 'added': 0, 'removed': 0, 'changed': 0}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def parse_list_line(line):
+        """解析 package:<apk路径>=<包名> versionCode:N uid:N installer=X"""
+        line = line.strip()
+        if not line.startswith("package:"):
+            return None
+        tokens = line[len("package:"):].split()
+        if not tokens:
+            return None
+        # apk路径中可能含有'='（如 /data/app/~~AbC==/），包名不会含有
+        path, _, name = tokens[0].rpartition('=')
+        record = {'name': name, 'path': path or None, 'uid': None, 'installer': None,
+                  'version_code': None, 'system': False, 'disabled': False}
+        for token in tokens[1:]:
+            if token.startswith("versionCode:"):
+                record['version_code'] = int(token[12:]) if token[12:].isdigit() else None
+            elif token.startswith("uid:"):
+                record['uid'] = int(token[4:]) if token[4:].isdigit() else None
+            elif token.startswith("installer="):
+                installer = token[10:]
+                record['installer'] = None if installer == 'null' else installer
+        return record
+
+    @classmethod
+    def parse_listing(cls, output, token):
+        """按分隔标记切分一次调用的输出，返回 {包名: 记录}"""
+        sections = {}
+        current = None
+        for line in output.splitlines():
+            line = line.strip()
+            if line.startswith(token):
+                current = line[len(token):]
+                sections[current] = []
+            elif current is not None and line:
+                sections[current].append(line)
+        packages = {}
+        for line in sections.get('all', []):
+            record = cls.parse_list_line(line)
+            if record:
+                packages[record['name']] = record
+        for key in ('system', 'disabled'):
+            for line in sections.get(key, []):
+                name = line[len("package:"):].strip() if line.startswith("package:") else None
+                if name in packages:
+                    packages[name][key] = True
+        return packages
+
+    def refresh(self):
+        """重新获取清单并与缓存比较：未变化的包保留已解析的详情，只在包名集合变化时重建索引"""
+        token = f"@@PKG{random.randint(100000, 999999)}@@"
+        output = self.adb_manager.run_shell(self.LIST_SCRIPT.format(token=token), self.serial, timeout=60)
+        if output.startswith("Error"):
+            raise RuntimeError(output)
+        fresh = self.parse_listing(output, token)
+        with self._lock:
+            old = self.packages
+            added = [name for name in fresh if name not in old]
+            removed = [name for name in old if name not in fresh]
+            changed = 0
+            for name, record in fresh.items():
+                previous = old.get(name)
+                if previous is None:
+                    continue
+                if all(previous[k] == record[k] for k in record):
+                    fresh[name] = previous
+                else:
+                    changed += 1
+            self.packages = fresh
+            if added or removed or not self.names:
+                self.names = sorted(fresh)
+            self.loaded_at = time.monotonic()
+            self.stats['refreshes'] += 1
+            self.stats['added'] += len(added) if old else 0
+            self.stats['removed'] += len(removed)
+            self.stats['changed'] += changed
+        return {'added': added if old else [], 'removed': removed, 'changed': changed, 'total': len(fresh)}
+
+    def load(self, force=False):
+        """缓存未过期时直接使用，否则刷新"""
+        if force or self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age:
+            self.refresh()
+        return self.packages
+
+    def select(self, kind='all'):
+        """按包名排序返回 all / system / third_party / disabled 记录"""
+        packages = self.load()
+        records = [packages[name] for name in self.names]
+        if kind == 'system':
+            return [r for r in records if r['system']]
+        if kind == 'third_party':
+            return [r for r in records if not r['system']]
+        if kind == 'disabled':
+            return [r for r in records if r['disabled']]
+        return records
+
+    def search(self, text, limit=None):
+        """前缀匹配（二分查找）在前，其余包含该子串的包名在后"""
+        self.load()
+        text = text.strip()
+        if not text:
+            return []
+        names = self.names
+        start = bisect.bisect_left(names, text)
+        prefix = []
+        for name in names[start:]:
+            if not name.startswith(text):
+                break
+            prefix.append(name)
+        seen = set(prefix)
+        lowered = text.lower()
+        substring = [name for name in names if lowered in name.lower() and name not in seen]
+        result = [self.packages[name] for name in prefix + substring]
+        return result[:limit] if limit else result
+
+    def get(self, name):
+        return self.load().get(name)
+
+    def invalidate(self):
+        """安装/卸载后调用，下次访问时增量刷新"""
+        self.loaded_at = None
+
+    @staticmethod
+    def parse_dumpsys(output, name):
+        """解析 dumpsys package 输出中该包的段落：键值字段、权限和各用户状态"""
+        lines = output.splitlines()
+        header = f"Package [{name}]"
+        start = next((i for i, line in enumerate(lines) if line.strip().startswith(header)), None)
+        if start is None:
+            return None
+        base_indent = len(lines[start]) - len(lines[start].lstrip())
+        fields = {}
+        permissions = {'requested': [], 'install': {}, 'runtime': {}}
+        users = {}
+        section, section_indent = None, 0
+        for line in lines[start + 1:]:
+            stripped = line.strip()
+            if not stripped:
+                continue
+            indent = len(line) - len(line.lstrip())
+            if indent <= base_indent:
+                break
+            if section and indent > section_indent:
+                perm, _, state = stripped.partition(':')
+                if section == 'requested':
+                    permissions['requested'].append(perm)
+                else:
+                    permissions[section][perm] = 'granted=true' in state
+                continue
+            section = None
+            if stripped.endswith("permissions:"):
+                kind = stripped.split()[0]
+                if kind in permissions:
+                    section, section_indent = kind, indent
+                continue
+            if stripped.startswith("User ") and ':' in stripped:
+                user, _, rest = stripped[5:].partition(':')
+                users[user.strip()] = dict(re.findall(r'(\w+)=(\S+)', rest))
+                continue
+            pairs = re.findall(r'(\w+)=', stripped)
+            if len(pairs) == 1 and stripped.startswith(pairs[0] + '='):
+                key, _, value = stripped.partition('=')
+                fields.setdefault(key, value)
+            else:
+                for key, value in re.findall(r'(\w+)=(\S+)', stripped):
+                    fields.setdefault(key, value)
+        return {'fields': fields, 'permissions': permissions, 'users': users}
+
+    def details(self, name, force=False):
+        """查看详情时才执行 dumpsys package，结果缓存在记录中直到包发生变化"""
+        record = self.get(name)
+        if record is not None and record.get('details') and not force:
+            return record['details']
+        output = self.adb_manager.run_adb_command(f"shell dumpsys package {name}", serial=self.serial, timeout=60)
+        if output.startswith("Error"):
+            raise RuntimeError(output)
+        details = self.parse_dumpsys(output, name)
+        if details is not None and record is not None:
+            record['details'] = details
+        return details
+
+# 二进制AndroidManifest.xml (AXML) 最小解析：只读取<manifest>根元素的属性
+AXML_ATTR_IDS = {0x0101021b: 'versionCode', 0x0101021c: 'versionName'}
+
+def _axml_strings(data, offset):
+    """解析字符串池（支持UTF-8与UTF-16）"""
+    _, header_size, _, count, _, flags, strings_start, _ = struct.unpack_from('<HHIIIIII', data, offset)
+    utf8 = bool(flags & 0x100)
+    offsets = struct.unpack_from(f'<{count}I', data, offset + header_size)
+    base = offset + strings_start
+    strings = []
+    for start in offsets:
+        pos = base + start
+        if utf8:
+            # 先是字符数，再是字节数，各占1或2字节
+            pos += 2 if data[pos] & 0x80 else 1
+            length = data[pos]
+            if length & 0x80:
+                length = ((length & 0x7f) << 8) | data[pos + 1]
+                pos += 1
+            pos += 1
+            strings.append(data[pos:pos + length].decode('utf-8', 'replace'))
+        else:
+            length, = struct.unpack_from('<H', data, pos)
+            pos += 2
+            if length & 0x8000:
+                low, = struct.unpack_from('<H', data, pos)
+                length = ((length & 0x7fff) << 16) | low
+                pos += 2
+            strings.append(data[pos:pos + length * 2].decode('utf-16-le', 'replace'))
+    return strings
+
+def parse_axml_manifest(data):
+    """返回<manifest>元素的属性字典，如 package / versionCode / versionName / split"""
+    if len(data) < 8 or struct.unpack_from('<H', data, 0)[0] != 0x0003:
+        raise ValueError("不是二进制AndroidManifest.xml")
+    offset = struct.unpack_from('<H', data, 2)[0]
+    strings, resource_ids = [], []
+    while offset + 8 <= len(data):
+        chunk_type, header_size, chunk_size = struct.unpack_from('<HHI', data, offset)
+        if chunk_size < 8:
+            break
+        if chunk_type == 0x0001:
+            strings = _axml_strings(data, offset)
+        elif chunk_type == 0x0180:
+            resource_ids = struct.unpack_from(f'<{(chunk_size - header_size) // 4}I', data, offset + header_size)
+        elif chunk_type == 0x0102:
+            name_index, attr_start, attr_size, attr_count = struct.unpack_from('<4xIHHH', data, offset + 16)
+            if strings[name_index] != 'manifest':
+                break
+            attrs = {}
+            pos = offset + header_size + attr_start
+            for _ in range(attr_count):
+                _, name, raw, _, _, data_type, value = struct.unpack_from('<IIIHBBI', data, pos)
+                key = strings[name] if name < len(strings) else ''
+                if not key and name < len(resource_ids):
+                    key = AXML_ATTR_IDS.get(resource_ids[name], '')
+                if key:
+                    if raw != 0xffffffff:
+                        attrs[key] = strings[raw]
+                    elif data_type == 0x03:
+                        attrs[key] = strings[value]
+                    else:
+                        attrs[key] = value
+                pos += attr_size
+            return attrs
+        offset += chunk_size
+    raise ValueError("AndroidManifest.xml中没有manifest元素")
+
+def read_apk_info(apk_path):
+    """读取APK的包名、versionCode、versionName和split名称"""
+    with zipfile.ZipFile(apk_path) as apk:
+        attrs = parse_axml_manifest(apk.read('AndroidManifest.xml'))
+    version_code = attrs.get('versionCode')
+    if isinstance(version_code, str):
+        version_code = int(version_code) if version_code.isdigit() else None
+    return {'path': str(apk_path), 'package': attrs.get('package'), 'version_code': version_code,
+            'version_name': attrs.get('versionName'), 'split': attrs.get('split'),
+            'size': os.path.getsize(apk_path)}
+
+# 批量安装 - 按包名合并split APK为install-multiple，多设备并行，同一USB集线器上限制并发
+class BulkInstaller:
+    HUB_CONCURRENCY = 2
+
+    def __init__(self, adb_manager, hub_concurrency=None, timeout=300, inventories=None):
+        self.adb_manager = adb_manager
+        self.hub_concurrency = hub_concurrency or self.HUB_CONCURRENCY
+        self.timeout = timeout
+        # 与应用管理菜单共用的 {序列号: PackageInventory}
+        self.inventories = inventories if inventories is not None else {}
+        self._hub_locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def collect(source):
+        """source为APK目录（递归）或JSON清单，返回按包名分组的安装单元"""
+        source = Path(source)
+        groups = []
+        if source.suffix == '.json':
+            with open(source, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if isinstance(manifest, dict):
+                if not isinstance(manifest.get('apps'), list):
+                    raise ValueError(f"{source}: 清单需要是APK列表，或包含 \"apps\" 列表的对象")
+                entries = manifest['apps']
+            elif isinstance(manifest, list):
+                entries = manifest
+            else:
+                raise ValueError(f"{source}: 清单需要是APK列表，或包含 \"apps\" 列表的对象")
+            for i, entry in enumerate(entries, 1):
+                apks = entry.get('apks') if isinstance(entry, dict) else [entry]
+                if not isinstance(apks, list) or not apks or not all(isinstance(apk, str) and apk for apk in apks):
+                    raise ValueError(f"{source}: 第 {i} 项需要是APK路径，或包含非空 \"apks\" 路径列表的对象")
+                groups.append([source.parent / apk for apk in apks])
+            infos = [[read_apk_info(apk) for apk in group] for group in groups]
+        else:
+            by_package = {}
+            for apk in sorted(source.rglob("*.apk")):
+                info = read_apk_info(apk)
+                by_package.setdefault((info['package'], info['version_code']), []).append(info)
+            infos = list(by_package.values())
+        units = []
+        for group in infos:
+            base = [info for info in group if not info['split']]
+            if len(base) != 1:
+                raise ValueError(f"{group[0]['package']}: 需要且只能有一个基础APK（找到 {len(base)} 个）")
+            base = base[0]
+            splits = [info for info in group if info['split']]
+            units.append({'package': base['package'], 'version_code': base['version_code'],
+                          'version_name': base['version_name'], 'apks': [base] + splits,
+                          'size': sum(info['size'] for info in group)})
+        return units
+
+    @staticmethod
+    def hub_of(device):
+        """根据 devices -l 的usb路径推断所在集线器（去掉最后一级端口）"""
+        usb = device.get('usb')
+        if not usb:
+            return device.get('transport', 'network')
+        bus, _, ports = usb.partition('-')
+        return f"{bus}-{ports.rsplit('.', 1)[0]}" if '.' in ports else bus
+
+    def _hub_lock(self, hub):
+        with self._lock:
+            if hub not in self._hub_locks:
+                self._hub_locks[hub] = threading.Semaphore(self.hub_concurrency)
+            return self._hub_locks[hub]
+
+    def _inventory(self, serial):
+        with self._lock:
+            if serial not in self.inventories:
+                self.inventories[serial] = PackageInventory(self.adb_manager, serial)
+            return self.inventories[serial]
+
+    def install_device(self, serial, hub, units, on_result=None):
+        """在一台设备上依次安装各单元，跳过已安装相同或更高versionCode的应用"""
+        inventory = self._inventory(serial)
+        try:
+            installed = inventory.load(force=True)
+        except RuntimeError as e:
+            installed = {}
+            if on_result:
+                on_result({'serial': serial, 'package': None, 'status': 'warning', 'output': str(e)})
+        results = []
+        for unit in units:
+            current = installed.get(unit['package'])
+            if current and current['version_code'] is not None and unit['version_code'] is not None \
+                    and current['version_code'] >= unit['version_code']:
+                result = {'serial': serial, 'package': unit['package'], 'status': 'skipped', 'bytes': 0,
+                          'seconds': 0.0, 'output': f"已安装 versionCode {current['version_code']}"}
+            else:
+                paths = " ".join(f"\"{info['path']}\"" for info in unit['apks'])
+                command = f"install-multiple -r {paths}" if len(unit['apks']) > 1 else f"install -r {paths}"
+                with self._hub_lock(hub):
+                    start = time.perf_counter()
+                    output = self.adb_manager.run_adb_command(command, serial=serial, timeout=self.timeout)
+                    seconds = time.perf_counter() - start
+                ok = not output.startswith("Error") and "Failure" not in output
+                result = {'serial': serial, 'package': unit['package'], 'status': 'installed' if ok else 'failed',
+                          'bytes': unit['size'] if ok else 0, 'seconds': seconds,
+                          'output': output.strip().splitlines()[-1] if output.strip() else ''}
+            results.append(result)
+            if on_result:
+                on_result(result)
+        inventory.invalidate()
+        return results
+
+    def install(self, units, devices, on_result=None):
+        """devices为 {序列号: devices -l 信息}，所有设备并行安装，返回汇总"""
+        start = time.perf_counter()
+        results = []
+        with ThreadPoolExecutor(max_workers=max(1, len(devices))) as pool:
+            futures = {pool.submit(self.install_device, serial, self.hub_of(info), units, on_result): serial
+                       for serial, info in devices.items()}
+            for future in as_completed(futures):
+                try:
+                    results.extend(future.result())
+                except Exception as e:
+                    results.append({'serial': futures[future], 'package': None, 'status': 'failed',
+                                    'bytes': 0, 'seconds': 0.0, 'output': f"Error: {str(e)}"})
+        elapsed = time.perf_counter() - start
+        installed = [r for r in results if r['status'] == 'installed']
+        total_bytes = sum(r['bytes'] for r in installed)
+        return {
+            'results': results,
+            'installed': len(installed),
+            'skipped': sum(1 for r in results if r['status'] == 'skipped'),
+            'failed': [r for r in results if r['status'] == 'failed'],
+            'bytes': total_bytes,
+            'elapsed': elapsed,
+            'mb_per_s': total_bytes / 1024 / 1024 / elapsed if elapsed > 0 else 0.0,
+            'hubs': sorted({self.hub_of(info) for info in devices.values()})
+        }
+
+# 目录同步 - 按大小/修改时间比对，时间不同时再用设备端md5sum批量确认；
+# 小文件打包成一个tar流经exec写入设备，大文件单独adb push，可选删除设备上多余的文件
+class DirectorySync:
+    SMALL_FILE_LIMIT = 1024 * 1024
+    # 单条shell命令携带的文件数，避免超出设备端命令行长度限制
+    BATCH_SIZE = 200
+
+    def __init__(self, adb_manager, serial=None, small_file_limit=None, timeout=300):
+        self.adb_manager = adb_manager
+        self.serial = serial or adb_manager.current_device
+        self.small_file_limit = small_file_limit or self.SMALL_FILE_LIMIT
+        self.timeout = timeout
+
+    @staticmethod
+    def local_listing(root):
+        """{相对路径: {'path', 'size', 'mtime'}}，相对路径使用/分隔"""
+        root = Path(root)
+        listing = {}
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                path = Path(dirpath) / name
+                st = path.stat()
+                listing[path.relative_to(root).as_posix()] = {'path': path, 'size': st.st_size,
+                                                                'mtime': int(st.st_mtime)}
+        return listing
+
+    def remote_listing(self, remote_root):
+        """一次shell调用列出设备目录下所有文件的大小和修改时间；目录不存在时返回空"""
+        script = (f"cd {shlex.quote(remote_root)} 2>/dev/null || exit 0; "
+                  f"find . -type f -exec stat -c '%s %Y %n' {{}} +")
+        output = self.adb_manager.run_shell(script, self.serial, self.timeout)
+        if output.startswith("Error"):
+            raise RuntimeError(output)
+        listing = {}
+        for line in output.splitlines():
+            size, _, rest = line.partition(' ')
+            mtime, _, name = rest.partition(' ')
+            if size.isdigit() and mtime.isdigit() and name.startswith('./'):
+                listing[name[2:]] = {'size': int(size), 'mtime': int(mtime)}
+        return listing
+
+    def remote_md5(self, remote_root, names):
+        """分批在设备上计算md5，返回 {相对路径: md5}"""
+        digests = {}
+        for i in range(0, len(names), self.BATCH_SIZE):
+            batch = " ".join(shlex.quote(name) for name in names[i:i + self.BATCH_SIZE])
+            output = self.adb_manager.run_shell(f"cd {shlex.quote(remote_root)} && md5sum {batch}",
+                                                self.serial, self.timeout)
+            if output.startswith("Error"):
+                continue
+            for line in output.splitlines():
+                digest, _, name = line.partition('  ')
+                if len(digest) == 32:
+                    digests[name] = digest
+        return digests
+
+    def plan(self, local_root, remote_root, delete=False):
+        """比较本地与设备目录，返回需要推送/删除的文件清单"""
+        local = self.local_listing(local_root)
+        remote = self.remote_listing(remote_root)
+        changed, suspect = [], []
+        for name, info in local.items():
+            other = remote.get(name)
+            if other is None or other['size'] != info['size']:
+                changed.append(name)
+            elif other['mtime'] != info['mtime']:
+                suspect.append(name)
+        hashed = 0
+        if suspect:
+            remote_digests = self.remote_md5(remote_root, suspect)
+            local_digests = FirmwareHasher(('md5',), chunk_size=1024 * 1024).hash_files(
+                [local[name]['path'] for name in suspect])
+            for name in suspect:
+                local_digest = local_digests[str(local[name]['path'])].get('md5')
+                if local_digest is None or remote_digests.get(name) != local_digest:
+                    changed.append(name)
+            hashed = len(suspect)
+        changed.sort()
+        return {
+            'local_root': str(local_root),
+            'remote_root': remote_root,
+            'local': local,
+            'small': [name for name in changed if local[name]['size'] <= self.small_file_limit],
+            'large': [name for name in changed if local[name]['size'] > self.small_file_limit],
+            'delete': sorted(set(remote) - set(local)) if delete else [],
+            'unchanged': len(local) - len(changed),
+            'hashed': hashed
+        }
+
+    def _push_tar(self, plan, names):
+        """把多个小文件写成一个tar流，经exec在设备上直接解包"""
+        remote_root = shlex.quote(plan['remote_root'])
+        stream = self.adb_manager.open_stream(f"mkdir -p {remote_root} && tar -x -f - -C {remote_root}",
+                                              self.serial, service='exec', writable=True)
+
+        def reset_owner(info):
+            info.uid = info.gid = 0
+            info.uname = info.gname = ''
+            return info
+
+        try:
+            with tarfile.open(fileobj=stream, mode='w|', format=tarfile.GNU_FORMAT) as tar:
+                for name in names:
+                    tar.add(plan['local'][name]['path'], arcname=name, recursive=False, filter=reset_owner)
+            stream.close_write()
+            output = stream.read().decode('utf-8', 'replace').strip()
+        finally:
+            stream.close()
+        return output
+
+    def _push_file(self, plan, name):
+        remote = f"{plan['remote_root'].rstrip('/')}/{name}"
+        return self.adb_manager.run_adb_command(f"push \"{plan['local'][name]['path']}\" \"{remote}\"",
+                                                serial=self.serial, timeout=self.timeout)
+
+    def _delete(self, plan):
+        errors = []
+        names = plan['delete']
+        for i in range(0, len(names), self.BATCH_SIZE):
+            batch = " ".join(shlex.quote(name) for name in names[i:i + self.BATCH_SIZE])
+            output = self.adb_manager.run_shell(f"cd {shlex.quote(plan['remote_root'])} && rm -f {batch}",
+                                                self.serial, self.timeout)
+            if output.startswith("Error"):
+                errors.append(output)
+        return errors
+
+    def run(self, plan, on_progress=None):
+        """执行同步计划，返回传输字节数、耗时与错误"""
+        start = time.perf_counter()
+        errors = []
+        sent = 0
+        if plan['small']:
+            output = self._push_tar(plan, plan['small'])
+            if output:
+                errors.append(output)
+            sent += sum(plan['local'][name]['size'] for name in plan['small'])
+            if on_progress:
+                on_progress(f"tar: {len(plan['small'])} 个小文件")
+        for name in plan['large']:
+            output = self._push_file(plan, name)
+            if output.startswith("Error"):
+                errors.append(f"{name}: {output}")
+            else:
+                sent += plan['local'][name]['size']
+            if on_progress:
+                on_progress(name)
+        if plan['delete']:
+            errors.extend(self._delete(plan))
+        elapsed = time.perf_counter() - start
+        return {
+            'pushed': len(plan['small']) + len(plan['large']),
+            'deleted': len(plan['delete']),
+            'bytes': sent,
+            'elapsed': elapsed,
+            'mb_per_s': sent / 1024 / 1024 / elapsed if elapsed > 0 else 0.0,
+            'errors': errors
+        }
+
+    def sync(self, local_root, remote_root, delete=False, on_progress=None):
+        plan = self.plan(local_root, remote_root, delete)
+        result = self.run(plan, on_progress)
+        result['unchanged'] = plan['unchanged']
+        result['hashed'] = plan['hashed']
+        return result
+
+# 计数读取包装 - 统计实际经过连接的字节数（压缩时即压缩后的大小）
+class CountingReader:
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+# 流式tar拉取 - 设备端 tar -c（可选gzip）经exec输出，主机边接收边解包，不落临时归档；
+# 大目录按顶层条目分组后多路并行
+class TarPuller:
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, adb_manager, serial=None, compress=False, workers=4, timeout=60):
+        self.adb_manager = adb_manager
+        self.serial = serial or adb_manager.current_device
+        self.compress = compress
+        self.workers = max(1, workers)
+        self.timeout = timeout
+
+    @staticmethod
+    def safe_member(member, dest):
+        """拒绝绝对路径、越出目标目录的路径与链接以及设备文件"""
+        if hasattr(tarfile, 'data_filter'):
+            try:
+                return tarfile.data_filter(member, dest)
+            except tarfile.FilterError:
+                return None
+        if member.isdev() or Path(member.name).is_absolute():
+            return None
+        root = os.path.realpath(dest)
+        target = os.path.realpath(os.path.join(dest, member.name))
+        if os.path.commonpath([root, target]) != root:
+            return None
+        if member.issym() or member.islnk():
+            base = os.path.dirname(target) if member.issym() else root
+            link = os.path.realpath(os.path.join(base, member.linkname))
+            if os.path.isabs(member.linkname) or os.path.commonpath([root, link]) != root:
+                return None
+        return member
+
+    def list_entries(self, remote_root):
+        """一次shell调用取得顶层条目及其大小(KB)，用于分组并行"""
+        output = self.adb_manager.run_shell(
+            f"cd {shlex.quote(remote_root)} && find . -mindepth 1 -maxdepth 1 -exec du -sk {{}} +",
+            self.serial, self.timeout)
+        if output.startswith("Error"):
+            raise RuntimeError(output)
+        entries = []
+        for line in output.splitlines():
+            size, _, name = line.partition('\t')
+            if size.isdigit() and name.startswith('./'):
+                entries.append((name[2:], int(size)))
+        return entries
+
+    def split_entries(self, entries):
+        """按大小贪心分配到各路，使每路数据量接近"""
+        groups = [[0, []] for _ in range(min(self.workers, len(entries)) or 1)]
+        for name, size in sorted(entries, key=lambda e: e[1], reverse=True):
+            lightest = min(groups, key=lambda g: g[0])
+            lightest[0] += size
+            lightest[1].append(name)
+        return [names for _, names in groups if names]
+
+    def pull_stream(self, remote_root, names, local_dir):
+        """拉取remote_root下的names（为空则整个目录）并就地解包"""
+        local_dir = str(local_dir)
+        os.makedirs(local_dir, exist_ok=True)
+        targets = " ".join(shlex.quote(name) for name in names) if names else "."
+        command = (f"tar -c{'z' if self.compress else ''} -f - -C {shlex.quote(remote_root)} "
+                   f"-- {targets} 2>/dev/null")
+        stats = {'files': 0, 'bytes': 0, 'wire_bytes': 0, 'skipped': []}
+        stream = self.adb_manager.open_stream(command, self.serial, service='exec')
+
+        def members(tar):
+            for member in tar:
+                safe = self.safe_member(member, local_dir)
+                if safe is None:
+                    stats['skipped'].append(member.name)
+                    continue
+                if safe.isfile():
+                    stats['files'] += 1
+                    stats['bytes'] += safe.size
+                yield safe
+
+        # 成员已经过safe_member过滤，新版Python不再重复套用默认过滤器
+        trusted = {'filter': 'fully_trusted'} if hasattr(tarfile, 'data_filter') else {}
+        reader = CountingReader(stream)
+        try:
+            with tarfile.open(fileobj=reader, mode='r|gz' if self.compress else 'r|',
+                              bufsize=self.CHUNK_SIZE) as tar:
+                # extractall在最后才设置目录属性，只读目录不会挡住后续文件
+                tar.extractall(local_dir, members=members(tar), **trusted)
+        finally:
+            stream.close()
+        stats['wire_bytes'] = reader.count
+        return stats
+
+    def pull(self, remote_root, local_dir, parallel=True, on_result=None):
+        """拉取整个目录；parallel时按顶层条目分组多路并行，返回MB/s与files/s"""
+        start = time.perf_counter()
+        remote_root = remote_root.rstrip('/') or '/'
+        local_dir = Path(local_dir) / (Path(remote_root).name or 'root')
+        groups = self.split_entries(self.list_entries(remote_root)) if parallel and self.workers > 1 else [[]]
+        # 空目录也走一次整目录拉取，以便在本地建立目录
+        groups = groups or [[]]
+        total = {'files': 0, 'bytes': 0, 'wire_bytes': 0, 'skipped': [], 'errors': [], 'streams': len(groups)}
+        with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+            futures = {pool.submit(self.pull_stream, remote_root, names, local_dir): names for names in groups}
+            for future in as_completed(futures):
+                try:
+                    stats = future.result()
+                except (OSError, tarfile.TarError) as e:
+                    total['errors'].append(f"{', '.join(futures[future]) or remote_root}: {e}")
+                    continue
+                for key in ('files', 'bytes', 'wire_bytes'):
+                    total[key] += stats[key]
+                total['skipped'].extend(stats['skipped'])
+                if on_result:
+                    on_result(futures[future], stats)
+        elapsed = time.perf_counter() - start
+        total.update({
+            'local_dir': str(local_dir),
+            'elapsed': elapsed,
+            'mb_per_s': total['bytes'] / 1024 / 1024 / elapsed if elapsed > 0 else 0.0,
+            'files_per_s': total['files'] / elapsed if elapsed > 0 else 0.0
+        })
+        return total
+
+# PNG编码 - 只用zlib与struct，行过滤固定为None（type 0），压缩级别可调
+def encode_png(width, height, pixels, channels=4, level=1):
+    """pixels为按行排列的RGB/RGBA数据，返回PNG字节"""
+    stride = width * channels
+    view = memoryview(pixels)
+    raw = bytearray((stride + 1) * height)
+    for row in range(height):
+        start = row * (stride + 1) + 1
+        raw[start:start + stride] = view[row * stride:(row + 1) * stride]
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 6 if channels == 4 else 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw, level)) + chunk(b'IEND', b'')
+
+# 截屏引擎 - 读取screencap原始帧（不带-p，省去设备端PNG编码），帧数据放入预分配缓冲区，
+# 主机端线程池编码PNG；支持多设备按帧率连拍
+class ScreenCapture:
+    # screencap像素格式: 编号 -> (名称, 每像素字节数)
+    FORMATS = {1: ('RGBA_8888', 4), 2: ('RGBX_8888', 4), 3: ('RGB_888', 3), 4: ('RGB_565', 2), 5: ('BGRA_8888', 4)}
+    BUFFERS_PER_DEVICE = 4
+    # 等待空闲缓冲区的最长秒数，超时按抓取失败处理而不是一直阻塞
+    BUFFER_WAIT = 30
+    # 连拍时每台设备最多保留的错误信息条数（失败总数另计）
+    MAX_ERRORS = 20
+    RGB565_TABLES = (bytes(b & 0xf8 for b in range(256)), bytes((b & 0x07) << 5 for b in range(256)),
+                     bytes((b >> 5) << 2 for b in range(256)), bytes((b & 0x1f) << 3 for b in range(256)))
+
+    def __init__(self, adb_manager, workers=None, level=1, save_raw=False):
+        self.adb_manager = adb_manager
+        self.level = level
+        self.save_raw = save_raw
+        self.pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 2)
+        # {序列号: {'header_size', 'width', 'height', 'format', 'buffers': queue.Queue}}
+        self.devices = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @classmethod
+    def parse_header(cls, data, total_size=None):
+        """解析12字节（旧版）或16字节（Android 9起多一个色彩空间字段）的帧头"""
+        width, height, pixel_format = struct.unpack_from('<III', data, 0)
+        if pixel_format not in cls.FORMATS:
+            raise ValueError(f"不支持的像素格式: {pixel_format}")
+        frame_size = width * height * cls.FORMATS[pixel_format][1]
+        header_size = 16
+        if total_size is not None and total_size - frame_size == 12:
+            header_size = 12
+        return {'width': width, 'height': height, 'format': pixel_format,
+                'frame_size': frame_size, 'header_size': header_size}
+
+    def probe(self, serial):
+        """第一次截屏完整读取，确定帧头长度与分辨率，并按帧大小预分配缓冲区"""
+        stream = self.adb_manager.open_stream("screencap", serial, service='exec')
+        try:
+            data = stream.read()
+        finally:
+            stream.close()
+        if len(data) < 12:
+            raise RuntimeError(f"{serial}: screencap没有输出")
+        info = self.parse_header(data, len(data))
+        buffers = queue.Queue()
+        for _ in range(self.BUFFERS_PER_DEVICE):
+            buffers.put(bytearray(info['frame_size']))
+        info['buffers'] = buffers
+        with self._lock:
+            self.devices[serial] = info
+        return info
+
+    def _read_frame(self, serial):
+        """读取一帧到预分配缓冲区，返回 (帧信息, 缓冲区, 抓取耗时)"""
+        info = self.devices.get(serial) or self.probe(serial)
+        start = time.perf_counter()
+        stream = self.adb_manager.open_stream("screencap", serial, service='exec')
+        buffer = None
+        try:
+            header = stream.read(info['header_size'])
+            frame = self.parse_header(header)
+            if frame['frame_size'] != info['frame_size']:
+                # 屏幕旋转或分辨率变化，这一帧使用临时缓冲区
+                buffer = bytearray(frame['frame_size'])
+            else:
+                try:
+                    buffer = info['buffers'].get(timeout=self.BUFFER_WAIT)
+                except queue.Empty:
+                    raise RuntimeError(f"{serial}: 等待帧缓冲区超时") from None
+            view = memoryview(buffer)
+            filled = 0
+            while filled < len(buffer):
+                n = stream.readinto(view[filled:])
+                if not n:
+                    break
+                filled += n
+        except BaseException:
+            # 读取中途出错（连接重置、超时）时归还缓冲区，否则几次失败后连拍会一直等待
+            if buffer is not None:
+                self._release(serial, buffer)
+            raise
+        finally:
+            stream.close()
+        if filled < len(buffer):
+            self._release(serial, buffer)
+            raise RuntimeError(f"{serial}: 帧数据不完整 ({filled}/{len(buffer)})")
+        frame['seconds'] = time.perf_counter() - start
+        return frame, buffer
+
+    def _release(self, serial, buffer):
+        info = self.devices.get(serial)
+        if info and len(buffer) == info['frame_size']:
+            info['buffers'].put(buffer)
+
+    def to_rgb(self, frame, buffer):
+        """转换为PNG可直接使用的RGB/RGBA数据，返回 (数据, 通道数)"""
+        pixel_format = frame['format']
+        if pixel_format == 1:
+            return buffer, 4
+        if pixel_format == 2:
+            data = bytearray(buffer)
+            data[3::4] = b'\xff' * (len(data) // 4)
+            return data, 4
+        if pixel_format == 3:
+            return buffer, 3
+        if pixel_format == 5:
+            data = bytearray(buffer)
+            data[0::4], data[2::4] = buffer[2::4], buffer[0::4]
+            return data, 4
+        # RGB_565小端：高字节 RRRRRGGG，低字节 GGGBBBBB；用查表与整数按位或代替逐像素循环
+        low, high = bytes(buffer[0::2]), bytes(buffer[1::2])
+        green = (int.from_bytes(high.translate(self.RGB565_TABLES[1]), 'big') |
+                 int.from_bytes(low.translate(self.RGB565_TABLES[2]), 'big')).to_bytes(len(low), 'big')
+        data = bytearray(len(low) * 3)
+        data[0::3] = high.translate(self.RGB565_TABLES[0])
+        data[1::3] = green
+        data[2::3] = low.translate(self.RGB565_TABLES[3])
+        return data, 3
+
+    def _save(self, serial, frame, buffer, path):
+        """在工作线程中编码并写盘，完成后归还缓冲区"""
+        start = time.perf_counter()
+        try:
+            if self.save_raw:
+                path = path.with_suffix('.raw')
+                with open(path, 'wb') as f:
+                    f.write(struct.pack('<III', frame['width'], frame['height'], frame['format']))
+                    f.write(buffer)
+            else:
+                data, channels = self.to_rgb(frame, buffer)
+                with open(path, 'wb') as f:
+                    f.write(encode_png(frame['width'], frame['height'], data, channels, self.level))
+        finally:
+            self._release(serial, buffer)
+        return {'serial': serial, 'path': str(path), 'capture_s': frame['seconds'],
+                'encode_s': time.perf_counter() - start}
+
+    def capture(self, serial, path):
+        """截取一帧并保存，返回Future"""
+        with TELEMETRY.span('screencap', serial=serial) as span:
+            frame, buffer = self._read_frame(serial)
+            span.add_bytes(len(buffer))
+        return self.pool.submit(self._save, serial, frame, buffer, Path(path))
+
+    def burst(self, devices, fps=2.0, duration=10.0, out_dir="screenshots", on_frame=None):
+        """多台设备同时按帧率连拍；抓取跟不上时跳过错过的时间点并计为丢帧"""
+        out_dir = Path(out_dir) / time.strftime('%Y%m%d_%H%M%S')
+        out_dir.mkdir(parents=True, exist_ok=True)
+        interval = 1.0 / fps
+        stop_at = time.perf_counter() + duration
+        results = {}
+        done = threading.Condition()
+
+        def record(stats, error=None, result=None):
+            """在完成回调中累计结果，不保留Future，长时间连拍时内存不随帧数增长"""
+            with done:
+                if error is not None:
+                    stats['failed'] += 1
+                    if len(stats['errors']) < self.MAX_ERRORS:
+                        stats['errors'].append(str(error))
+                else:
+                    stats['frames'] += 1
+                    stats['capture_s'] += result['capture_s']
+                    stats['encode_s'] += result['encode_s']
+
+        def on_done(stats, future):
+            error = future.exception()
+            record(stats, error, None if error else future.result())
+            with done:
+                stats['pending'] -= 1
+                done.notify_all()
+            if on_frame and error is None:
+                on_frame(future.result())
+
+        def run(serial):
+            stats = {'frames': 0, 'dropped': 0, 'failed': 0, 'errors': [], 'pending': 0,
+                     'capture_s': 0.0, 'encode_s': 0.0}
+            safe_name = re.sub(r'[^\w.-]', '_', serial)
+            deadline = time.perf_counter()
+            index = 0
+            while deadline < stop_at:
+                wait = deadline - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                try:
+                    future = self.capture(serial, out_dir / f"{safe_name}_{index:05d}.png")
+                    with done:
+                        stats['pending'] += 1
+                    future.add_done_callback(lambda f: on_done(stats, f))
+                except (RuntimeError, ValueError, OSError) as e:
+                    record(stats, e)
+                index += 1
+                deadline += interval
+                now = time.perf_counter()
+                if now > deadline + interval:
+                    missed = int((now - deadline) / interval)
+                    stats['dropped'] += missed
+                    index += missed
+                    deadline += missed * interval
+            return stats
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, len(devices))) as capture_pool:
+            for serial, stats in zip(devices, capture_pool.map(run, devices)):
+                results[serial] = stats
+        with done:
+            done.wait_for(lambda: all(stats['pending'] == 0 for stats in results.values()))
+        for stats in results.values():
+            frames = stats['frames']
+            del stats['pending']
+            stats['fps'] = frames / duration if duration > 0 else 0.0
+            stats['capture_ms'] = stats.pop('capture_s') * 1000 / frames if frames else 0.0
+            stats['encode_ms'] = stats.pop('encode_s') * 1000 / frames if frames else 0.0
+        return {'out_dir': str(out_dir), 'devices': results, 'elapsed': time.perf_counter() - start}
+
+# 固件哈希引擎 - 大块读取，单次遍历同时计算多种摘要
+class FirmwareHasher:
+    DEFAULT_ALGORITHMS = ('md5', 'sha1', 'sha256')
+    CHUNK_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, algorithms=None, chunk_size=None, max_workers=None):
+        self.algorithms = tuple(algorithms or self.DEFAULT_ALGORITHMS)
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+
+    def hash_file(self, file_path, progress=None, parallel=True):
+        """计算文件摘要，返回各算法的十六进制值以及字节数、耗时和吞吐量(MB/s)
+
+        parallel为True时各算法在线程中并行更新（hashlib处理大块数据时会释放GIL），
+        同时预读下一块数据；progress(已处理字节, 总字节) 在每块处理后回调。
+        """
+        with TELEMETRY.span('hash', path=str(file_path), algorithms=','.join(self.algorithms)) as span:
+            result = self._hash_file(Path(file_path), progress, parallel)
+            span.add_bytes(result['size'])
+            return result
+
+    def _hash_file(self, file_path, progress, parallel):
+        total = file_path.stat().st_size
+        hashers = {name: hashlib.new(name) for name in self.algorithms}
+        buffers = [bytearray(self.chunk_size), bytearray(self.chunk_size)]
+        done = 0
+        start = time.perf_counter()
+
+        parallel = parallel and len(hashers) > 1 and (os.cpu_count() or 1) > 1
+        pool = ThreadPoolExecutor(max_workers=len(hashers)) if parallel else None
+        try:
+            with open(file_path, 'rb', buffering=0) as f:
+                pending = []
+                index = 0
+                while True:
+                    # 当前块读盘与上一块的哈希计算重叠进行
+                    buf = buffers[index % 2]
+                    n = f.readinto(buf)
+                    for future in pending:
+                        future.result()
+                    if not n:
+                        break
+                    view = memoryview(buf)[:n]
+                    if pool:
+                        pending = [pool.submit(h.update, view) for h in hashers.values()]
+                    else:
+                        for h in hashers.values():
+                            h.update(view)
+                    done += n
+                    index += 1
+                    if progress:
+                        progress(done, total)
+        finally:
+            if pool:
+                pool.shutdown()
+
+        elapsed = time.perf_counter() - start
+        result = {name: h.hexdigest() for name, h in hashers.items()}
+        result.update({
+            'size': done,
+            'seconds': elapsed,
+            'mb_per_s': done / 1024 / 1024 / elapsed if elapsed > 0 else 0.0
+        })
+        return result
+
+    def hash_files(self, file_paths, on_result=None):
+        """并行校验多个文件，返回 {路径: 结果}；单个文件出错时结果中包含error"""
+        file_paths = [Path(p) for p in file_paths]
+        results = {}
+        if not file_paths:
+            return results
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(file_paths))) as pool:
+            futures = {pool.submit(self.hash_file, path, None, False): path for path in file_paths}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    result = future.result()
+                except OSError as e:
+                    result = {'error': str(e)}
+                results[str(path)] = result
+                if on_result:
+                    on_result(path, result)
+        return results
+
+def print_hash_progress(done, total, log=print):
+    """哈希进度条"""
+    percent = int(done * 100 / total) if total else 100
+    bar = f"\r校验中 [{'█' * (percent//2)}{' ' * (50 - percent//2)}] {percent}% "
+    log(f"\033[93m{bar}\033[0m", end='', flush=True)
+
+# 根据 img/<系统>/<设备>/ 目录结构推断固件所属系统和设备
+def detect_firmware_origin(file_path):
+    path_parts = Path(file_path).parts
+    system = "unknown"
+    device = "未知设备"
+    
+    if "img" in path_parts:
+        img_index = path_parts.index("img")
+        if img_index + 1 < len(path_parts) - 1:
+            system = path_parts[img_index + 1]
+        if img_index + 2 < len(path_parts) - 1:
+            device = path_parts[img_index + 2].replace('_', ' ')
+    return system, device
+
+# 固件索引 - 以 路径+大小+修改时间+inode 为键缓存摘要和元数据，文件未变化时无需重新计算
+class FirmwareIndex:
+    EXTENSIONS = ('.zip', '.img', '.bin', '.tgz')
+    INDEX_VERSION = 1
+
+    def __init__(self, root="img", index_file=None):
+        self.root = Path(root)
+        self.index_file = Path(index_file) if index_file else self.root / ".firmware_index.json"
+        self.entries = None
+        self._lock = threading.Lock()
+        self._dirty = False
+        # 由FirmwareWatcher增量维护的文件列表；为None时需要完整扫描
+        self.listing = None
+
+    def load(self):
+        """从磁盘加载索引，文件损坏或版本不符时从空索引开始"""
+        if self.entries is not None:
+            return self.entries
+        entries = {}
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.INDEX_VERSION:
+                entries = data.get('entries', {})
+        except (OSError, ValueError):
+            pass
+        with self._lock:
+            if self.entries is None:
+                self.entries = entries
+            return self.entries
+
+    def save(self):
+        """原子写入索引文件"""
+        if not self._dirty:
+            return
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.index_file.with_name(self.index_file.name + ".tmp")
+        with self._lock:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.INDEX_VERSION, 'entries': self.entries}, f,
+                          ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_file, self.index_file)
+            self._dirty = False
+
+    @staticmethod
+    def _key(file_path):
+        # abspath不访问文件系统，网络存储上比resolve()快得多
+        return os.path.abspath(file_path)
+
+    def _under(self, key, directory=None):
+        """索引键是否位于directory（默认为索引根目录）之下；多个目录树可以共用同一个索引文件"""
+        return key.startswith(os.path.join(self._key(directory or self.root), ''))
+
+    @staticmethod
+    def _fingerprint(st):
+        return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'inode': st.st_ino}
+
+    def get(self, file_path, st=None):
+        """返回仍然有效的索引项；文件已变化或不存在时返回None"""
+        entries = self.load()
+        entry = entries.get(self._key(file_path))
+        if not entry:
+            return None
+        try:
+            st = st or os.stat(file_path)
+        except OSError:
+            return None
+        if entry.get('size') != st.st_size or entry.get('mtime_ns') != st.st_mtime_ns:
+            return None
+        # Windows下scandir缓存的stat没有inode(为0)，此时只比较大小和修改时间
+        if st.st_ino and entry.get('inode') and entry['inode'] != st.st_ino:
+            return None
+        return entry
+
+    def update(self, file_path, hashes=None, metadata=None, st=None):
+        """写入/更新索引项（不立即保存）"""
+        entries = self.load()
+        st = st or os.stat(file_path)
+        key = self._key(file_path)
+        entry = self.get(file_path, st) or {}
+        system, device = detect_firmware_origin(file_path)
+        entry.update(self._fingerprint(st))
+        entry.update({'path': str(file_path), 'name': Path(file_path).name,
+                      'system': entry.get('system', system), 'device': entry.get('device', device)})
+        if hashes:
+            entry.update({k: hashes[k] for k in FirmwareHasher.DEFAULT_ALGORITHMS if k in hashes})
+            entry['hashed_at'] = time.time()
+        if metadata:
+            entry.update(metadata)
+        with self._lock:
+            entries[key] = entry
+            self._dirty = True
+        return entry
+
+    def is_firmware_name(self, name):
+        return name.lower().endswith(self.EXTENSIONS) and not name.startswith('.')
+
+    def iter_files(self, root=None):
+        """单次遍历目录树（os.scandir），一次匹配所有扩展名并复用DirEntry的stat结果，返回 (路径, stat)"""
+        stack = [str(root or self.root)]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError:
+                continue
+            subdirs = []
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif self.is_firmware_name(entry.name) and entry.is_file():
+                        yield Path(entry.path), entry.stat()
+                except OSError:
+                    continue
+            stack.extend(reversed(subdirs))
+
+    def refresh_file(self, file_path, st=None):
+        """登记单个文件（新文件只记录元数据），返回索引项"""
+        st = st or os.stat(file_path)
+        entry = self.get(file_path, st)
+        if entry is None:
+            entry = self.update(file_path, st=st)
+        with self._lock:
+            if self.listing is not None:
+                self.listing[self._key(file_path)] = entry
+        return entry
+
+    def remove_file(self, file_path):
+        """文件被删除或移走时从索引中移除"""
+        key = self._key(file_path)
+        with self._lock:
+            if self.load().pop(key, None) is not None:
+                self._dirty = True
+            if self.listing is not None:
+                self.listing.pop(key, None)
+
+    def remove_tree(self, directory):
+        """目录被删除或移走时移除其下所有文件"""
+        entries = self.load()
+        with self._lock:
+            for key in [k for k in entries if self._under(k, directory)]:
+                del entries[key]
+                self._dirty = True
+            if self.listing is not None:
+                for key in [k for k in self.listing if self._under(k, directory)]:
+                    del self.listing[key]
+
+    def invalidate_listing(self):
+        """放弃增量维护的文件列表，下次scan时完整扫描"""
+        with self._lock:
+            self.listing = None
+
+    def scan(self, incremental=False):
+        """列出固件文件：已索引且未变化的直接使用缓存，新文件只登记元数据，删除的文件从索引移除
+
+        incremental为True且监视器正在维护文件列表时不访问磁盘，直接返回当前列表。
+        """
+        if incremental:
+            with self._lock:
+                current = list(self.listing.values()) if self.listing is not None else None
+            if current is not None:
+                self.save()
+                return sorted(current, key=lambda e: e['path'])
+        entries = self.load()
+        listing = {}
+        for fw_file, st in self.iter_files():
+            entry = self.get(fw_file, st)
+            if entry is None:
+                entry = self.update(fw_file, st=st)
+            listing[self._key(fw_file)] = entry
+        with self._lock:
+            # 只清理本目录树下已不存在的文件，其他目录树的缓存摘要保持不变
+            for key in [k for k in entries if k not in listing and self._under(k)]:
+                del entries[key]
+                self._dirty = True
+            self.listing = listing
+        self.save()
+        return list(listing.values())
+
+    def ensure_hashes(self, file_path, hasher, progress=None):
+        """返回包含摘要的索引项，只有文件变化过时才重新计算"""
+        entry = self.get(file_path)
+        if entry and entry.get('sha256'):
+            return entry, False
+        st = os.stat(file_path)
+        hashes = hasher.hash_file(file_path, progress=progress)
+        entry = self.update(file_path, hashes, {'mb_per_s': round(hashes['mb_per_s'], 1)}, st=st)
+        self.save()
+        return entry, True
+
+    def rebuild(self, hasher, verify=False, on_result=None):
+        """强制刷新索引：重新计算全部文件摘要；verify为True时报告与旧记录不一致的文件"""
+        old_entries = dict(self.load())
+        files = [fw_file for fw_file, _ in self.iter_files()]
+        mismatched = []
+
+        def record(path, result):
+            if 'error' in result:
+                if on_result:
+                    on_result(path, result, None)
+                return
+            old = old_entries.get(self._key(path), {})
+            ok = not old.get('sha256') or old['sha256'] == result['sha256']
+            if verify and not ok:
+                mismatched.append(str(path))
+            self.update(path, result, {'mb_per_s': round(result['mb_per_s'], 1)})
+            if on_result:
+                on_result(path, result, ok)
+
+        with self._lock:
+            self.entries = {k: v for k, v in old_entries.items() if not self._under(k)}
+            self.listing = None
+            self._dirty = True
+        hasher.hash_files(files, on_result=record)
+        self.save()
+        return {'files': len(files), 'mismatched': mismatched}
+
+# 固件目录监视器 (Linux inotify) - 文件增删改时增量更新索引，选择固件时无需重新扫描
+class FirmwareWatcher:
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    EVENT_HEADER = struct.Struct('iIII')
+
+    _libc = None
+
+    @classmethod
+    def available(cls):
+        """当前平台是否支持inotify"""
+        if not sys.platform.startswith('linux'):
+            return False
+        if cls._libc is None:
+            try:
+                cls._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                cls._libc.inotify_init1
+            except (OSError, AttributeError):
+                cls._libc = False
+        return bool(cls._libc)
+
+    def __init__(self, index, on_change=None):
+        self.index = index
+        self.on_change = on_change
+        self.fd = None
+        self.watches = {}
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """先完整扫描一次建立文件列表，然后监视目录树的变化"""
+        if not self.available():
+            return False
+        self.fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            self.fd = None
+            return False
+        self.index.root.mkdir(parents=True, exist_ok=True)
+        self._watch_tree(self.index.root)
+        self.index.scan()
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(2)
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(directory)), self.WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = Path(directory)
+
+    def _watch_tree(self, root):
+        self._add_watch(root)
+        for dirpath, dirnames, _ in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for d in dirnames:
+                self._add_watch(Path(dirpath) / d)
+
+    def _loop(self):
+        while self._running:
+            readable, _, _ = select.select([self.fd], [], [], 0.5)
+            if not readable:
+                continue
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            changed = False
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                changed |= self._handle_event(wd, mask, name)
+            if changed:
+                self.index.save()
+                if self.on_change:
+                    self.on_change()
+
+    def _handle_event(self, wd, mask, name):
+        if mask & self.IN_Q_OVERFLOW:
+            # 事件队列溢出，放弃增量列表，下次选择固件时完整扫描
+            self.index.invalidate_listing()
+            return True
+        if mask & self.IN_IGNORED:
+            self.watches.pop(wd, None)
+            return False
+        directory = self.watches.get(wd)
+        if directory is None or not name or name.startswith('.'):
+            return False
+        path = directory / name
+        if mask & self.IN_ISDIR:
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self._watch_tree(path)
+                for fw_file, st in self.index.iter_files(path):
+                    self.index.refresh_file(fw_file, st)
+                return True
+            if mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                self.index.remove_tree(path)
+                return True
+            return False
+        if not self.index.is_firmware_name(name):
+            return False
+        if mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+            self.index.remove_file(path)
+            return True
+        if mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE):
+            try:
+                self.index.refresh_file(path)
+            except OSError:
+                return False
+            return True
+        return False
+
+# 内容寻址固件仓库 - 每份内容按SHA-256只保存一次，img/ 下的文件是指向仓库对象的硬链接或reflink；
+# 引用关系记录在 objects.json 中（索引中的摘要 + 各对象的引用路径），不依赖硬链接数
+class FirmwareStore:
+    FICLONE = 0x40049409
+    META_VERSION = 1
 
-# ADB功能管理器
-class ADBManager:
-    def __init__(self):
-        self.connected_devices = []
-        self.current_device = None
-        
-    def run_adb_command(self, command, device_specific=True):
-        """执行ADB命令"""
+    def __init__(self, root=None, link_mode=None):
+        self.root = Path(root) if root else Path("img") / ".store"
+        self.meta_file = self.root / "objects.json"
+        # hardlink：硬链接（默认）；reflink：写时复制克隆，文件系统不支持时退回硬链接
+        self.link_mode = link_mode or os.environ.get('FLASH_STORE_LINK', 'hardlink')
+        self.objects = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self.objects is not None:
+            return self.objects
+        self.objects = {}
         try:
-            full_command = "adb"
-            if device_specific and self.current_device:
-                full_command += f" -s {self.current_device}"
-            full_command += f" {command}"
-            
-            result = subprocess.run(full_command, shell=True, capture_output=True, text=True, timeout=30)
-            return result.stdout.strip() if result.returncode == 0 else f"Error: {result.stderr.strip()}"
-        except subprocess.TimeoutExpired:
-            return "Error: Command timeout"
-        except Exception as e:
-            return f"Error: {str(e)}"
-    
-    def check_devices(self):
-        """检查连接的设备"""
-        output = self.run_adb_command("devices", False)
-        devices = []
-        for line in output.split('\n')[1:]:
-            if line.strip() and '\tdevice' in line:
-                devices.append(line.split('\t')[0])
-        self.connected_devices = devices
-        return devices
-    
-    def select_device(self):
-        """选择设备"""
-        devices = self.check_devices()
-        if not devices:
-            print("未找到连接的设备")
-            return False
-        
-        print("\n连接的设备:")
-        for i, device in enumerate(devices, 1):
-            print(f"{i}. {device}")
-        
+            with open(self.meta_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.META_VERSION:
+                self.objects = data.get('objects', {})
+        except (OSError, ValueError):
+            pass
+        return self.objects
+
+    def save(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.meta_file.with_name(self.meta_file.name + ".tmp")
+        with self._lock:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.META_VERSION, 'objects': self.objects or {}}, f, separators=(',', ':'))
+            os.replace(tmp_file, self.meta_file)
+
+    def object_path(self, sha256):
+        return self.root / "sha256" / sha256[:2] / sha256
+
+    def lookup(self, sha256):
+        """仓库中存在该内容时返回其记录（大小、各摘要）"""
+        if not sha256:
+            return None
+        meta = self.load().get(sha256)
         try:
-            choice = input("\n选择设备 (输入编号): ").strip()
-            if choice.isdigit() and 1 <= int(choice) <= len(devices):
-                self.current_device = devices[int(choice) - 1]
-                print(f"已选择设备: {self.current_device}")
-                return True
-        except:
+            st = os.stat(self.object_path(sha256))
+        except OSError:
+            return None
+        if meta is None or meta.get('size') != st.st_size:
+            return None
+        return meta
+
+    def _reflink(self, src, dest):
+        if fcntl is None:
+            raise OSError("当前平台不支持reflink")
+        with open(src, 'rb') as s, open(dest, 'wb') as d:
+            try:
+                fcntl.ioctl(d.fileno(), self.FICLONE, s.fileno())
+            except OSError:
+                d.close()
+                os.remove(dest)
+                raise
+
+    def _link(self, src, dest):
+        """让dest成为src的链接（先建临时链接再原子替换），返回实际使用的方式"""
+        dest = Path(dest)
+        tmp = dest.with_name(f".{dest.name}.{os.getpid()}.link")
+        modes = ('reflink', 'hardlink') if self.link_mode == 'reflink' else ('hardlink',)
+        for mode in modes:
+            try:
+                if mode == 'hardlink':
+                    os.link(src, tmp)
+                else:
+                    self._reflink(src, tmp)
+                os.replace(tmp, dest)
+                return mode
+            except OSError:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+        # 跨文件系统等无法链接的情况只能复制
+        shutil.copy2(src, tmp)
+        os.replace(tmp, dest)
+        return 'copy'
+
+    def add(self, file_path, hashes):
+        """把文件收入仓库并让原路径指向仓库对象，返回 (方式, 节省的字节数)"""
+        sha256 = hashes['sha256']
+        obj = self.object_path(sha256)
+        st = os.stat(file_path)
+        objects = self.load()
+        try:
+            obj_st = os.stat(obj)
+        except OSError:
+            obj_st = None
+        if obj_st is not None and obj_st.st_size != st.st_size:
+            raise ValueError(f"仓库对象 {sha256[:12]} 大小与文件不一致")
+        if obj_st is None:
+            obj.parent.mkdir(parents=True, exist_ok=True)
+            mode = self._link(file_path, obj)
+            if mode != 'hardlink' and os.name != 'nt':
+                # 内容以摘要命名，不允许原地修改；硬链接与用户文件共用inode，不能改权限
+                os.chmod(obj, 0o444)
+            saved = 0
+        elif os.path.samefile(obj, file_path):
+            mode, saved = 'linked', 0
+        else:
+            mode = self._link(obj, file_path)
+            saved = st.st_size if mode == 'hardlink' or mode == 'reflink' else 0
+        with self._lock:
+            meta = objects.setdefault(sha256, {'size': st.st_size, 'added': time.time()})
+            meta.update({k: hashes[k] for k in ('md5', 'sha1') if k in hashes})
+        self._add_ref(sha256, file_path)
+        return mode, saved
+
+    def _add_ref(self, sha256, path):
+        """记录引用该对象的文件路径（reflink与复制出的文件无法从链接数看出引用关系）"""
+        path = os.path.abspath(path)
+        with self._lock:
+            meta = self.load().get(sha256)
+            if meta is not None and path not in meta.setdefault('refs', []):
+                meta['refs'].append(path)
+
+    def live_refs(self, sha256):
+        """仍然存在且大小与对象一致的引用路径"""
+        meta = self.load().get(sha256) or {}
+        live = []
+        for path in meta.get('refs', []):
+            try:
+                if os.stat(path).st_size == meta.get('size'):
+                    live.append(path)
+            except OSError:
+                pass
+        return live
+
+    def materialize(self, sha256, dest):
+        """按摘要在dest处生成文件（不下载、不重新校验），仓库中没有时返回None"""
+        meta = self.lookup(sha256)
+        if meta is None:
+            return None
+        Path(dest).parent.mkdir(parents=True, exist_ok=True)
+        self._link(self.object_path(sha256), dest)
+        self._add_ref(sha256, dest)
+        return dict(meta, sha256=sha256)
+
+    def iter_objects(self):
+        objects_dir = self.root / "sha256"
+        if not objects_dir.is_dir():
+            return
+        for prefix in os.scandir(objects_dir):
+            if prefix.is_dir():
+                for entry in os.scandir(prefix.path):
+                    if entry.is_file():
+                        yield entry.name, entry.stat()
+
+    def gc(self, referenced=()):
+        """删除没有任何文件引用的对象：不在索引引用的摘要集合中，且记录的引用路径都已不存在"""
+        referenced = set(referenced)
+        objects = self.load()
+        removed, freed = 0, 0
+        for sha256, st in list(self.iter_objects()):
+            # 仍有其他硬链接说明一定被引用（旧版仓库的对象没有引用记录）
+            if sha256 in referenced or st.st_nlink > 1:
+                continue
+            live = self.live_refs(sha256)
+            if live:
+                with self._lock:
+                    if sha256 in objects:
+                        objects[sha256]['refs'] = live
+                continue
+            path = self.object_path(sha256)
+            try:
+                os.chmod(path, 0o644)
+                os.remove(path)
+            except OSError:
+                continue
+            with self._lock:
+                objects.pop(sha256, None)
+            removed += 1
+            freed += st.st_size
+        with self._lock:
+            for sha256 in [k for k in objects if not self.object_path(k).exists()]:
+                del objects[sha256]
+        self.save()
+        return {'removed': removed, 'freed': freed}
+
+    def report(self, entries):
+        """去重报告：逻辑大小（各文件之和）、内容大小（按摘要去重）与实际占用（按inode去重）"""
+        groups = {}
+        unhashed = 0
+        for entry in entries:
+            if not entry.get('sha256'):
+                unhashed += 1
+                continue
+            groups.setdefault(entry['sha256'], []).append(entry)
+        logical = unique = physical = 0
+        seen_inodes = set()
+        duplicates = []
+        for sha256, items in groups.items():
+            unique += items[0]['size']
+            inodes = set()
+            for item in items:
+                logical += item['size']
+                try:
+                    st = os.stat(item['path'])
+                except OSError:
+                    continue
+                inodes.add((st.st_dev, st.st_ino))
+                if (st.st_dev, st.st_ino) not in seen_inodes:
+                    seen_inodes.add((st.st_dev, st.st_ino))
+                    physical += st.st_size
+            if len(inodes) > 1:
+                duplicates.append({'sha256': sha256, 'size': items[0]['size'],
+                                   'paths': [item['path'] for item in items], 'copies': len(inodes)})
+        store_only = sum(st.st_size for sha256, st in self.iter_objects()
+                         if sha256 not in groups and not self.live_refs(sha256))
+        duplicates.sort(key=lambda d: d['size'] * (d['copies'] - 1), reverse=True)
+        return {'files': sum(len(items) for items in groups.values()), 'unhashed': unhashed,
+                'contents': len(groups), 'logical': logical, 'unique': unique, 'physical': physical,
+                'reclaimable': physical - unique, 'store_only': store_only, 'duplicates': duplicates}
+
+    @staticmethod
+    def entry_metadata(entry):
+        """索引项中除文件指纹外的信息，文件被替换为链接后需要带回新索引项"""
+        return {k: v for k, v in entry.items() if k not in ('size', 'mtime_ns', 'inode', 'path', 'name')}
+
+    def dedupe(self, index):
+        """把索引中已有摘要的文件全部收入仓库，并刷新索引中的文件指纹"""
+        saved, linked = 0, 0
+        for entry in list(index.scan()):
+            if not entry.get('sha256'):
+                continue
+            try:
+                mode, bytes_saved = self.add(entry['path'], entry)
+            except (OSError, ValueError):
+                continue
+            if bytes_saved:
+                linked += 1
+                saved += bytes_saved
+            index.update(entry['path'], entry, self.entry_metadata(entry))
+        index.save()
+        self.save()
+        return {'linked': linked, 'saved': saved}
+
+# 下载失败
+class DownloadError(Exception):
+    pass
+
+# 分段断点续传下载引擎 - 多连接Range请求并行下载，边写入边计算摘要
+class SegmentedDownloader:
+    CHUNK_SIZE = 1024 * 1024
+    MIN_SEGMENT_SIZE = 16 * 1024 * 1024
+    STATE_SAVE_INTERVAL = 1.0
+
+    def __init__(self, connections=4, timeout=30, chunk_size=None, min_segment_size=None, algorithms=None):
+        self.connections = max(1, connections)
+        self.timeout = timeout
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.min_segment_size = min_segment_size or self.MIN_SEGMENT_SIZE
+        self.algorithms = tuple(algorithms or FirmwareHasher.DEFAULT_ALGORITHMS)
+
+    # ---- HTTP ----
+    def _open_connection(self, url):
+        """为URL所在主机建立连接（每个工作线程持有一个并复用）"""
+        parsed = urlparse(url)
+        if parsed.scheme == 'https':
+            return http.client.HTTPSConnection(parsed.netloc, timeout=self.timeout)
+        if parsed.scheme == 'http':
+            return http.client.HTTPConnection(parsed.netloc, timeout=self.timeout)
+        raise DownloadError(f"不支持的协议: {parsed.scheme}")
+
+    @staticmethod
+    def _request_path(url):
+        parsed = urlparse(url)
+        return (parsed.path or '/') + (f"?{parsed.query}" if parsed.query else '')
+
+    def probe(self, url, max_redirects=5):
+        """获取最终URL、文件大小、是否支持Range以及ETag/Last-Modified"""
+        for _ in range(max_redirects + 1):
+            conn = self._open_connection(url)
+            try:
+                conn.request('HEAD', self._request_path(url))
+                response = conn.getresponse()
+                response.read()
+            finally:
+                conn.close()
+            if response.status in (301, 302, 303, 307, 308):
+                url = urljoin(url, response.getheader('Location'))
+                continue
+            if response.status != 200:
+                raise DownloadError(f"服务器返回 HTTP {response.status}")
+            length = response.getheader('Content-Length')
+            return {
+                'url': url,
+                'size': int(length) if length is not None else None,
+                'ranges': response.getheader('Accept-Ranges', '').lower() == 'bytes',
+                'etag': response.getheader('ETag'),
+                'last_modified': response.getheader('Last-Modified')
+            }
+        raise DownloadError("重定向次数过多")
+
+    # ---- 断点状态 ----
+    @staticmethod
+    def _state_path(part_path):
+        return part_path.with_name(part_path.name + ".json")
+
+    def _load_state(self, part_path, info):
+        """读取断点状态，只有URL、大小和ETag都一致时才续传"""
+        try:
+            with open(self._state_path(part_path), 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not part_path.exists():
+            return None
+        if (state.get('url'), state.get('size'), state.get('etag')) != (info['url'], info['size'], info['etag']):
+            return None
+        return state
+
+    def _save_state(self, part_path, state):
+        tmp_path = self._state_path(part_path).with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._state_path(part_path))
+
+    def _plan_segments(self, size):
+        """按连接数切分，片段数多于连接数以便快的连接多分担"""
+        segment_size = max(self.min_segment_size, -(-size // (self.connections * 4)))
+        return [[start, min(start + segment_size, size), 0] for start in range(0, size, segment_size)]
+
+    # ---- 下载 ----
+    def download(self, url, file_path, progress=None):
+        """下载到file_path，返回 {size, seconds, mb_per_s, resumed, md5/sha1/sha256}
+
+        数据先写入 <文件>.part，进度保存在 <文件>.part.json，中断后再次调用会从已完成的位置继续。
+        """
+        with TELEMETRY.span('download', url=url, path=str(file_path)) as span:
+            result = self._download(url, Path(file_path), progress)
+            span.add_bytes(result['size'] - result['resumed'])
+            span.set(resumed=result['resumed'], mb_per_s=round(result['mb_per_s'], 2))
+            return result
+
+    def _download(self, url, file_path, progress):
+        part_path = file_path.with_name(file_path.name + ".part")
+        info = self.probe(url)
+        size = info['size']
+        segmented = info['ranges'] and size is not None and size > 0
+
+        state = self._load_state(part_path, info) if segmented else None
+        if state is None:
+            state = {'url': info['url'], 'size': size, 'etag': info['etag'],
+                     'segments': self._plan_segments(size) if segmented else [[0, size, 0]]}
+            with open(part_path, 'wb') as f:
+                if segmented:
+                    f.truncate(size)
+        segments = state['segments']
+        resumed = sum(seg[2] for seg in segments)
+
+        lock = threading.Condition()
+        errors = []
+        finished = threading.Event()
+        hashers = {name: hashlib.new(name) for name in self.algorithms}
+        hashed = [0]
+
+        def watermark():
+            # 从文件开头连续写完的字节数，摘要线程只读取这一范围
+            for start, end, done in segments:
+                if start + done < (end if end is not None else float('inf')):
+                    return start + done
+            return size
+
+        def hash_follower():
+            with open(part_path, 'rb', buffering=0) as f:
+                while True:
+                    with lock:
+                        while hashed[0] >= (watermark() or 0) and not finished.is_set() and not errors:
+                            lock.wait(0.5)
+                        limit = watermark()
+                        if limit is None:
+                            limit = segments[0][2]
+                        if hashed[0] >= limit and (finished.is_set() or errors):
+                            return
+                    f.seek(hashed[0])
+                    while hashed[0] < limit:
+                        data = f.read(min(self.chunk_size * 8, limit - hashed[0]))
+                        if not data:
+                            break
+                        for h in hashers.values():
+                            h.update(data)
+                        hashed[0] += len(data)
+
+        pending = list(range(len(segments)))
+
+        def worker():
+            conn = None
+            try:
+                with open(part_path, 'r+b', buffering=0) as out:
+                    while not errors:
+                        with lock:
+                            if not pending:
+                                return
+                            index = pending.pop(0)
+                        seg = segments[index]
+                        start, end, done = seg
+                        if end is not None and start + done >= end:
+                            continue
+                        headers = {}
+                        if segmented:
+                            headers['Range'] = f"bytes={start + done}-{end - 1}"
+                        if conn is None:
+                            conn = self._open_connection(info['url'])
+                        conn.request('GET', self._request_path(info['url']), headers=headers)
+                        response = conn.getresponse()
+                        if response.status not in ((206,) if segmented else (200,)):
+                            response.read()
+                            raise DownloadError(f"服务器返回 HTTP {response.status}")
+                        out.seek(start + done)
+                        while True:
+                            data = response.read(self.chunk_size)
+                            if not data:
+                                break
+                            out.write(data)
+                            with lock:
+                                seg[2] += len(data)
+                                lock.notify_all()
+                            if errors:
+                                return
+                        if end is not None and start + seg[2] < end:
+                            raise DownloadError("连接提前断开")
+                        if response.will_close:
+                            conn.close()
+                            conn = None
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                    lock.notify_all()
+            finally:
+                if conn is not None:
+                    conn.close()
+
+        start_time = time.perf_counter()
+        worker_count = min(self.connections, len(segments)) if segmented else 1
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(worker_count)]
+        follower = threading.Thread(target=hash_follower, daemon=True)
+        for t in threads:
+            t.start()
+        follower.start()
+
+        last_save = time.monotonic()
+        try:
+            alive = threads
+            while alive:
+                alive[0].join(0.2)
+                alive = [t for t in threads if t.is_alive()]
+                done_bytes = sum(seg[2] for seg in segments)
+                if progress:
+                    progress(done_bytes, size)
+                if segmented and time.monotonic() - last_save >= self.STATE_SAVE_INTERVAL:
+                    with lock:
+                        self._save_state(part_path, state)
+                    last_save = time.monotonic()
+        except BaseException:
+            with lock:
+                errors.append(DownloadError("下载被中断"))
+                lock.notify_all()
+            raise
+        finally:
+            with lock:
+                if segmented:
+                    self._save_state(part_path, state)
+                finished.set()
+                lock.notify_all()
+            follower.join()
+
+        if errors:
+            raise errors[0] if isinstance(errors[0], DownloadError) else DownloadError(str(errors[0]))
+
+        total = sum(seg[2] for seg in segments)
+        if size is not None and total != size:
+            raise DownloadError(f"大小不一致: {total} != {size}")
+        if progress:
+            progress(total, total)
+        os.replace(part_path, file_path)
+        try:
+            os.remove(self._state_path(part_path))
+        except OSError:
             pass
-        
-        return False
+
+        elapsed = time.perf_counter() - start_time
+        result = {name: h.hexdigest() for name, h in hashers.items()}
+        result.update({
+            'size': total,
+            'seconds': elapsed,
+            'resumed': resumed,
+            'mb_per_s': (total - resumed) / 1024 / 1024 / elapsed if elapsed > 0 else 0.0
+        })
+        return result
+
+# 块级增量更新（zsync风格）- 用本地旧版本拼出新版本，只下载缺失的块
+class DeltaUpdater:
+    BLOCK_SIZE = 64 * 1024
+    MANIFEST_SUFFIX = ".zsync.json"
+    MERGE_GAP = 4
+    # 逐字节滑动是纯Python实现（约数MB/s），超过该扫描量后放弃，剩余块直接下载
+    MAX_SLIDE_BYTES = 64 * 1024 * 1024
+    # 压缩包内容改动后几乎不会出现错位相同的块，滑动查找只会白白耗时
+    COMPRESSED_SUFFIXES = ('.zip', '.tgz', '.gz', '.xz', '.bz2', '.zst', '.7z', '.rar', '.lz4')
+    # 作为一个整体比较的双重扩展名；其余文件只比较最后一个扩展名（文件名中的版本号不算扩展名）
+    DOUBLE_SUFFIXES = ('.tar.gz', '.tar.xz', '.tar.bz2', '.tar.zst', '.tar.lz4', '.img.gz', '.img.xz')
+
+    def __init__(self, downloader=None, connections=4, timeout=30, slide=None, max_slide_bytes=None):
+        self.downloader = downloader or SegmentedDownloader(connections=connections, timeout=timeout)
+        self.connections = max(1, connections)
+        self.timeout = timeout
+        # None：按旧文件类型决定（压缩包不滑动）
+        self.slide = slide
+        self.max_slide_bytes = self.MAX_SLIDE_BYTES if max_slide_bytes is None else max_slide_bytes
+
+    # ---- 校验和 ----
+    @staticmethod
+    def weak_checksum(block):
+        """滚动校验和：a为字节和，b为按位置加权和（各取低16位）"""
+        a = sum(block) & 0xffff
+        b = sum(accumulate(block)) & 0xffff
+        return a, b
+
+    @staticmethod
+    def strong_checksum(block):
+        return hashlib.md5(block).hexdigest()
+
+    @classmethod
+    def build_manifest(cls, file_path, block_size=None):
+        """为文件生成块清单（镜像站发布新版本时运行，结果保存为 <文件>.zsync.json）"""
+        block_size = block_size or cls.BLOCK_SIZE
+        file_path = Path(file_path)
+        sha256 = hashlib.sha256()
+        blocks = []
+        with open(file_path, 'rb') as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                sha256.update(block)
+                a, b = cls.weak_checksum(block)
+                blocks.append([(a << 16) | b, cls.strong_checksum(block)])
+        return {'version': 1, 'size': file_path.stat().st_size, 'block_size': block_size,
+                'sha256': sha256.hexdigest(), 'blocks': blocks}
+
+    def fetch_manifest(self, url):
+        """获取 <url>.zsync.json，镜像站未提供时返回None"""
+        try:
+            with urllib.request.urlopen(url + self.MANIFEST_SUFFIX, timeout=self.timeout) as response:
+                manifest = json.loads(response.read().decode('utf-8'))
+        except (urllib.error.URLError, OSError, ValueError):
+            return None
+        if manifest.get('version') != 1 or not manifest.get('block_size'):
+            return None
+        return manifest
+
+    @staticmethod
+    def find_seed(file_path):
+        """在同一目录中挑选最接近的旧版本：扩展名相同、文件名公共前缀最长、修改时间最新"""
+        file_path = Path(file_path)
+        suffixes = file_path.suffix.lower()
+        for double in DeltaUpdater.DOUBLE_SUFFIXES:
+            if file_path.name.lower().endswith(double):
+                suffixes = double
+                break
+        best, best_key = None, None
+        try:
+            entries = list(os.scandir(file_path.parent))
+        except OSError:
+            return None
+        for entry in entries:
+            if entry.name == file_path.name or not entry.name.lower().endswith(suffixes) or not entry.is_file():
+                continue
+            prefix = len(os.path.commonprefix([entry.name, file_path.name]))
+            key = (prefix, entry.stat().st_mtime)
+            if best_key is None or key > best_key:
+                best, best_key = Path(entry.path), key
+        return best
+
+    # ---- 块匹配 ----
+    def match_blocks(self, manifest, seed_path):
+        """返回 {新文件块号: 旧文件偏移}；先按对齐块比较强校验，剩余的块再用滚动校验滑动查找"""
+        bs = manifest['block_size']
+        blocks = manifest['blocks']
+        last_size = manifest['size'] - (len(blocks) - 1) * bs if blocks else 0
+        by_strong = {}
+        for i, (_, strong) in enumerate(blocks):
+            by_strong.setdefault(strong, []).append(i)
+        matches = {}
+        matched_seed = set()
+
+        with open(seed_path, 'rb') as f:
+            offset = 0
+            while True:
+                block = f.read(bs)
+                if not block:
+                    break
+                for i in by_strong.get(self.strong_checksum(block), ()):
+                    if i not in matches and (len(block) == bs or i == len(blocks) - 1 and len(block) == last_size):
+                        matches[i] = offset
+                        matched_seed.add(offset // bs)
+                offset += len(block)
+
+        slide = self.slide
+        if slide is None:
+            slide = Path(seed_path).suffix.lower() not in self.COMPRESSED_SUFFIXES
+        if slide and self.max_slide_bytes > 0 and len(matches) < len(blocks):
+            self._slide(seed_path, bs, blocks, matches, matched_seed)
+        return matches
+
+    def _slide(self, seed_path, bs, blocks, matches, matched_seed):
+        """在旧文件未匹配的区域逐字节滑动窗口，处理插入/删除导致的错位；最多扫描max_slide_bytes字节"""
+        weak_index = {}
+        for i, (weak, strong) in enumerate(blocks):
+            if i not in matches:
+                weak_index.setdefault(weak, []).append(i)
+        size = os.path.getsize(seed_path)
+        if size < bs or not weak_index:
+            return
+        # 连续未匹配的对齐块组成待扫描区域，向后延伸一个块以覆盖跨边界的数据
+        regions = []
+        total_blocks = size // bs
+        i = 0
+        while i < total_blocks:
+            if i in matched_seed:
+                i += 1
+                continue
+            j = i
+            while j < total_blocks and j not in matched_seed:
+                j += 1
+            regions.append((i * bs, min(size, j * bs + bs - 1)))
+            i = j
+
+        budget = self.max_slide_bytes
+        with open(seed_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for start, end in regions:
+                pos = start
+                if budget <= 0:
+                    return
+                if pos + bs > end:
+                    continue
+                # 本区域最多滑动到剩余预算为止
+                end = min(end, pos + bs + budget)
+                budget -= end - pos - bs
+                a, b = self.weak_checksum(data[pos:pos + bs])
+                while True:
+                    candidates = weak_index.get((a << 16) | b)
+                    if candidates:
+                        strong = self.strong_checksum(data[pos:pos + bs])
+                        hits = [i for i in candidates if i not in matches and blocks[i][1] == strong]
+                        if hits:
+                            for i in hits:
+                                matches[i] = pos
+                                candidates.remove(i)
+                            if len(matches) == len(blocks):
+                                return
+                            pos += bs
+                            if pos + bs > end:
+                                break
+                            a, b = self.weak_checksum(data[pos:pos + bs])
+                            continue
+                    if pos + bs >= end:
+                        break
+                    out, new = data[pos], data[pos + bs]
+                    a = (a - out + new) & 0xffff
+                    b = (b - bs * out + a) & 0xffff
+                    pos += 1
+
+    # ---- 下载与重建 ----
+    def _missing_ranges(self, manifest, matches):
+        """缺失块合并为字节区间；间隔很小的区间合并成一次请求"""
+        bs = manifest['block_size']
+        ranges = []
+        for i in range(len(manifest['blocks'])):
+            if i in matches:
+                continue
+            start, end = i * bs, min((i + 1) * bs, manifest['size'])
+            if ranges and start - ranges[-1][1] <= self.MERGE_GAP * bs:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        return ranges
+
+    def _fetch_ranges(self, url, ranges, out_path, progress=None):
+        """多连接并行下载各区间，直接写入目标文件对应位置"""
+        pending = list(ranges)
+        lock = threading.Lock()
+        fetched = [0]
+        total = sum(end - start for start, end in ranges)
+
+        def worker():
+            conn = None
+            try:
+                with open(out_path, 'r+b', buffering=0) as out:
+                    while True:
+                        with lock:
+                            if not pending:
+                                return
+                            start, end = pending.pop(0)
+                        if conn is None:
+                            conn = self.downloader._open_connection(url)
+                        conn.request('GET', SegmentedDownloader._request_path(url),
+                                     headers={'Range': f"bytes={start}-{end - 1}"})
+                        response = conn.getresponse()
+                        if response.status != 206:
+                            response.read()
+                            raise DownloadError(f"服务器不支持Range请求 (HTTP {response.status})")
+                        out.seek(start)
+                        remaining = end - start
+                        while remaining:
+                            data = response.read(min(self.downloader.chunk_size, remaining))
+                            if not data:
+                                raise DownloadError("连接提前断开")
+                            out.write(data)
+                            remaining -= len(data)
+                            with lock:
+                                fetched[0] += len(data)
+                                if progress:
+                                    progress(fetched[0], total)
+                        if response.will_close:
+                            conn.close()
+                            conn = None
+            finally:
+                if conn is not None:
+                    conn.close()
+
+        with ThreadPoolExecutor(max_workers=min(self.connections, len(ranges)) or 1) as pool:
+            for future in [pool.submit(worker) for _ in range(min(self.connections, len(ranges)))]:
+                future.result()
+        return fetched[0]
+
+    def update(self, url, file_path, seed_path, manifest=None, progress=None):
+        """以seed_path为基础生成url对应的新文件，返回摘要及复用/下载的字节数；失败抛出DownloadError"""
+        with TELEMETRY.span('delta_download', url=url, path=str(file_path), seed=str(seed_path)) as span:
+            result = self._update(url, file_path, seed_path, manifest, progress)
+            span.add_bytes(result['fetched_bytes'])
+            span.set(reused_blocks=result['reused_blocks'], total_blocks=result['total_blocks'])
+            return result
+
+    def _update(self, url, file_path, seed_path, manifest, progress):
+        start_time = time.perf_counter()
+        file_path = Path(file_path)
+        manifest = manifest or self.fetch_manifest(url)
+        if manifest is None:
+            raise DownloadError("镜像站未提供块清单")
+        bs = manifest['block_size']
+        matches = self.match_blocks(manifest, seed_path)
+        match_seconds = time.perf_counter() - start_time
+
+        part_path = file_path.with_name(file_path.name + ".delta")
+        with open(part_path, 'wb') as out:
+            out.truncate(manifest['size'])
+        try:
+            with open(seed_path, 'rb') as seed, open(part_path, 'r+b') as out:
+                for i, offset in matches.items():
+                    seed.seek(offset)
+                    out.seek(i * bs)
+                    out.write(seed.read(min(bs, manifest['size'] - i * bs)))
+            ranges = self._missing_ranges(manifest, matches)
+            fetched = self._fetch_ranges(url, ranges, part_path, progress) if ranges else 0
+            hashes = FirmwareHasher(self.downloader.algorithms).hash_file(part_path)
+            if manifest.get('sha256') and hashes.get('sha256') != manifest['sha256']:
+                raise DownloadError("重建后的文件SHA-256与块清单不一致")
+            os.replace(part_path, file_path)
+        except BaseException:
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+
+        elapsed = time.perf_counter() - start_time
+        result = {name: hashes[name] for name in self.downloader.algorithms}
+        result.update({
+            'size': manifest['size'],
+            'seconds': elapsed,
+            'resumed': 0,
+            'mb_per_s': manifest['size'] / 1024 / 1024 / elapsed if elapsed > 0 else 0.0,
+            'delta': True,
+            'seed': str(seed_path),
+            'reused_blocks': len(matches),
+            'total_blocks': len(manifest['blocks']),
+            'fetched_bytes': fetched,
+            'requests': len(ranges),
+            'match_seconds': match_seconds
+        })
+        return result
+
+# 输入分发器 - 阻塞等待按键事件再交给菜单处理，菜单空闲时不占用CPU
+class InputDispatcher:
+    def __init__(self, mode=None):
+        # keyboard: 全局按键事件；stdin: 逐行读取（无keyboard库、无root权限或无人值守时）
+        mode = mode or os.environ.get('FLASH_INPUT')
+        if mode not in ('keyboard', 'stdin'):
+            mode = 'keyboard' if keyboard is not None else 'stdin'
+        self.mode = mode
+
+    def _read_key(self):
+        """阻塞读取一次按键，返回小写键名"""
+        if self.mode == 'keyboard':
+            try:
+                while True:
+                    event = keyboard.read_event()
+                    if event.event_type == keyboard.KEY_DOWN and event.name:
+                        return event.name.lower()
+            except (ImportError, OSError):
+                # Linux下非root用户无法监听键盘，改为读取标准输入
+                self.mode = 'stdin'
+        try:
+            choice = input("> ").strip().lower()
+        except EOFError:
+            return 'esc'
+        return 'esc' if choice in ('q', 'esc') else choice
+
+    def wait_key(self, keys):
+        """等待keys中的任意一个键并返回它，其他按键被忽略"""
+        keys = [str(k).lower() for k in keys]
+        while True:
+            key = self._read_key()
+            if key in keys:
+                return key
+
+    def wait_any_key(self):
+        """等待任意按键（标准输入模式下为回车）"""
+        self._read_key()
+
+    def dispatch(self, handlers):
+        """handlers为 {键: 处理函数}，等待按键后调用对应的处理函数并返回其结果"""
+        key = self.wait_key(handlers.keys())
+        return handlers[key]()
+
+# 内置固件目录 - 未配置本地清单或镜像时使用，格式与清单文件相同
+BUILTIN_CATALOG = {
+    'index': {
+        'version': 1,
+        'vendors': {
+            'xiaomi': {'manifest': 'xiaomi.json'},
+            'pixel': {'manifest': 'pixel.json'},
+            'samsung': {'manifest': 'samsung.json'},
+            'oneplus': {'manifest': 'oneplus.json'}
+        }
+    },
+    'xiaomi.json': {
+        'devices': ['Xiaomi 14', 'Xiaomi 13 Pro', 'Xiaomi 13', 'Xiaomi 12S Ultra'],
+        'versions': ['澎湃OS 1.0', 'MIUI 14', 'MIUI 13'],
+        'firmware': [
+            {'device': 'Xiaomi 14', 'channel': 'stable', 'size_mb': 4500, 'filename': 'xiaomi14_stable_os.zip'},
+            {'device': 'Xiaomi 13', 'channel': 'stable', 'size_mb': 4200, 'filename': 'miui_FUXI_V14.0.12.11.19_STABLE.zip'},
+            {'device': 'Xiaomi 13 Pro', 'channel': 'stable', 'size_mb': 4300, 'filename': 'miui_NUWA_V14.0.12.11.19_STABLE.zip'},
+            {'device': 'Xiaomi 14', 'channel': 'beta', 'size_mb': 3800, 'filename': 'fuxi_pre_dpp_images.tgz'},
+            {'device': 'Xiaomi 13', 'channel': 'beta', 'size_mb': 3600, 'filename': 'fuxi_pre_dpp_images_23.5.6.tgz'}
+        ]
+    },
+    'pixel.json': {
+        'devices': ['Pixel 8 Pro', 'Pixel 8', 'Pixel 7 Pro', 'Pixel 7'],
+        'versions': ['Android 14 QPR3', 'Android 14 QPR2', 'Android 14'],
+        'firmware': [
+            {'device': 'Pixel 8 Pro', 'channel': 'stable', 'size_mb': 2800, 'filename': 'husky-stable-factory.zip'},
+            {'device': 'Pixel 8', 'channel': 'stable', 'size_mb': 2700, 'filename': 'shiba-stable-factory.zip'},
+            {'device': 'Pixel 8 Pro', 'channel': 'beta', 'size_mb': 2600, 'filename': 'husky-beta-ota.zip'},
+            {'device': 'Pixel 8', 'channel': 'beta', 'size_mb': 2500, 'filename': 'shiba-beta-ota.zip'}
+        ]
+    },
+    'samsung.json': {
+        'devices': ['Galaxy S24 Ultra', 'Galaxy S24+', 'Galaxy S24'],
+        'versions': ['One UI 6.1', 'One UI 6.0', 'One UI 5.1'],
+        'firmware': []
+    },
+    'oneplus.json': {
+        'devices': ['OnePlus 12', 'OnePlus 11', 'OnePlus 10 Pro'],
+        'versions': ['OxygenOS 14', 'OxygenOS 13.1', 'OxygenOS 13'],
+        'firmware': []
+    }
+}
+
+# 本地清单目录：index.json + 各厂商清单文件
+class LocalManifestLoader:
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def load(self, name):
+        try:
+            with open(self.directory / name, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+# 远程镜像清单：本地磁盘缓存，使用ETag/If-Modified-Since重新验证，网络不可用时使用缓存
+class RemoteManifestLoader:
+    def __init__(self, base_url, cache_dir=None, timeout=10):
+        self.base_url = base_url.rstrip('/') + '/'
+        self.cache_dir = Path(cache_dir) if cache_dir else Path("img") / ".catalog_cache"
+        self.timeout = timeout
+        self.stats = {'fetched': 0, 'not_modified': 0, 'cached': 0}
+
+    def _cache_paths(self, name):
+        safe_name = name.replace('/', '_')
+        return self.cache_dir / safe_name, self.cache_dir / (safe_name + ".meta")
+
+    def load(self, name):
+        body_path, meta_path = self._cache_paths(name)
+        meta = {}
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            pass
+        has_cache = body_path.exists()
+
+        request = urllib.request.Request(urljoin(self.base_url, name))
+        if has_cache and meta.get('etag'):
+            request.add_header('If-None-Match', meta['etag'])
+        if has_cache and meta.get('last_modified'):
+            request.add_header('If-Modified-Since', meta['last_modified'])
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                meta = {'etag': response.headers.get('ETag'),
+                        'last_modified': response.headers.get('Last-Modified'),
+                        'fetched_at': time.time()}
+            data = json.loads(body.decode('utf-8'))
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            body_path.write_bytes(body)
+            meta_path.write_text(json.dumps(meta), encoding='utf-8')
+            self.stats['fetched'] += 1
+            return data
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and has_cache:
+                self.stats['not_modified'] += 1
+                return self._read_cache(body_path)
+            if e.code == 404:
+                return None
+        except (urllib.error.URLError, OSError, ValueError):
+            pass
+        # 网络错误时退回到缓存
+        if has_cache:
+            self.stats['cached'] += 1
+            return self._read_cache(body_path)
+        return None
+
+    @staticmethod
+    def _read_cache(body_path):
+        try:
+            return json.loads(body_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+
+# 固件目录 - 顶层索引只列出厂商，厂商清单在首次访问时才加载并建立索引
+class FirmwareCatalog:
+    def __init__(self, loader=None, builtin=None):
+        self.loader = loader
+        self.builtin = BUILTIN_CATALOG if builtin is None else builtin
+        self._index = None
+        self._sections = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls):
+        """FLASH_CATALOG_URL 指定镜像清单地址，FLASH_CATALOG_DIR 指定本地清单目录（默认 catalog/）"""
+        url = os.environ.get('FLASH_CATALOG_URL')
+        if url:
+            return cls(RemoteManifestLoader(url))
+        directory = Path(os.environ.get('FLASH_CATALOG_DIR', 'catalog'))
+        if (directory / "index.json").exists():
+            return cls(LocalManifestLoader(directory))
+        return cls()
+
+    def _load(self, name):
+        data = self.loader.load(name) if self.loader else None
+        return data if data is not None else self.builtin.get(name)
+
+    def index(self):
+        if self._index is None:
+            self._index = self._load('index.json') or self.builtin.get('index') or {'vendors': {}}
+        return self._index
+
+    def systems(self):
+        return list(self.index().get('vendors', {}))
+
+    def section(self, system):
+        """加载并索引某个厂商的清单"""
+        if system in self._sections:
+            return self._sections[system]
+        with self._lock:
+            if system in self._sections:
+                return self._sections[system]
+            vendor = self.index().get('vendors', {}).get(system) or {}
+            data = self._load(vendor.get('manifest', f"{system}.json")) or {}
+            self._sections[system] = self._build_section(data)
+            return self._sections[system]
+
+    @staticmethod
+    def _build_section(data):
+        """建立 设备列表 / 设备->版本列表 / (设备,渠道)->固件 / (设备,渠道,版本)->固件 索引"""
+        devices = list(data.get('devices', []))
+        default_versions = list(data.get('versions', []))
+        versions = {}
+        by_channel = {}
+        by_version = {}
+        for entry in data.get('firmware', []):
+            device = entry['device']
+            if device not in devices:
+                devices.append(device)
+            by_channel.setdefault((device, entry.get('channel', 'stable')), []).append(entry)
+            if entry.get('version'):
+                by_version[(device, entry.get('channel', 'stable'), entry['version'])] = entry
+                device_versions = versions.setdefault(device, [])
+                if entry['version'] not in device_versions:
+                    device_versions.append(entry['version'])
+        return {'devices': devices, 'default_versions': default_versions, 'versions': versions,
+                'by_channel': by_channel, 'by_version': by_version}
+
+    def devices(self, system):
+        return self.section(system)['devices']
+
+    def has_firmware(self, system):
+        """清单中是否有该厂商的固件条目"""
+        return bool(self.section(system)['by_channel'])
+
+    def versions(self, system, device):
+        section = self.section(system)
+        return section['versions'].get(device) or section['default_versions']
+
+    def firmware(self, system, device, channel, version=None):
+        section = self.section(system)
+        if version:
+            entry = section['by_version'].get((device, channel, version))
+            if entry:
+                return entry
+        entries = section['by_channel'].get((device, channel))
+        return entries[0] if entries else None
 
 # 固件源管理
 class FirmwareSource:
-    def __init__(self):
-        # 模拟的固件信息
-        self.sources = {
-            'xiaomi': {
-                'stable': {
-                    'devices': {
-                        'Xiaomi 14': {'size_mb': 4500, 'filename': 'xiaomi14_stable_os.zip'},
-                        'Xiaomi 13': {'size_mb': 4200, 'filename': 'miui_FUXI_V14.0.12.11.19_STABLE.zip'},
-                        'Xiaomi 13 Pro': {'size_mb': 4300, 'filename': 'miui_NUWA_V14.0.12.11.19_STABLE.zip'}
-                    }
-                },
-                'beta': {
-                    'devices': {
-                        'Xiaomi 14': {'size_mb': 3800, 'filename': 'fuxi_pre_dpp_images.tgz'},
-                        'Xiaomi 13': {'size_mb': 3600, 'filename': 'fuxi_pre_dpp_images_23.5.6.tgz'}
-                    }
-                }
-            },
-            'pixel': {
-                'stable': {
-                    'devices': {
-                        'Pixel 8 Pro': {'size_mb': 2800, 'filename': 'husky-stable-factory.zip'},
-                        'Pixel 8': {'size_mb': 2700, 'filename': 'shiba-stable-factory.zip'}
-                    }
-                },
-                'beta': {
-                    'devices': {
-                        'Pixel 8 Pro': {'size_mb': 2600, 'filename': 'husky-beta-ota.zip'},
-                        'Pixel 8': {'size_mb': 2500, 'filename': 'shiba-beta-ota.zip'}
-                    }
-                }
-            }
-        }
+    def __init__(self, catalog=None):
+        self.catalog = catalog or FirmwareCatalog.from_environment()
     
+    def get_available_systems(self):
+        """获取有固件条目的厂商列表，没有条目的厂商不在菜单中显示"""
+        return [system for system in self.catalog.systems() if self.catalog.has_firmware(system)]
+
     def get_available_devices(self, system):
         """获取可用设备列表"""
-        devices = {
-            'xiaomi': ['Xiaomi 14', 'Xiaomi 13 Pro', 'Xiaomi 13', 'Xiaomi 12S Ultra'],
-            'pixel': ['Pixel 8 Pro', 'Pixel 8', 'Pixel 7 Pro', 'Pixel 7'],
-            'samsung': ['Galaxy S24 Ultra', 'Galaxy S24+', 'Galaxy S24'],
-            'oneplus': ['OnePlus 12', 'OnePlus 11', 'OnePlus 10 Pro']
-        }
-        return devices.get(system, [])
+        return self.catalog.devices(system)
     
     def get_available_versions(self, system, device):
         """获取可用版本列表"""
-        versions = {
-            'xiaomi': ['澎湃OS 1.0', 'MIUI 14', 'MIUI 13'],
-            'pixel': ['Android 14 QPR3', 'Android 14 QPR2', 'Android 14'],
-            'samsung': ['One UI 6.1', 'One UI 6.0', 'One UI 5.1'],
-            'oneplus': ['OxygenOS 14', 'OxygenOS 13.1', 'OxygenOS 13']
-        }
-        return versions.get(system, [])
+        return self.catalog.versions(system, device)
     
-    def get_firmware_info(self, system, device, channel):
+    def get_firmware_info(self, system, device, channel, version=None):
         """获取固件信息"""
-        if system in self.sources and channel in self.sources[system]:
-            if device in self.sources[system][channel]['devices']:
-                return self.sources[system][channel]['devices'][device]
+        return self.catalog.firmware(system, device, channel, version)
+
+    def get_download_url(self, system, channel, firmware_info):
+        """固件下载地址：条目自带url优先，否则使用 FLASH_MIRROR_URL 镜像根地址拼接"""
+        if firmware_info.get('url'):
+            return firmware_info['url']
+        mirror = os.environ.get('FLASH_MIRROR_URL')
+        if mirror:
+            return f"{mirror.rstrip('/')}/{system}/{channel}/{firmware_info['filename']}"
         return None
 
 # 固件管理模块 - 保留原有核心功能
@@ -152,6 +3818,19 @@ class FirmwareManager:
         self.selected_device = None
         self.selected_version = None
         self.adb_manager = ADBManager()
+        self.hasher = FirmwareHasher()
+        self.firmware_index = FirmwareIndex()
+        self.firmware_store = FirmwareStore()
+        self.package_inventories = {}
+        self.firmware_watcher = None
+        self.input = InputDispatcher()
+        self.downloader = SegmentedDownloader()
+        self.last_download = None
+        # 刷写发送端，None时使用模拟发送
+        self.flash_sender = None
+        self.fastboot = None
+        # 刷写流程的日志输出函数，批处理模式下由BatchRunner替换为写标准错误
+        self.log = print
 
     def show_menu(self):
         """显示主菜单 - 保留原有界面"""
@@ -163,15 +3842,12 @@ class FirmwareManager:
         print("3. ADB工具箱 (50+功能)")
         print("ESC. 退出程序\n")
 
-        while True:
-            if keyboard.is_pressed('1'):
-                return self.download_firmware()
-            elif keyboard.is_pressed('2'):
-                return self.select_local_firmware()
-            elif keyboard.is_pressed('3'):
-                return self.show_adb_toolbox()
-            elif keyboard.is_pressed('esc'):
-                sys.exit()
+        return self.input.dispatch({
+            '1': self.download_firmware,
+            '2': self.select_local_firmware,
+            '3': self.show_adb_toolbox,
+            'esc': sys.exit
+        })
 
     def download_firmware(self):
         """下载固件 - 保留原有功能"""
@@ -203,23 +3879,15 @@ class FirmwareManager:
         clear_screen()
         legal_notice()
         print("\n选择操作系统类型：")
-        print("1. 小米 (MIUI/澎湃OS)")
-        print("2. Google Pixel")
-        print("3. Samsung")
-        print("4. OnePlus")
+        labels = {'xiaomi': "小米 (MIUI/澎湃OS)", 'pixel': "Google Pixel", 'samsung': "Samsung", 'oneplus': "OnePlus"}
+        systems = {}
+        for i, system in enumerate(self.source_manager.get_available_systems()[:9], 1):
+            systems[str(i)] = system
+            print(f"{i}. {labels.get(system, system)}")
         print("ESC. 返回上级菜单\n")
         
-        while True:
-            if keyboard.is_pressed('1'):
-                return 'xiaomi'
-            elif keyboard.is_pressed('2'):
-                return 'pixel'
-            elif keyboard.is_pressed('3'):
-                return 'samsung'
-            elif keyboard.is_pressed('4'):
-                return 'oneplus'
-            elif keyboard.is_pressed('esc'):
-                return None
+        key = self.input.wait_key(list(systems) + ['esc'])
+        return systems.get(key)
 
     def select_device(self, system):
         """选择设备型号"""
@@ -232,12 +3900,8 @@ class FirmwareManager:
             print(f"{i}. {device}")
         print("ESC. 返回上级菜单\n")
         
-        while True:
-            for i in range(1, len(devices) + 1):
-                if keyboard.is_pressed(str(i)):
-                    return devices[i-1]
-            if keyboard.is_pressed('esc'):
-                return None
+        key = self.input.wait_key([str(i) for i in range(1, len(devices) + 1)] + ['esc'])
+        return None if key == 'esc' else devices[int(key) - 1]
 
     def select_version(self, system, device):
         """选择系统版本"""
@@ -250,12 +3914,8 @@ class FirmwareManager:
             print(f"{i}. {version}")
         print("ESC. 返回上级菜单\n")
         
-        while True:
-            for i in range(1, len(versions) + 1):
-                if keyboard.is_pressed(str(i)):
-                    return versions[i-1]
-            if keyboard.is_pressed('esc'):
-                return None
+        key = self.input.wait_key([str(i) for i in range(1, len(versions) + 1)] + ['esc'])
+        return None if key == 'esc' else versions[int(key) - 1]
 
     def select_channel(self):
         """选择下载渠道"""
@@ -267,15 +3927,12 @@ class FirmwareManager:
         print("3. 自定义镜像库")
         print("ESC. 返回上级菜单\n")
         
-        while True:
-            if keyboard.is_pressed('1'):
-                return "stable"
-            elif keyboard.is_pressed('2'):
-                return "beta"
-            elif keyboard.is_pressed('3'):
-                return self.custom_mirror()
-            elif keyboard.is_pressed('esc'):
-                return None
+        return self.input.dispatch({
+            '1': lambda: "stable",
+            '2': lambda: "beta",
+            '3': self.custom_mirror,
+            'esc': lambda: None
+        })
 
     def custom_mirror(self):
         """处理自定义镜像库"""
@@ -292,8 +3949,13 @@ class FirmwareManager:
             size_mb = int(input("文件大小(MB): ").strip() or "2000")
         except ValueError:
             size_mb = 2000
+
+        url = input("下载地址 (http/https，可留空): ").strip()
+        if url and urlparse(url).scheme not in ('http', 'https'):
+            print("\033[91m不支持的下载地址，将不使用镜像下载\033[0m")
+            url = None
             
-        return {'type': 'custom', 'filename': filename, 'size_mb': size_mb}
+        return {'type': 'custom', 'filename': filename, 'size_mb': size_mb, 'url': url or None}
 
     def create_dummy_file(self, file_path, size_mb):
         """创建指定大小的空文件"""
@@ -306,8 +3968,11 @@ class FirmwareManager:
             print(f"创建文件失败: {e}")
             return False
 
-    def download_with_progress(self, file_path, size_mb):
-        """模拟带进度条的下载过程"""
+    def download_with_progress(self, file_path, size_mb, url=None):
+        """带进度条的下载过程；提供url时分段下载，否则模拟下载"""
+        self.last_download = None
+        if url:
+            return self._download_from_url(file_path, url)
         try:
             if file_path.exists():
                 existing_size = file_path.stat().st_size / (1024 * 1024)
@@ -320,7 +3985,7 @@ class FirmwareManager:
             for i in range(101):
                 bar = f"\r[{'█' * (i//2)}{' ' * (50 - i//2)}] {i}% "
                 print(f"\033[93m{bar}\033[0m", end='', flush=True)
-                time.sleep(0.03)
+                ui_sleep(0.03)
             
             if self.create_dummy_file(file_path, size_mb):
                 print("\n下载完成!")
@@ -333,6 +3998,92 @@ class FirmwareManager:
             print(f"\n下载过程出错: {e}")
             return False
 
+    def _download_from_url(self, file_path, url):
+        """使用分段下载引擎下载，进度条按实际接收的字节数刷新"""
+        start = time.perf_counter()
+
+        def progress(done, total):
+            elapsed = time.perf_counter() - start
+            speed = done / 1024 / 1024 / elapsed if elapsed > 0 else 0
+            if total:
+                i = int(done * 100 / total)
+                bar = f"\r[{'█' * (i//2)}{' ' * (50 - i//2)}] {i}% {done / 1024 / 1024:.0f}/{total / 1024 / 1024:.0f} MB {speed:.1f} MB/s "
+            else:
+                bar = f"\r已下载 {done / 1024 / 1024:.0f} MB {speed:.1f} MB/s "
+            print(f"\033[93m{bar}\033[0m", end='', flush=True)
+
+        try:
+            info = self.downloader.probe(url)
+            if file_path.exists() and info['size'] is not None and file_path.stat().st_size == info['size']:
+                print(f"\n文件已存在，跳过下载")
+                return True
+            if info['ranges'] and self._delta_download(file_path, info['url'], progress):
+                return True
+            print(f"\n开始下载... 文件大小: {info['size'] / 1024 / 1024:.0f} MB" if info['size'] else "\n开始下载...")
+            if not info['ranges']:
+                print("服务器不支持分段下载，使用单连接")
+            self.last_download = self.downloader.download(url, file_path, progress=progress)
+            if self.last_download['resumed']:
+                print(f"\n已从断点续传 ({self.last_download['resumed'] / 1024 / 1024:.0f} MB)")
+            print(f"\n下载完成! 平均速度 {self.last_download['mb_per_s']:.1f} MB/s")
+            return True
+        except (DownloadError, OSError, http.client.HTTPException) as e:
+            print(f"\n下载过程出错: {e}")
+            print("再次下载将从断点继续")
+            return False
+
+    @staticmethod
+    def use_store():
+        return os.environ.get('FLASH_STORE', '1') != '0'
+
+    def _fetch_from_store(self, sha256, file_path):
+        """按摘要从仓库（或索引中已有的同内容文件）生成目标文件，命中时设置last_download"""
+        if not sha256:
+            return False
+        if self.firmware_store.lookup(sha256) is None:
+            # 内容可能已在img/中但尚未收入仓库
+            for entry in self.firmware_index.scan():
+                if entry.get('sha256') == sha256 and self.firmware_index.get(entry['path']):
+                    try:
+                        self.firmware_store.add(entry['path'], entry)
+                    except (OSError, ValueError):
+                        continue
+                    self.firmware_index.update(entry['path'], entry, FirmwareStore.entry_metadata(entry))
+                    break
+        try:
+            meta = self.firmware_store.materialize(sha256, file_path)
+        except OSError:
+            return False
+        if meta is None:
+            return False
+        self.firmware_store.save()
+        self.last_download = dict(meta, seconds=0.0, resumed=0, mb_per_s=0.0, store=True)
+        return True
+
+    def _delta_download(self, file_path, url, progress):
+        """同目录存在旧版本且镜像站提供块清单时增量更新；不可用或失败时返回False改为完整下载"""
+        if os.environ.get('FLASH_DELTA', '1') == '0':
+            return False
+        seed = DeltaUpdater.find_seed(file_path)
+        if seed is None:
+            return False
+        updater = DeltaUpdater(self.downloader, connections=self.downloader.connections)
+        manifest = updater.fetch_manifest(url)
+        if manifest is None:
+            return False
+        print(f"\n发现旧版本 {seed.name}，尝试增量更新...")
+        try:
+            self.last_download = updater.update(url, file_path, seed, manifest, progress)
+        except (DownloadError, OSError, http.client.HTTPException) as e:
+            print(f"\n增量更新失败: {e}，改为完整下载")
+            self.last_download = None
+            return False
+        result = self.last_download
+        print(f"\n增量更新完成! 复用 {result['reused_blocks']}/{result['total_blocks']} 块，"
+              f"下载 {result['fetched_bytes'] / 1024 / 1024:.1f} MB / {result['size'] / 1024 / 1024:.1f} MB "
+              f"({result['requests']} 次请求)，耗时 {result['seconds']:.1f}s")
+        return True
+
     def perform_download(self, system, device, version, channel_info):
         """执行下载流程"""
         clear_screen()
@@ -349,16 +4100,18 @@ class FirmwareManager:
         if isinstance(channel_info, dict) and channel_info['type'] == 'custom':
             filename = channel_info['filename']
             size_mb = channel_info['size_mb']
+            url = channel_info.get('url')
             source_name = "自定义镜像库"
         else:
-            firmware_info = self.source_manager.get_firmware_info(system, device, channel_type)
+            firmware_info = self.source_manager.get_firmware_info(system, device, channel_type, version)
             if not firmware_info:
                 print(f"\033[91m错误: 找不到 {device} 的 {channel_type} 版本固件\033[0m")
-                time.sleep(2)
+                ui_sleep(2)
                 return False
             
             filename = firmware_info['filename']
             size_mb = firmware_info['size_mb']
+            url = self.source_manager.get_download_url(system, channel_type, firmware_info)
             source_name = "官方镜像站"
         
         safe_device_dir = device.replace(' ', '')
@@ -371,14 +4124,40 @@ class FirmwareManager:
         print(f"文件名: {filename}")
         print(f"保存路径: {file_path}")
         print(f"文件大小: {size_mb} MB")
+        if url:
+            print(f"下载地址: {url}")
         
-        print("\n连接镜像服务器...")
-        time.sleep(1)
+        expected_sha256 = (channel_info if isinstance(channel_info, dict) and channel_info['type'] == 'custom'
+                           else firmware_info).get('sha256')
+        if self.use_store() and self._fetch_from_store(expected_sha256, file_path):
+            print(f"\n仓库中已有相同内容 (SHA-256 {expected_sha256[:16]}...)，跳过下载和校验")
+            downloaded = True
+        else:
+            print("\n连接镜像服务器...")
+            if not url:
+                ui_sleep(1)
+            downloaded = self.download_with_progress(file_path, size_mb, url)
         
-        if self.download_with_progress(file_path, size_mb):
+        if downloaded:
             if file_path.exists():
                 file_size = file_path.stat().st_size
-                md5_hash = self.calculate_md5(file_path)
+                if self.last_download:
+                    # 摘要已在下载过程中计算
+                    hashes = self.last_download
+                else:
+                    print("\n正在校验固件...")
+                    hashes = self.calculate_hashes(file_path)
+                metadata = {'system': system, 'device': device, 'version': version, 'channel': channel_type}
+                if self.use_store() and hashes.get('sha256'):
+                    try:
+                        mode, saved = self.firmware_store.add(file_path, hashes)
+                        self.firmware_store.save()
+                        if saved:
+                            print(f"与仓库中已有内容相同，已改为{mode}，节省 {saved / 1024 / 1024:.0f} MB")
+                    except (OSError, ValueError) as e:
+                        print(f"加入固件仓库失败: {e}")
+                self.firmware_index.update(file_path, hashes, metadata)
+                self.firmware_index.save()
                 
                 self.selected_firmware = str(file_path)
                 self.firmware_info = {
@@ -388,7 +4167,9 @@ class FirmwareManager:
                     'version': version,
                     'channel': channel_type,
                     'size': f"{file_size / 1024 / 1024 / 1024:.2f} GB",
-                    'md5': md5_hash,
+                    'md5': hashes['md5'],
+                    'sha1': hashes['sha1'],
+                    'sha256': hashes['sha256'],
                     'build_date': time.strftime("%Y-%m-%d"),
                     'source': source_name,
                     'file_path': str(file_path)
@@ -398,24 +4179,32 @@ class FirmwareManager:
                 print(f"设备：{device}")
                 print(f"版本：{version}")
                 print(f"文件大小：{self.firmware_info['size']}")
+                print(f"SHA-256：{hashes['sha256']}")
+                print(f"校验速度：{hashes['mb_per_s']:.1f} MB/s")
                 print(f"保存位置：{file_path}")
             else:
                 print("\033[91m文件创建失败！\033[0m")
                 return False
         else:
             print("\033[91m下载失败！\033[0m")
-            time.sleep(2)
+            ui_sleep(2)
             return False
         
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
         return True
 
+    def calculate_hashes(self, file_path, show_progress=True):
+        """计算文件的MD5/SHA-1/SHA-256（单次读取）"""
+        result = self.hasher.hash_file(file_path, progress=print_hash_progress if show_progress else None)
+        if show_progress:
+            print()
+        return result
+
     def calculate_md5(self, file_path):
-        """计算文件的MD5值（模拟）"""
+        """计算文件的MD5值"""
         if file_path.exists():
-            content = f"{file_path}{file_path.stat().st_size}".encode()
-            return hashlib.md5(content).hexdigest()
+            return self.calculate_hashes(file_path, show_progress=False)['md5']
         return "0" * 32
 
     def select_local_firmware(self):
@@ -425,36 +4214,47 @@ class FirmwareManager:
         print("\n本地固件选择：")
         print("支持格式：.zip / .img / .bin / .tgz\n")
         
-        img_dir = Path("img")
-        firmware_files = []
+        img_dir = self.firmware_index.root
         
         if img_dir.exists():
+            if self.firmware_watcher is None and os.environ.get('FLASH_WATCH', '1') != '0' \
+                    and FirmwareWatcher.available():
+                self.firmware_watcher = FirmwareWatcher(self.firmware_index)
+                if not self.firmware_watcher.start():
+                    self.firmware_watcher = False
+            firmware_files = self.firmware_index.scan(incremental=bool(self.firmware_watcher))
             print("发现以下固件文件：")
-            for ext in ['*.zip', '*.img', '*.bin', '*.tgz']:
-                for fw_file in img_dir.rglob(ext):
-                    firmware_files.append(fw_file)
-                    file_size = fw_file.stat().st_size / (1024 * 1024 * 1024)
-                    print(f"{len(firmware_files)}. {fw_file.name} ({file_size:.2f} GB) - {fw_file.parent}")
+            for i, entry in enumerate(firmware_files, 1):
+                file_size = entry['size'] / (1024 * 1024 * 1024)
+                verified = " [已校验]" if entry.get('sha256') else ""
+                print(f"{i}. {entry['name']} ({file_size:.2f} GB) - {Path(entry['path']).parent}{verified}")
             
             if not firmware_files:
                 print("  暂无固件文件，请先下载固件")
                 print("\n按任意键返回...")
-                keyboard.read_event()
+                self.input.wait_any_key()
                 return False
         else:
             print("img目录不存在，请先下载固件")
             print("\n按任意键返回...")
-            keyboard.read_event()
+            self.input.wait_any_key()
             return False
         
         print("\n请输入文件编号或输入完整路径：")
+        print("(输入 r 重建索引, v 校验全部固件, d 固件仓库去重)")
         
         while True:
             choice = input("选择: ").strip()
             
             if choice.isdigit() and 1 <= int(choice) <= len(firmware_files):
-                selected_file = firmware_files[int(choice) - 1]
+                selected_file = Path(firmware_files[int(choice) - 1]['path'])
                 return self._process_selected_file(selected_file)
+            elif choice.lower() in ('r', 'v'):
+                self.rebuild_firmware_index(verify=(choice.lower() == 'v'))
+                return self.select_local_firmware()
+            elif choice.lower() == 'd':
+                self.store_maintenance()
+                return self.select_local_firmware()
             else:
                 file_path = Path(choice)
                 if file_path.exists() and file_path.is_file():
@@ -462,26 +4262,93 @@ class FirmwareManager:
                 else:
                     print("\033[91m无效选择！请重新输入\033[0m")
 
+    def rebuild_firmware_index(self, verify=False):
+        """重新计算全部固件摘要并刷新索引"""
+        print("\n正在校验全部固件..." if verify else "\n正在重建固件索引...")
+
+        def report(path, result, ok):
+            if 'error' in result:
+                print(f"  {Path(path).name}: \033[91m读取失败 {result['error']}\033[0m")
+            elif ok:
+                print(f"  {Path(path).name}: OK ({result['mb_per_s']:.1f} MB/s)")
+            else:
+                print(f"  {Path(path).name}: \033[91m摘要与索引记录不一致\033[0m")
+
+        summary = self.firmware_index.rebuild(self.hasher, verify=verify, on_result=report)
+        print(f"\n共处理 {summary['files']} 个文件")
+        if summary['mismatched']:
+            print(f"\033[91m{len(summary['mismatched'])} 个文件内容已改变\033[0m")
+        print("\n按任意键继续...")
+        self.input.wait_any_key()
+
+    def store_maintenance(self):
+        """固件仓库去重报告、去重与垃圾回收"""
+        print("\n正在统计固件仓库...")
+        entries = self.firmware_index.scan()
+        report = self.firmware_store.report(entries)
+        gb = 1024 * 1024 * 1024
+        print(f"文件 {report['files']} 个，不同内容 {report['contents']} 份（{report['unhashed']} 个文件尚未校验）")
+        print(f"逻辑大小 {report['logical'] / gb:.2f} GB，去重后 {report['unique'] / gb:.2f} GB，"
+              f"实际占用 {report['physical'] / gb:.2f} GB")
+        print(f"可回收 {report['reclaimable'] / gb:.2f} GB，仓库中无引用的对象 {report['store_only'] / gb:.2f} GB")
+        for item in report['duplicates'][:10]:
+            print(f"  {item['sha256'][:12]} {item['size'] / 1024 / 1024:.0f} MB × {item['copies']}:")
+            for path in item['paths']:
+                print(f"    {path}")
+        if report['unhashed']:
+            print("提示：未校验的文件不参与去重，可先输入 r 重建索引")
+
+        if report['reclaimable'] and input("\n是否对重复文件去重? (y/n): ").strip().lower() == 'y':
+            result = self.firmware_store.dedupe(self.firmware_index)
+            print(f"已链接 {result['linked']} 个文件，节省 {result['saved'] / gb:.2f} GB")
+        if input("是否清理无引用的仓库对象? (y/n): ").strip().lower() == 'y':
+            referenced = {e['sha256'] for e in self.firmware_index.scan() if e.get('sha256')}
+            result = self.firmware_store.gc(referenced)
+            print(f"已删除 {result['removed']} 个对象，释放 {result['freed'] / gb:.2f} GB")
+        print("\n按任意键继续...")
+        self.input.wait_any_key()
+
     def _process_selected_file(self, file_path):
         """处理选中的文件"""
         self.selected_firmware = str(file_path)
         self._analyze_firmware(file_path)
+        if self.firmware_info.get('ota_partitions'):
+            self.extract_ota_payload(file_path)
         return True
 
+    def extract_ota_payload(self, file_path):
+        """提取OTA包中的分区镜像到固件目录下的 images/"""
+        choice = input("\n是否提取分区镜像? (y/n): ").strip().lower()
+        if choice != 'y':
+            return
+        payload = OTAPayload(file_path)
+        names = [n.strip() for n in input("分区名 (逗号分隔，留空为全部): ").split(',') if n.strip()] or None
+        out_dir = Path(file_path).parent / "images"
+        print(f"\n正在提取到 {out_dir} ...")
+        try:
+            result = payload.extract(out_dir, names, progress=print_hash_progress)
+        except (ValueError, OSError) as e:
+            print(f"\n\033[91m提取失败: {e}\033[0m")
+            return
+        print()
+        for partition in result['partitions']:
+            status = {True: "校验通过", False: "\033[91m校验失败\033[0m", None: "无校验值"}[partition['verified']]
+            print(f"  {partition['name']}.img ({partition['size'] / 1024 / 1024:.1f} MB) {status}")
+        print(f"提取完成，耗时 {result['seconds']:.1f} 秒")
+
     def _analyze_firmware(self, file_path):
         """分析固件文件"""
         file_size = file_path.stat().st_size
-        
-        path_parts = file_path.parts
-        system = "unknown"
-        device = "未知设备"
-        
-        if "img" in path_parts:
-            img_index = path_parts.index("img")
-            if img_index + 1 < len(path_parts):
-                system = path_parts[img_index + 1]
-            if img_index + 2 < len(path_parts):
-                device = path_parts[img_index + 2].replace('_', ' ')
+        entry = self.firmware_index.get(file_path)
+        if not entry or not entry.get('sha256'):
+            self.log("\n正在校验固件...")
+        entry, rehashed = self.firmware_index.ensure_hashes(
+            file_path, self.hasher, progress=lambda done, total: print_hash_progress(done, total, self.log))
+        if rehashed:
+            self.log()
+        hashes = entry
+        system = entry.get('system', 'unknown')
+        device = entry.get('device', '未知设备')
         
         self.firmware_info = {
             'name': file_path.name,
@@ -492,15 +4359,40 @@ class FirmwareManager:
             'path': str(file_path.parent),
             'modified': time.ctime(file_path.stat().st_mtime),
             'valid': True,
+            'md5': hashes['md5'],
+            'sha1': hashes['sha1'],
+            'sha256': hashes['sha256'],
             'file_path': str(file_path)
         }
+        if rehashed:
+            # 刚按文件内容算出的摘要，刷写前的校验可以直接沿用
+            self.firmware_info['verified_stamp'] = firmware_stamp(file_path)
         
-        print(f"\n固件分析完成：")
-        print(f"文件名：{self.firmware_info['name']}")
-        print(f"大小：{self.firmware_info['size']}")
-        print(f"系统：{self.firmware_info['system']}")
-        print(f"设备：{self.firmware_info['device']}")
-        time.sleep(2)
+        self.log(f"\n固件分析完成：")
+        self.log(f"文件名：{self.firmware_info['name']}")
+        self.log(f"大小：{self.firmware_info['size']}")
+        self.log(f"系统：{self.firmware_info['system']}")
+        self.log(f"设备：{self.firmware_info['device']}")
+        self.log(f"MD5：{hashes['md5']}")
+        self.log(f"SHA-256：{hashes['sha256']}")
+        if rehashed:
+            self.log(f"校验速度：{hashes['mb_per_s']:.1f} MB/s")
+        else:
+            self.log("摘要来自固件索引（文件未变化）")
+        if OTAPayload.contains_payload(file_path):
+            try:
+                partitions = OTAPayload(file_path).list_partitions()
+            except (ValueError, OSError, zipfile.BadZipFile) as e:
+                self.log(f"OTA payload 解析失败: {e}")
+            else:
+                self.firmware_info['type'] = 'A/B OTA'
+                self.firmware_info['ota_partitions'] = partitions
+                self.log(f"OTA分区 ({len(partitions)} 个)：")
+                for partition in partitions:
+                    kind = "完整" if partition['full'] else "增量"
+                    self.log(f"  {partition['name']:<16} {partition['size'] / 1024 / 1024:>9.1f} MB  {kind}  "
+                          f"{(partition['hash'] or '')[:16]}")
+        ui_sleep(2)
 
     # ADB工具箱功能
     def show_adb_toolbox(self):
@@ -515,21 +4407,15 @@ class FirmwareManager:
         print("5. 调试工具")
         print("6. 返回主菜单\n")
         
-        while True:
-            if keyboard.is_pressed('1'):
-                return self.show_device_management()
-            elif keyboard.is_pressed('2'):
-                return self.show_app_management()
-            elif keyboard.is_pressed('3'):
-                return self.show_file_operations()
-            elif keyboard.is_pressed('4'):
-                return self.show_system_info()
-            elif keyboard.is_pressed('5'):
-                return self.show_debug_tools()
-            elif keyboard.is_pressed('6'):
-                return self.show_menu()
-            elif keyboard.is_pressed('esc'):
-                return self.show_menu()
+        return self.input.dispatch({
+            '1': self.show_device_management,
+            '2': self.show_app_management,
+            '3': self.show_file_operations,
+            '4': self.show_system_info,
+            '5': self.show_debug_tools,
+            '6': self.show_menu,
+            'esc': self.show_menu
+        })
 
     def show_device_management(self):
         """设备管理功能"""
@@ -543,34 +4429,24 @@ class FirmwareManager:
         print("5. 重启到Bootloader")
         print("6. 查看设备状态")
         print("7. 查看电池信息")
-        print("8. 返回工具箱\n")
+        print("8. 批量执行命令(所有设备)")
+        print("9. 返回工具箱\n")
         
-        while True:
-            if keyboard.is_pressed('1'):
-                self.check_connected_devices()
-                break
-            elif keyboard.is_pressed('2'):
-                self.adb_manager.select_device()
-                break
-            elif keyboard.is_pressed('3'):
-                self.reboot_device()
-                break
-            elif keyboard.is_pressed('4'):
-                self.reboot_recovery()
-                break
-            elif keyboard.is_pressed('5'):
-                self.reboot_bootloader()
-                break
-            elif keyboard.is_pressed('6'):
-                self.get_device_state()
-                break
-            elif keyboard.is_pressed('7'):
-                self.get_battery_info()
-                break
-            elif keyboard.is_pressed('8'):
-                return self.show_adb_toolbox()
-            elif keyboard.is_pressed('esc'):
-                return self.show_adb_toolbox()
+        actions = {
+            '1': self.check_connected_devices,
+            '2': self.adb_manager.select_device,
+            '3': self.reboot_device,
+            '4': self.reboot_recovery,
+            '5': self.reboot_bootloader,
+            '6': self.get_device_state,
+            '7': self.get_battery_info,
+            '8': self.batch_command
+        }
+        key = self.input.wait_key(list(actions) + ['9', 'esc'])
+        if key in actions:
+            actions[key]()
+            return
+        return self.show_adb_toolbox()
 
     def show_app_management(self):
         """应用管理功能"""
@@ -585,37 +4461,25 @@ class FirmwareManager:
         print("6. 清除应用数据")
         print("7. 强制停止应用")
         print("8. 查看应用信息")
+        print("0. 批量安装应用(所有设备)")
         print("9. 返回工具箱\n")
         
-        while True:
-            if keyboard.is_pressed('1'):
-                self.list_apps()
-                break
-            elif keyboard.is_pressed('2'):
-                self.list_system_apps()
-                break
-            elif keyboard.is_pressed('3'):
-                self.list_third_party_apps()
-                break
-            elif keyboard.is_pressed('4'):
-                self.install_app()
-                break
-            elif keyboard.is_pressed('5'):
-                self.uninstall_app()
-                break
-            elif keyboard.is_pressed('6'):
-                self.clear_app_data()
-                break
-            elif keyboard.is_pressed('7'):
-                self.force_stop_app()
-                break
-            elif keyboard.is_pressed('8'):
-                self.get_app_info()
-                break
-            elif keyboard.is_pressed('9'):
-                return self.show_adb_toolbox()
-            elif keyboard.is_pressed('esc'):
-                return self.show_adb_toolbox()
+        actions = {
+            '1': self.list_apps,
+            '2': self.list_system_apps,
+            '3': self.list_third_party_apps,
+            '4': self.install_app,
+            '5': self.uninstall_app,
+            '6': self.clear_app_data,
+            '7': self.force_stop_app,
+            '8': self.get_app_info,
+            '0': self.bulk_install
+        }
+        key = self.input.wait_key(list(actions) + ['9', 'esc'])
+        if key in actions:
+            actions[key]()
+            return
+        return self.show_adb_toolbox()
 
     def show_file_operations(self):
         """文件操作功能"""
@@ -628,35 +4492,23 @@ class FirmwareManager:
         print("4. 进入Shell")
         print("5. 查看当前目录")
         print("6. 创建目录")
-        print("7. 删除文件/目录")
-        print("8. 返回工具箱\n")
-        
-        while True:
-            if keyboard.is_pressed('1'):
-                self.push_file()
-                break
-            elif keyboard.is_pressed('2'):
-                self.pull_file()
-                break
-            elif keyboard.is_pressed('3'):
-                self.list_files()
-                break
-            elif keyboard.is_pressed('4'):
-                self.enter_shell()
-                break
-            elif keyboard.is_pressed('5'):
-                self.show_current_dir()
-                break
-            elif keyboard.is_pressed('6'):
-                self.create_directory()
-                break
-            elif keyboard.is_pressed('7'):
-                self.delete_file()
-                break
-            elif keyboard.is_pressed('8'):
-                return self.show_adb_toolbox()
-            elif keyboard.is_pressed('esc'):
-                return self.show_adb_toolbox()
+        print("7. 删除文件/目录")
+        print("8. 返回工具箱\n")
+        
+        actions = {
+            '1': self.push_file,
+            '2': self.pull_file,
+            '3': self.list_files,
+            '4': self.enter_shell,
+            '5': self.show_current_dir,
+            '6': self.create_directory,
+            '7': self.delete_file
+        }
+        key = self.input.wait_key(list(actions) + ['8', 'esc'])
+        if key in actions:
+            actions[key]()
+            return
+        return self.show_adb_toolbox()
 
     def show_system_info(self):
         """系统信息功能"""
@@ -670,34 +4522,26 @@ class FirmwareManager:
         print("5. 查看网络信息")
         print("6. 查看屏幕信息")
         print("7. 查看电池状态")
-        print("8. 返回工具箱\n")
+        print("8. 设备完整快照")
+        print("9. 清点所有设备")
+        print("0. 返回工具箱\n")
         
-        while True:
-            if keyboard.is_pressed('1'):
-                self.get_system_props()
-                break
-            elif keyboard.is_pressed('2'):
-                self.get_cpu_info()
-                break
-            elif keyboard.is_pressed('3'):
-                self.get_memory_info()
-                break
-            elif keyboard.is_pressed('4'):
-                self.get_storage_info()
-                break
-            elif keyboard.is_pressed('5'):
-                self.get_network_info()
-                break
-            elif keyboard.is_pressed('6'):
-                self.get_screen_info()
-                break
-            elif keyboard.is_pressed('7'):
-                self.get_battery_info()
-                break
-            elif keyboard.is_pressed('8'):
-                return self.show_adb_toolbox()
-            elif keyboard.is_pressed('esc'):
-                return self.show_adb_toolbox()
+        actions = {
+            '1': self.get_system_props,
+            '2': self.get_cpu_info,
+            '3': self.get_memory_info,
+            '4': self.get_storage_info,
+            '5': self.get_network_info,
+            '6': self.get_screen_info,
+            '7': self.get_battery_info,
+            '8': self.show_device_snapshot,
+            '9': self.device_inventory
+        }
+        key = self.input.wait_key(list(actions) + ['0', 'esc'])
+        if key in actions:
+            actions[key]()
+            return
+        return self.show_adb_toolbox()
 
     def show_debug_tools(self):
         """调试工具"""
@@ -711,34 +4555,24 @@ class FirmwareManager:
         print("5. 屏幕录制")
         print("6. 性能监控")
         print("7. 压力测试")
-        print("8. 返回工具箱\n")
+        print("8. ADB延迟对比")
+        print("9. 返回工具箱\n")
         
-        while True:
-            if keyboard.is_pressed('1'):
-                self.view_logcat()
-                break
-            elif keyboard.is_pressed('2'):
-                self.clear_logcat()
-                break
-            elif keyboard.is_pressed('3'):
-                self.bug_report()
-                break
-            elif keyboard.is_pressed('4'):
-                self.take_screenshot()
-                break
-            elif keyboard.is_pressed('5'):
-                self.screen_record()
-                break
-            elif keyboard.is_pressed('6'):
-                self.performance_monitor()
-                break
-            elif keyboard.is_pressed('7'):
-                self.stress_test()
-                break
-            elif keyboard.is_pressed('8'):
-                return self.show_adb_toolbox()
-            elif keyboard.is_pressed('esc'):
-                return self.show_adb_toolbox()
+        actions = {
+            '1': self.view_logcat,
+            '2': self.clear_logcat,
+            '3': self.bug_report,
+            '4': self.take_screenshot,
+            '5': self.screen_record,
+            '6': self.performance_monitor,
+            '7': self.stress_test,
+            '8': self.adb_latency_test
+        }
+        key = self.input.wait_key(list(actions) + ['9', 'esc'])
+        if key in actions:
+            actions[key]()
+            return
+        return self.show_adb_toolbox()
 
     # 具体的ADB功能实现
     def check_connected_devices(self):
@@ -753,7 +4587,7 @@ class FirmwareManager:
         else:
             print("未找到连接的设备")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def reboot_device(self):
         clear_screen()
@@ -762,7 +4596,7 @@ class FirmwareManager:
         result = self.adb_manager.run_adb_command("reboot")
         print(result)
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def reboot_recovery(self):
         clear_screen()
@@ -771,7 +4605,7 @@ class FirmwareManager:
         result = self.adb_manager.run_adb_command("reboot recovery")
         print(result)
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def reboot_bootloader(self):
         clear_screen()
@@ -779,8 +4613,39 @@ class FirmwareManager:
         print("\n重启到Bootloader...")
         result = self.adb_manager.run_adb_command("reboot bootloader")
         print(result)
+        if os.environ.get('FLASH_FASTBOOT') and not result.startswith("Error"):
+            print("\n等待设备进入fastboot...")
+            if self.connect_fastboot(wait=30):
+                info = self.fastboot_info()
+                for name, value in info.items():
+                    print(f"{name}: {value}")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
+
+    def connect_fastboot(self, target=None, wait=0):
+        """连接fastboot设备（FLASH_FASTBOOT=tcp:主机[:端口]），成功后刷写改走真实发送端"""
+        target = target or os.environ.get('FLASH_FASTBOOT')
+        if not target:
+            return None
+        if self.fastboot is not None:
+            self.fastboot.close()
+        try:
+            self.fastboot = FastbootClient.connect(target, wait=wait)
+        except (OSError, FastbootError) as e:
+            self.log(f"连接fastboot失败: {e}")
+            self.fastboot = None
+        return self.fastboot
+
+    def fastboot_info(self):
+        """读取常用的fastboot变量"""
+        info = {}
+        for name in ("product", "serialno", "version-bootloader", "unlocked", "current-slot"):
+            try:
+                info[name] = self.fastboot.getvar(name)
+            except FastbootError:
+                continue
+        info["max-download-size"] = f"{self.fastboot.max_download_size() / 1024 / 1024:.0f} MB"
+        return info
 
     def get_device_state(self):
         clear_screen()
@@ -789,7 +4654,68 @@ class FirmwareManager:
         result = self.adb_manager.run_adb_command("get-state")
         print(f"设备状态: {result}")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
+
+    def batch_command(self):
+        clear_screen()
+        legal_notice()
+        print("\n批量执行命令")
+        devices = self.adb_manager.check_devices()
+        if not devices:
+            print("未找到连接的设备")
+            print("\n按任意键继续...")
+            self.input.wait_any_key()
+            return
+        print(f"已连接 {len(devices)} 台设备")
+        print("1. 重启")
+        print("2. 查看系统版本 (getprop)")
+        print("3. 安装应用")
+        print("4. 清除应用数据")
+        print("5. 自定义命令")
+        choice = input("\n选择操作: ").strip()
+        if choice == '1':
+            command = "reboot"
+        elif choice == '2':
+            command = "shell getprop ro.build.display.id"
+        elif choice == '3':
+            apk_path = input("请输入APK文件路径: ").strip()
+            if not apk_path or not Path(apk_path).exists():
+                print("文件不存在!")
+                print("\n按任意键继续...")
+                self.input.wait_any_key()
+                return
+            command = f"install -r \"{apk_path}\""
+        elif choice == '4':
+            package_name = input("请输入包名: ").strip()
+            command = f"shell pm clear {package_name}" if package_name else None
+        elif choice == '5':
+            command = input("ADB命令 (不含adb -s): ").strip() or None
+        else:
+            command = None
+        if not command:
+            print("无效操作!")
+            print("\n按任意键继续...")
+            self.input.wait_any_key()
+            return
+
+        try:
+            timeout = int(input("单台设备超时秒数 (默认: 30): ").strip() or "30")
+        except ValueError:
+            timeout = 30
+
+        def report(result):
+            status = "\033[92m成功\033[0m" if result['ok'] else "\033[91m失败\033[0m"
+            output = result['output'].replace('\n', ' ')
+            print(f"[{result['serial']}] {status} ({result['elapsed']:.1f}s) {output[:80]}")
+
+        print(f"\n正在 {len(devices)} 台设备上执行: adb {command}\n")
+        summary = self.adb_manager.fan_out(command, devices, timeout=timeout, on_result=report)
+        print(f"\n完成: 成功 {len(summary['succeeded'])} 台, 失败 {len(summary['failed'])} 台, "
+              f"耗时 {summary['elapsed']:.1f} 秒")
+        if summary['failed']:
+            print("失败设备: " + ", ".join(summary['failed']))
+        print("\n按任意键继续...")
+        self.input.wait_any_key()
 
     def get_battery_info(self):
         clear_screen()
@@ -798,45 +4724,72 @@ class FirmwareManager:
         result = self.adb_manager.run_adb_command("shell dumpsys battery")
         print(result)
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
+
+    def package_inventory(self, serial=None):
+        """每台设备一份应用清单缓存"""
+        serial = serial or self.adb_manager.current_device
+        inventory = self.package_inventories.get(serial)
+        if inventory is None:
+            inventory = self.package_inventories[serial] = PackageInventory(self.adb_manager, serial)
+        return inventory
+
+    @staticmethod
+    def _format_package(record):
+        tags = []
+        if record['version_code'] is not None:
+            tags.append(f"v{record['version_code']}")
+        if record['disabled']:
+            tags.append("已停用")
+        if record['installer']:
+            tags.append(record['installer'])
+        return f"{record['name']}" + (f"  ({', '.join(tags)})" if tags else "")
+
+    def _browse_packages(self, title, kind, limit=None):
+        """列出应用并支持按包名搜索（前缀优先），r 强制刷新"""
+        inventory = self.package_inventory()
+        while True:
+            clear_screen()
+            legal_notice()
+            print(f"\n{title}...")
+            try:
+                start = time.perf_counter()
+                records = inventory.select(kind)
+                elapsed = time.perf_counter() - start
+            except RuntimeError as e:
+                print(e)
+                print("\n按任意键继续...")
+                self.input.wait_any_key()
+                return
+            for record in records[:limit] if limit else records:
+                print(self._format_package(record))
+            if limit and len(records) > limit:
+                print(f"... 还有 {len(records) - limit} 个应用")
+            print(f"\n共 {len(records)} 个应用（{elapsed * 1000:.0f} ms）")
+            text = input("搜索包名 (前缀或关键字，r 刷新，回车返回): ").strip()
+            if not text:
+                return
+            if text.lower() == 'r':
+                inventory.invalidate()
+                continue
+            kinds = {r['name'] for r in records}
+            matches = [r for r in inventory.search(text) if r['name'] in kinds]
+            print(f"\n匹配 {len(matches)} 个:")
+            for record in matches[:50]:
+                print(self._format_package(record))
+            if len(matches) > 50:
+                print(f"... 还有 {len(matches) - 50} 个")
+            print("\n按任意键继续...")
+            self.input.wait_any_key()
 
     def list_apps(self):
-        clear_screen()
-        legal_notice()
-        print("\n所有应用...")
-        result = self.adb_manager.run_adb_command("shell pm list packages")
-        packages = result.split('\n')
-        for pkg in packages[:20]:
-            if pkg:
-                print(pkg)
-        if len(packages) > 20:
-            print(f"... 还有 {len(packages)-20} 个应用")
-        print("\n按任意键继续...")
-        keyboard.read_event()
+        self._browse_packages("所有应用", 'all', limit=20)
 
     def list_system_apps(self):
-        clear_screen()
-        legal_notice()
-        print("\n系统应用...")
-        result = self.adb_manager.run_adb_command("shell pm list packages -s")
-        packages = result.split('\n')
-        for pkg in packages:
-            if pkg:
-                print(pkg)
-        print("\n按任意键继续...")
-        keyboard.read_event()
+        self._browse_packages("系统应用", 'system')
 
     def list_third_party_apps(self):
-        clear_screen()
-        legal_notice()
-        print("\n第三方应用...")
-        result = self.adb_manager.run_adb_command("shell pm list packages -3")
-        packages = result.split('\n')
-        for pkg in packages:
-            if pkg:
-                print(pkg)
-        print("\n按任意键继续...")
-        keyboard.read_event()
+        self._browse_packages("第三方应用", 'third_party')
 
     def install_app(self):
         clear_screen()
@@ -846,10 +4799,64 @@ class FirmwareManager:
         if apk_path and Path(apk_path).exists():
             result = self.adb_manager.run_adb_command(f"install \"{apk_path}\"")
             print(result)
+            self.package_inventory().invalidate()
         else:
             print("文件不存在!")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
+
+    def bulk_install(self):
+        clear_screen()
+        legal_notice()
+        print("\n批量安装应用")
+        source = input("APK目录或JSON清单路径: ").strip()
+        if not source or not Path(source).exists():
+            print("路径不存在!")
+            print("\n按任意键继续...")
+            self.input.wait_any_key()
+            return
+        try:
+            units = BulkInstaller.collect(source)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile, struct.error) as e:
+            print(f"读取APK失败: {e}")
+            print("\n按任意键继续...")
+            self.input.wait_any_key()
+            return
+        devices = self.adb_manager.device_details()
+        if not units or not devices:
+            print("没有可安装的APK" if not units else "未找到连接的设备")
+            print("\n按任意键继续...")
+            self.input.wait_any_key()
+            return
+        try:
+            hub_limit = int(input(f"每个USB集线器同时安装数 (默认: {BulkInstaller.HUB_CONCURRENCY}): ").strip()
+                            or BulkInstaller.HUB_CONCURRENCY)
+        except ValueError:
+            hub_limit = BulkInstaller.HUB_CONCURRENCY
+
+        installer = BulkInstaller(self.adb_manager, hub_limit, inventories=self.package_inventories)
+        total_size = sum(unit['size'] for unit in units)
+        print(f"\n{len(units)} 个应用 ({total_size / 1024 / 1024:.1f} MB) -> {len(devices)} 台设备, "
+              f"{len({installer.hub_of(info) for info in devices.values()})} 个集线器\n")
+        for unit in units:
+            splits = f" + {len(unit['apks']) - 1} 个split" if len(unit['apks']) > 1 else ""
+            print(f"  {unit['package']} v{unit['version_code']}{splits}")
+        print()
+
+        labels = {'installed': "\033[92m安装\033[0m", 'skipped': "\033[93m跳过\033[0m",
+                  'failed': "\033[91m失败\033[0m", 'warning': "\033[93m警告\033[0m"}
+
+        def report(result):
+            print(f"[{result['serial']}] {labels[result['status']]} {result['package'] or ''} "
+                  f"{result.get('seconds', 0):.1f}s {result['output'][:60]}")
+
+        summary = installer.install(units, devices, on_result=report)
+        print(f"\n完成: 安装 {summary['installed']}, 跳过 {summary['skipped']}, 失败 {len(summary['failed'])}, "
+              f"耗时 {summary['elapsed']:.1f} 秒, 吞吐 {summary['mb_per_s']:.1f} MB/s")
+        for result in summary['failed']:
+            print(f"  {result['serial']} {result['package']}: {result['output']}")
+        print("\n按任意键继续...")
+        self.input.wait_any_key()
 
     def uninstall_app(self):
         clear_screen()
@@ -859,10 +4866,11 @@ class FirmwareManager:
         if package_name:
             result = self.adb_manager.run_adb_command(f"uninstall {package_name}")
             print(result)
+            self.package_inventory().invalidate()
         else:
             print("包名不能为空!")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def clear_app_data(self):
         clear_screen()
@@ -875,7 +4883,7 @@ class FirmwareManager:
         else:
             print("包名不能为空!")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def force_stop_app(self):
         clear_screen()
@@ -888,7 +4896,7 @@ class FirmwareManager:
         else:
             print("包名不能为空!")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def get_app_info(self):
         clear_screen()
@@ -896,12 +4904,52 @@ class FirmwareManager:
         print("\n应用信息")
         package_name = input("请输入包名: ").strip()
         if package_name:
-            result = self.adb_manager.run_adb_command(f"shell dumpsys package {package_name}")
-            print(result[:1000] + "..." if len(result) > 1000 else result)
+            self._print_app_info(package_name)
         else:
             print("包名不能为空!")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
+
+    def _print_app_info(self, package_name):
+        """显示结构化的应用信息；包名不完整时按搜索结果提示"""
+        inventory = self.package_inventory()
+        try:
+            record = inventory.get(package_name)
+            if record is None:
+                matches = inventory.search(package_name, limit=10)
+                if len(matches) != 1:
+                    print("未找到该应用" if not matches else "匹配到多个应用:")
+                    for match in matches:
+                        print(f"  {match['name']}")
+                    return
+                record = matches[0]
+            details = inventory.details(record['name'])
+        except RuntimeError as e:
+            print(e)
+            return
+        print(f"包名：{record['name']}")
+        print(f"类型：{'系统应用' if record['system'] else '第三方应用'}{'（已停用）' if record['disabled'] else ''}")
+        print(f"APK路径：{record['path'] or '未知'}")
+        print(f"UID：{record['uid'] if record['uid'] is not None else '未知'}")
+        print(f"安装来源：{record['installer'] or '未知'}")
+        if not details:
+            return
+        fields = details['fields']
+        labels = (('versionName', '版本名'), ('versionCode', '版本号'), ('minSdk', '最低SDK'),
+                  ('targetSdk', '目标SDK'), ('primaryCpuAbi', 'ABI'), ('dataDir', '数据目录'),
+                  ('firstInstallTime', '首次安装'), ('lastUpdateTime', '最近更新'), ('flags', '标志'))
+        for key, label in labels:
+            if key in fields:
+                print(f"{label}：{fields[key]}")
+        permissions = details['permissions']
+        granted = [p for p, ok in {**permissions['install'], **permissions['runtime']}.items() if ok]
+        print(f"申请权限：{len(permissions['requested'])} 项，已授予 {len(granted)} 项")
+        for perm in permissions['runtime']:
+            state = "已授予" if permissions['runtime'][perm] else "未授予"
+            print(f"  {perm}: {state}")
+        for user, state in details['users'].items():
+            print(f"用户 {user}：installed={state.get('installed', '?')} stopped={state.get('stopped', '?')} "
+                  f"enabled={state.get('enabled', '?')}")
 
     def push_file(self):
         clear_screen()
@@ -909,13 +4957,38 @@ class FirmwareManager:
         print("\n推送文件到设备")
         local_path = input("本地文件路径: ").strip()
         remote_path = input("设备保存路径: ").strip()
-        if local_path and remote_path and Path(local_path).exists():
+        if local_path and remote_path and Path(local_path).is_dir() and \
+                input("同步模式（只推送有变化的文件）? (Y/n): ").strip().lower() != 'n':
+            self._sync_directory(local_path, remote_path)
+        elif local_path and remote_path and Path(local_path).exists():
             result = self.adb_manager.run_adb_command(f"push \"{local_path}\" \"{remote_path}\"")
             print(result)
         else:
             print("文件不存在或路径为空!")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
+
+    def _sync_directory(self, local_path, remote_path):
+        delete = input("删除设备上本地已不存在的文件? (y/N): ").strip().lower() == 'y'
+        sync = DirectorySync(self.adb_manager)
+        print("\n正在比较本地与设备文件...")
+        try:
+            plan = sync.plan(local_path, remote_path, delete)
+        except RuntimeError as e:
+            print(e)
+            return
+        print(f"未变化 {plan['unchanged']} 个（其中 {plan['hashed']} 个经md5确认）, "
+              f"小文件 {len(plan['small'])} 个走tar流, 大文件 {len(plan['large'])} 个, "
+              f"待删除 {len(plan['delete'])} 个")
+        if not (plan['small'] or plan['large'] or plan['delete']):
+            print("设备上已是最新")
+            return
+        result = sync.run(plan, on_progress=lambda name: print(f"  已推送 {name}"))
+        print(f"\n同步完成: 推送 {result['pushed']} 个, 删除 {result['deleted']} 个, "
+              f"{result['bytes'] / 1024 / 1024:.1f} MB, 耗时 {result['elapsed']:.1f} 秒, "
+              f"{result['mb_per_s']:.1f} MB/s")
+        for error in result['errors']:
+            print(f"\033[91m{error}\033[0m")
 
     def pull_file(self):
         clear_screen()
@@ -923,13 +4996,43 @@ class FirmwareManager:
         print("\n从设备拉取文件")
         remote_path = input("设备文件路径: ").strip()
         local_path = input("本地保存路径: ").strip()
-        if remote_path and local_path:
+        if remote_path and local_path and \
+                input("使用tar流式拉取（适合大量小文件的目录）? (y/N): ").strip().lower() == 'y':
+            self._tar_pull(remote_path, local_path)
+        elif remote_path and local_path:
             result = self.adb_manager.run_adb_command(f"pull \"{remote_path}\" \"{local_path}\"")
             print(result)
         else:
             print("路径不能为空!")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
+
+    def _tar_pull(self, remote_path, local_path):
+        compress = input("设备端gzip压缩? (适合文本类数据, y/N): ").strip().lower() == 'y'
+        try:
+            workers = int(input("并行路数 (默认: 4): ").strip() or "4")
+        except ValueError:
+            workers = 4
+        puller = TarPuller(self.adb_manager, compress=compress, workers=workers)
+
+        def report(names, stats):
+            label = ", ".join(names[:3]) + (f" 等{len(names)}项" if len(names) > 3 else "") if names else remote_path
+            print(f"  {label}: {stats['files']} 个文件, {stats['bytes'] / 1024 / 1024:.1f} MB")
+
+        print("\n正在拉取...")
+        try:
+            result = puller.pull(remote_path, local_path, on_result=report)
+        except RuntimeError as e:
+            print(e)
+            return
+        print(f"\n完成: {result['files']} 个文件, {result['bytes'] / 1024 / 1024:.1f} MB "
+              f"(传输 {result['wire_bytes'] / 1024 / 1024:.1f} MB, {result['streams']} 路), "
+              f"耗时 {result['elapsed']:.1f} 秒, {result['mb_per_s']:.1f} MB/s, {result['files_per_s']:.0f} 文件/秒")
+        print(f"保存到: {result['local_dir']}")
+        if result['skipped']:
+            print(f"\033[93m已跳过 {len(result['skipped'])} 个不安全的条目\033[0m")
+        for error in result['errors']:
+            print(f"\033[91m{error}\033[0m")
 
     def list_files(self):
         clear_screen()
@@ -939,7 +5042,7 @@ class FirmwareManager:
         result = self.adb_manager.run_adb_command(f"shell ls -la {path}")
         print(result)
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def enter_shell(self):
         clear_screen()
@@ -956,7 +5059,7 @@ class FirmwareManager:
         result = self.adb_manager.run_adb_command("shell pwd")
         print(result)
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def create_directory(self):
         clear_screen()
@@ -969,7 +5072,7 @@ class FirmwareManager:
         else:
             print("路径不能为空!")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def delete_file(self):
         clear_screen()
@@ -982,7 +5085,65 @@ class FirmwareManager:
         else:
             print("路径不能为空!")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
+
+    def show_device_snapshot(self):
+        clear_screen()
+        legal_notice()
+        print("\n设备完整快照")
+        snapshot = self.adb_manager.snapshot()
+        if snapshot['error']:
+            print(snapshot['error'])
+        else:
+            props = snapshot['props']
+            memory = snapshot['memory']
+            screen = snapshot['screen']
+            battery = snapshot['battery']
+            print(f"型号: {props.get('ro.product.model', '未知')} ({props.get('ro.product.brand', '')})")
+            print(f"Android版本: {props.get('ro.build.version.release', '未知')} (SDK {props.get('ro.build.version.sdk', '?')})")
+            print(f"构建: {props.get('ro.build.display.id', '未知')}")
+            print(f"CPU: {snapshot['cpu']['hardware'] or '未知'}, {snapshot['cpu']['cores']} 核")
+            if memory.get('MemTotal'):
+                print(f"内存: 可用 {memory.get('MemAvailable', 0) / 1024:.0f} MB / 总计 {memory['MemTotal'] / 1024:.0f} MB")
+            for volume in snapshot['storage']:
+                if volume['mounted_on'] in ('/data', '/sdcard', '/storage/emulated'):
+                    print(f"存储 {volume['mounted_on']}: 已用 {volume['used']} / {volume['size']} ({volume['use%']})")
+            print(f"屏幕: {screen.get('size', '未知')}, 密度 {screen.get('density', '未知')}")
+            print(f"电池: {battery.get('level', '?')}%, 温度 {int(battery.get('temperature', 0) or 0) / 10:.1f}°C")
+            for name, addresses in snapshot['network'].items():
+                if addresses:
+                    print(f"网络 {name}: {', '.join(addresses)}")
+            print(f"\n采集耗时 {snapshot['elapsed'] * 1000:.0f} ms (单次adb调用)")
+        print("\n按任意键继续...")
+        self.input.wait_any_key()
+
+    def device_inventory(self):
+        clear_screen()
+        legal_notice()
+        print("\n清点所有设备")
+        devices = self.adb_manager.check_devices()
+        if not devices:
+            print("未找到连接的设备")
+            print("\n按任意键继续...")
+            self.input.wait_any_key()
+            return
+        start = time.perf_counter()
+        snapshots = self.adb_manager.snapshot_devices(devices)
+        for snapshot in snapshots:
+            props = snapshot['props']
+            if snapshot['error']:
+                print(f"[{snapshot['serial']}] \033[91m{snapshot['error']}\033[0m")
+            else:
+                print(f"[{snapshot['serial']}] {props.get('ro.product.model', '未知')} "
+                      f"Android {props.get('ro.build.version.release', '?')} "
+                      f"电池 {snapshot['battery'].get('level', '?')}%")
+        filename = f"inventory_{int(time.time())}.json"
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(snapshots, f, ensure_ascii=False, indent=2)
+        print(f"\n{len(snapshots)} 台设备清点完成，耗时 {time.perf_counter() - start:.1f} 秒")
+        print(f"清单已保存: {filename}")
+        print("\n按任意键继续...")
+        self.input.wait_any_key()
 
     def get_system_props(self):
         clear_screen()
@@ -996,7 +5157,7 @@ class FirmwareManager:
         if len(lines) > 30:
             print("... (更多内容未显示)")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def get_cpu_info(self):
         clear_screen()
@@ -1005,7 +5166,7 @@ class FirmwareManager:
         result = self.adb_manager.run_adb_command("shell cat /proc/cpuinfo")
         print(result)
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def get_memory_info(self):
         clear_screen()
@@ -1014,7 +5175,7 @@ class FirmwareManager:
         result = self.adb_manager.run_adb_command("shell cat /proc/meminfo")
         print(result)
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def get_storage_info(self):
         clear_screen()
@@ -1023,7 +5184,7 @@ class FirmwareManager:
         result = self.adb_manager.run_adb_command("shell df -h")
         print(result)
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def get_network_info(self):
         clear_screen()
@@ -1032,7 +5193,7 @@ class FirmwareManager:
         result = self.adb_manager.run_adb_command("shell ifconfig || ip addr")
         print(result)
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def get_screen_info(self):
         clear_screen()
@@ -1043,17 +5204,76 @@ class FirmwareManager:
         print(f"屏幕尺寸: {size}")
         print(f"屏幕密度: {density}")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def view_logcat(self):
         clear_screen()
         legal_notice()
         print("\nLogcat日志")
+        devices = self.adb_manager.check_devices()
+        if not devices:
+            print("未找到连接的设备")
+            print("\n按任意键继续...")
+            self.input.wait_any_key()
+            return
+        if len(devices) > 1 and input("采集所有设备? (y/n): ").strip().lower() == 'y':
+            serials = devices
+        else:
+            serials = [self.adb_manager.current_device if self.adb_manager.current_device in devices else devices[0]]
+        tags = [t.strip() for t in input("标签过滤 (逗号分隔，留空为全部): ").split(',') if t.strip()]
+        priority = input("最低优先级 V/D/I/W/E/F (默认: V): ").strip().upper() or 'V'
+        pattern = input("正则过滤 (可留空): ").strip() or None
+        try:
+            log_filter = LogcatFilter(tags, priority, pattern)
+        except re.error as e:
+            print(f"正则表达式错误: {e}")
+            print("\n按任意键继续...")
+            self.input.wait_any_key()
+            return
+        save = input("保存到 logs/ 目录? (y/n): ").strip().lower() == 'y'
+        compression = 'zstd' if zstandard is not None else 'gzip'
+
+        captures = [LogcatCapture(self.adb_manager, serial, log_filter, output_dir="logs" if save else None,
+                                  compression=compression) for serial in serials]
+        try:
+            for capture in captures:
+                capture.start()
+        except RuntimeError as e:
+            for capture in captures:
+                capture.stop()
+            print(f"启动日志采集失败: {e}")
+            print("\n按任意键继续...")
+            self.input.wait_any_key()
+            return
         print("开始显示日志，按Ctrl+C停止...")
+        shown = {capture.serial: 0 for capture in captures}
         try:
-            os.system("adb logcat" if not self.adb_manager.current_device else f"adb -s {self.adb_manager.current_device} logcat")
+            while any(t.is_alive() for capture in captures for t in capture._threads):
+                time.sleep(0.2)
+                for capture in captures:
+                    records = capture.tail(shown[capture.serial], limit=200)
+                    for sequence, record in records:
+                        prefix = f"[{capture.serial}] " if len(captures) > 1 else ""
+                        print(f"{prefix}{record['time']} {record['priority']} {record['tag']}: {record['message']}")
+                    if records:
+                        shown[capture.serial] = records[-1][0]
         except KeyboardInterrupt:
             pass
+        finally:
+            for capture in captures:
+                capture.stop()
+
+        print("\n采集统计:")
+        for capture in captures:
+            stats = capture.snapshot_stats()
+            print(f"[{capture.serial}] 读取 {stats['lines']} 行, 匹配 {stats['accepted']} 行, "
+                  f"{capture.rate():.0f} 行/秒")
+            if capture.error:
+                print(f"  \033[91m{capture.error}\033[0m")
+            if capture.writer and capture.writer.files:
+                print(f"  日志文件: {capture.writer.directory} ({len(capture.writer.files)} 个)")
+        print("\n按任意键继续...")
+        self.input.wait_any_key()
 
     def clear_logcat(self):
         clear_screen()
@@ -1062,7 +5282,7 @@ class FirmwareManager:
         result = self.adb_manager.run_adb_command("logcat -c")
         print("日志已清除")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def bug_report(self):
         clear_screen()
@@ -1072,20 +5292,48 @@ class FirmwareManager:
         result = self.adb_manager.run_adb_command("bugreport")
         print("错误报告生成完成")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
 
     def take_screenshot(self):
         clear_screen()
         legal_notice()
         print("\n屏幕截图")
-        filename = f"screenshot_{int(time.time())}.png"
-        result = self.adb_manager.run_adb_command(f"exec-out screencap -p > {filename}")
-        if Path(filename).exists():
-            print(f"截图已保存: {filename}")
-        else:
-            print("截图失败")
+        print("1. 单张截图")
+        print("2. 连拍 (所有设备)")
+        choice = input("\n选择模式 (默认: 1): ").strip() or '1'
+        with ScreenCapture(self.adb_manager) as capture:
+            try:
+                if choice == '2':
+                    self._burst_capture(capture)
+                else:
+                    filename = f"screenshot_{int(time.time())}.png"
+                    result = capture.capture(self.adb_manager.current_device, filename).result()
+                    print(f"截图已保存: {result['path']} (抓取 {result['capture_s'] * 1000:.0f} ms, "
+                          f"编码 {result['encode_s'] * 1000:.0f} ms)")
+            except (RuntimeError, ValueError, OSError) as e:
+                print(f"截图失败: {e}")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
+
+    def _burst_capture(self, capture):
+        devices = self.adb_manager.check_devices()
+        if not devices:
+            print("未找到连接的设备")
+            return
+        try:
+            fps = float(input("每秒帧数 (默认: 2): ").strip() or "2")
+            duration = float(input("持续秒数 (默认: 10): ").strip() or "10")
+        except ValueError:
+            fps, duration = 2.0, 10.0
+        capture.save_raw = input("保存原始帧而不编码PNG? (y/N): ").strip().lower() == 'y'
+        print(f"\n{len(devices)} 台设备, {fps:g} 帧/秒, {duration:g} 秒...")
+        result = capture.burst(devices, max(fps, 0.1), duration)
+        for serial, stats in result['devices'].items():
+            print(f"[{serial}] {stats['frames']} 帧 ({stats['fps']:.1f} 帧/秒), 丢帧 {stats['dropped']}, 失败 {stats['failed']}, "
+                  f"抓取 {stats['capture_ms']:.0f} ms, 编码 {stats['encode_ms']:.0f} ms")
+            for error in stats['errors'][:3]:
+                print(f"  \033[91m{error}\033[0m")
+        print(f"保存到: {result['out_dir']}")
 
     def screen_record(self):
         clear_screen()
@@ -1106,22 +5354,75 @@ class FirmwareManager:
         clear_screen()
         legal_notice()
         print("\n性能监控")
+        devices = self.adb_manager.check_devices()
+        if not devices:
+            print("未找到连接的设备")
+            print("\n按任意键继续...")
+            self.input.wait_any_key()
+            return
+        if self.adb_manager.current_device in devices:
+            default = [self.adb_manager.current_device]
+        else:
+            default = devices[:1]
+        if len(devices) > 1 and input("监控所有设备? (y/n): ").strip().lower() == 'y':
+            serials = devices
+        else:
+            serials = default
+        try:
+            interval = float(input("采样间隔秒数 (默认: 1, 支持0.2等小数): ").strip() or "1")
+        except ValueError:
+            interval = 1.0
+        interval = max(0.1, interval)
+
+        samplers = [PerformanceSampler(self.adb_manager, serial, interval) for serial in serials]
+        try:
+            for sampler in samplers:
+                sampler.start()
+        except RuntimeError as e:
+            for sampler in samplers:
+                sampler.stop()
+            print(f"启动性能监控失败: {e}")
+            print("\n按任意键继续...")
+            self.input.wait_any_key()
+            return
         print("开始监控，按Ctrl+C停止...")
         try:
             while True:
+                time.sleep(max(interval, 0.5))
                 clear_screen()
                 legal_notice()
                 print("\n性能监控 (实时)")
-                cpu = self.adb_manager.run_adb_command("shell top -n 1 -b | head -20")
-                mem = self.adb_manager.run_adb_command("shell cat /proc/meminfo | head -10")
-                print("CPU使用情况:")
-                print(cpu)
-                print("\n内存使用情况:")
-                print(mem)
+                for sampler in samplers:
+                    latest = sampler.ring.latest()
+                    print(f"\n[{sampler.serial}] 样本数 {len(sampler.ring)}")
+                    if sampler.error:
+                        print(f"  \033[91m{sampler.error}\033[0m")
+                    if not latest:
+                        print("  等待数据...")
+                        continue
+                    print(f"  CPU: {latest['cpu_percent']:.1f}% (用户 {latest['cpu_user']:.1f}%, "
+                          f"系统 {latest['cpu_system']:.1f}%, IO等待 {latest['cpu_iowait']:.1f}%)")
+                    if sampler.core_percent:
+                        print("  各核心: " + " ".join(f"{pct:.0f}%" for pct in sampler.core_percent))
+                    print(f"  内存: 已用 {latest['mem_used_percent']:.1f}% "
+                          f"(可用 {latest['mem_available_kb'] / 1024:.0f} MB / {latest['mem_total_kb'] / 1024:.0f} MB)")
+                    for proc in sampler.top_processes[:5]:
+                        print(f"    {proc['pid']:>6} {proc['cpu_percent']:5.1f}% {proc['name']}")
                 print("\n按Ctrl+C停止监控...")
-                time.sleep(3)
         except KeyboardInterrupt:
             pass
+        finally:
+            for sampler in samplers:
+                sampler.stop()
+
+        export = input("\n导出数据? (csv/json/n): ").strip().lower()
+        if export in ('csv', 'json'):
+            for sampler in samplers:
+                filename = f"perf_{sampler.serial.replace(':', '_')}_{int(time.time())}.{export}"
+                count = sampler.export_csv(filename) if export == 'csv' else sampler.export_json(filename)
+                print(f"已导出 {count} 个样本: {filename}")
+            print("\n按任意键继续...")
+            self.input.wait_any_key()
 
     def stress_test(self):
         clear_screen()
@@ -1135,14 +5436,953 @@ class FirmwareManager:
         else:
             print("包名不能为空!")
         print("\n按任意键继续...")
-        keyboard.read_event()
+        self.input.wait_any_key()
+
+    def adb_latency_test(self):
+        clear_screen()
+        legal_notice()
+        print("\nADB延迟对比 (原生协议 vs adb进程)")
+        rounds = input("测试轮数 (默认: 20): ").strip() or "20"
+        rounds = int(rounds) if rounds.isdigit() else 20
+        results = self.adb_manager.compare_latency(rounds=rounds)
+        for mode, label in (('native', '原生协议'), ('subprocess', 'adb进程')):
+            stats = results.get(mode)
+            if stats:
+                print(f"{label}: 平均 {stats['mean_ms']:.2f} ms, 中位数 {stats['median_ms']:.2f} ms, "
+                      f"最小 {stats['min_ms']:.2f} ms, 最大 {stats['max_ms']:.2f} ms")
+            else:
+                print(f"{label}: 不可用")
+        if 'speedup' in results:
+            print(f"原生协议加速比: {results['speedup']:.1f}x")
+        print("\n按任意键继续...")
+        self.input.wait_any_key()
+
+# 最小protobuf解码：返回 (字段号, 线路类型, 值)，只用于读取OTA清单
+def iter_protobuf_fields(data):
+    view = memoryview(data)
+    pos = 0
+    end = len(view)
+
+    def varint():
+        nonlocal pos
+        result = shift = 0
+        while True:
+            byte = view[pos]
+            pos += 1
+            result |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return result
+            shift += 7
+
+    while pos < end:
+        key = varint()
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            yield field, wire_type, varint()
+        elif wire_type == 1:
+            yield field, wire_type, int.from_bytes(view[pos:pos + 8], 'little')
+            pos += 8
+        elif wire_type == 2:
+            length = varint()
+            yield field, wire_type, bytes(view[pos:pos + length])
+            pos += length
+        elif wire_type == 5:
+            yield field, wire_type, int.from_bytes(view[pos:pos + 4], 'little')
+            pos += 4
+        else:
+            raise ValueError(f"不支持的protobuf线路类型: {wire_type}")
+
+# A/B OTA payload.bin 操作类型 (update_engine InstallOperation.Type)
+PAYLOAD_OP_NAMES = {
+    0: 'REPLACE', 1: 'REPLACE_BZ', 2: 'MOVE', 3: 'BSDIFF', 4: 'SOURCE_COPY', 5: 'SOURCE_BSDIFF',
+    6: 'ZERO', 7: 'DISCARD', 8: 'REPLACE_XZ', 9: 'PUFFDIFF', 10: 'BROTLI_BSDIFF', 11: 'ZUCCHINI',
+    12: 'LZ4DIFF_BSDIFF', 13: 'LZ4DIFF_PUFFDIFF'
+}
+PAYLOAD_FULL_OPS = (0, 1, 6, 7, 8)
+
+# 在进程池中执行一批互不依赖的安装操作：读取数据、校验SHA-256、解压后写入目标区块
+def apply_payload_operations(source_path, data_start, block_size, out_path, operations):
+    written = 0
+    with open(source_path, 'rb') as src, open(out_path, 'r+b') as out:
+        for op in operations:
+            if op['type'] in (6, 7):
+                # ZERO/DISCARD：目标文件预先截断为全零，无需写入
+                continue
+            src.seek(data_start + op['data_offset'])
+            data = src.read(op['data_length'])
+            if op['data_sha256'] and hashlib.sha256(data).digest() != op['data_sha256']:
+                raise ValueError(f"操作数据校验失败 (偏移 {op['data_offset']})")
+            if op['type'] == 1:
+                data = bz2.decompress(data)
+            elif op['type'] == 8:
+                data = lzma.decompress(data)
+            elif op['type'] != 0:
+                raise ValueError(f"不支持的操作类型: {PAYLOAD_OP_NAMES.get(op['type'], op['type'])}")
+            view = memoryview(data)
+            pos = 0
+            for start_block, num_blocks in op['dst_extents']:
+                length = num_blocks * block_size
+                out.seek(start_block * block_size)
+                out.write(view[pos:pos + length])
+                pos += length
+            written += pos
+    return written
+
+# OTA payload.bin 解析/提取 - 直接读取zip内未压缩存储的payload.bin，无需先解压整个包
+class OTAPayload:
+    MAGIC = b'CrAU'
+
+    def __init__(self, file_path):
+        self.file_path = Path(file_path)
+        self.payload_offset = self._locate_payload()
+        self.block_size = 4096
+        self.partitions = []
+        self._read_manifest()
+
+    @staticmethod
+    def contains_payload(file_path):
+        """判断文件是否为包含payload.bin的OTA包（或就是payload.bin）"""
+        try:
+            with open(file_path, 'rb') as f:
+                if f.read(4) == OTAPayload.MAGIC:
+                    return True
+            if not zipfile.is_zipfile(file_path):
+                return False
+            with zipfile.ZipFile(file_path) as zf:
+                return 'payload.bin' in zf.namelist()
+        except OSError:
+            return False
+
+    def _locate_payload(self):
+        """只读取zip中央目录和本地文件头，得到payload.bin数据在文件中的偏移"""
+        with open(self.file_path, 'rb') as f:
+            if f.read(4) == self.MAGIC:
+                return 0
+        with zipfile.ZipFile(self.file_path) as zf:
+            info = zf.getinfo('payload.bin')
+        if info.compress_type != zipfile.ZIP_STORED:
+            raise ValueError("payload.bin 为压缩存储，无法直接读取")
+        with open(self.file_path, 'rb') as f:
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_length, extra_length = struct.unpack('<HH', header[26:30])
+        return info.header_offset + 30 + name_length + extra_length
+
+    def _read_manifest(self):
+        with open(self.file_path, 'rb') as f:
+            f.seek(self.payload_offset)
+            magic, version, manifest_size = struct.unpack('>4sQQ', f.read(20))
+            if magic != self.MAGIC:
+                raise ValueError("不是有效的payload.bin")
+            signature_size = struct.unpack('>I', f.read(4))[0] if version >= 2 else 0
+            manifest = f.read(manifest_size)
+        self.version = version
+        header_size = 24 if version >= 2 else 20
+        self.data_start = self.payload_offset + header_size + manifest_size + signature_size
+
+        for field, _, value in iter_protobuf_fields(manifest):
+            if field == 3:
+                self.block_size = value
+            elif field == 13:
+                self.partitions.append(self._parse_partition(value))
+
+    @staticmethod
+    def _parse_extent(data):
+        start = count = 0
+        for field, _, value in iter_protobuf_fields(data):
+            if field == 1:
+                start = value
+            elif field == 2:
+                count = value
+        return start, count
+
+    def _parse_partition(self, data):
+        partition = {'name': None, 'size': 0, 'hash': None, 'operations': []}
+        for field, _, value in iter_protobuf_fields(data):
+            if field == 1:
+                partition['name'] = value.decode('utf-8')
+            elif field == 7:
+                for info_field, _, info_value in iter_protobuf_fields(value):
+                    if info_field == 1:
+                        partition['size'] = info_value
+                    elif info_field == 2:
+                        partition['hash'] = info_value.hex()
+            elif field == 8:
+                op = {'type': 0, 'data_offset': 0, 'data_length': 0, 'dst_extents': [], 'data_sha256': None}
+                for op_field, _, op_value in iter_protobuf_fields(value):
+                    if op_field == 1:
+                        op['type'] = op_value
+                    elif op_field == 2:
+                        op['data_offset'] = op_value
+                    elif op_field == 3:
+                        op['data_length'] = op_value
+                    elif op_field == 6:
+                        op['dst_extents'].append(self._parse_extent(op_value))
+                    elif op_field == 8:
+                        op['data_sha256'] = op_value
+                partition['operations'].append(op)
+        return partition
+
+    def list_partitions(self):
+        """分区名、大小、SHA-256与操作统计，不读取任何镜像数据"""
+        result = []
+        for partition in self.partitions:
+            op_types = {}
+            for op in partition['operations']:
+                name = PAYLOAD_OP_NAMES.get(op['type'], str(op['type']))
+                op_types[name] = op_types.get(name, 0) + 1
+            result.append({
+                'name': partition['name'],
+                'size': partition['size'],
+                'hash': partition['hash'],
+                'operations': len(partition['operations']),
+                'op_types': op_types,
+                'full': all(op['type'] in PAYLOAD_FULL_OPS for op in partition['operations'])
+            })
+        return result
+
+    def extract(self, out_dir, names=None, max_workers=None, batch_bytes=32 * 1024 * 1024, progress=None):
+        """提取分区镜像到out_dir，操作按数据量分批在进程池中并行执行，完成后校验整个分区的SHA-256"""
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        selected = [p for p in self.partitions if names is None or p['name'] in names]
+        for partition in selected:
+            if not all(op['type'] in PAYLOAD_FULL_OPS for op in partition['operations']):
+                raise ValueError(f"{partition['name']} 为增量更新，需要旧分区数据，无法单独提取")
+
+        tasks = []
+        total_bytes = 0
+        for partition in selected:
+            out_path = out_dir / f"{partition['name']}.img"
+            with open(out_path, 'wb') as f:
+                f.truncate(partition['size'])
+            batch, batch_size = [], 0
+            for op in partition['operations']:
+                batch.append(op)
+                batch_size += op['data_length']
+                if batch_size >= batch_bytes:
+                    tasks.append((out_path, batch, batch_size))
+                    batch, batch_size = [], 0
+            if batch:
+                tasks.append((out_path, batch, batch_size))
+            total_bytes += sum(op['data_length'] for op in partition['operations'])
+
+        start = time.perf_counter()
+        done = 0
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(apply_payload_operations, str(self.file_path), self.data_start,
+                                   self.block_size, str(out_path), batch): size
+                       for out_path, batch, size in tasks}
+            for future in as_completed(futures):
+                future.result()
+                done += futures[future]
+                if progress:
+                    progress(done, total_bytes)
+
+        results = []
+        for partition in selected:
+            out_path = out_dir / f"{partition['name']}.img"
+            ok = None
+            if partition['hash']:
+                digest = FirmwareHasher(('sha256',)).hash_file(out_path, parallel=False)['sha256']
+                ok = digest == partition['hash']
+            results.append({'name': partition['name'], 'path': str(out_path), 'size': partition['size'], 'verified': ok})
+        return {'partitions': results, 'seconds': time.perf_counter() - start, 'payload_bytes': total_bytes}
+
+# Android sparse镜像格式 (libsparse)
+SPARSE_HEADER_MAGIC = 0xED26FF3A
+SPARSE_HEADER = struct.Struct('<IHHHHIIII')
+SPARSE_CHUNK_HEADER = struct.Struct('<HHII')
+CHUNK_TYPE_RAW = 0xCAC1
+CHUNK_TYPE_FILL = 0xCAC2
+CHUNK_TYPE_DONT_CARE = 0xCAC3
+CHUNK_TYPE_CRC32 = 0xCAC4
+
+def is_sparse_image(file_path):
+    """判断文件是否为sparse镜像"""
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(4)
+    except OSError:
+        return False
+    return len(header) == 4 and struct.unpack('<I', header)[0] == SPARSE_HEADER_MAGIC
+
+# sparse镜像编码/拆分 - 分块描述为 (类型, 起始块, 块数, 参数)：
+# RAW的参数是数据在源文件中的偏移，FILL是4字节填充值，DONT_CARE为None。
+# 只保存分块描述，写出时再从源文件读取数据，内存占用与镜像大小无关。
+class SparseImage:
+    DEFAULT_BLOCK_SIZE = 4096
+    SCAN_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, source_path, block_size=None, zero_as_dont_care=False):
+        self.source_path = Path(source_path)
+        self.block_size = block_size or self.DEFAULT_BLOCK_SIZE
+        self.zero_as_dont_care = zero_as_dont_care
+        self.chunks = []
+        self.total_blocks = 0
+        self.source_sparse = is_sparse_image(self.source_path)
+        if self.source_sparse:
+            self._read_sparse()
+        else:
+            self._scan_raw()
+
+    @property
+    def logical_size(self):
+        return self.total_blocks * self.block_size
+
+    def _add_chunk(self, chunk_type, start, blocks, arg):
+        """追加分块，与前一个同类分块相邻时合并"""
+        if self.chunks:
+            last_type, last_start, last_blocks, last_arg = self.chunks[-1]
+            if last_type == chunk_type and last_start + last_blocks == start:
+                if chunk_type == CHUNK_TYPE_DONT_CARE or \
+                   (chunk_type == CHUNK_TYPE_FILL and last_arg == arg) or \
+                   (chunk_type == CHUNK_TYPE_RAW and last_arg + last_blocks * self.block_size == arg):
+                    self.chunks[-1] = (chunk_type, last_start, last_blocks + blocks, last_arg)
+                    return
+        self.chunks.append((chunk_type, start, blocks, arg))
+
+    def _data_ranges(self, f, size):
+        """利用SEEK_DATA/SEEK_HOLE找出文件中真正有数据的区间，文件空洞直接作为DONT_CARE"""
+        if not hasattr(os, 'SEEK_DATA'):
+            yield 0, size
+            return
+        fd = f.fileno()
+        offset = 0
+        try:
+            while offset < size:
+                try:
+                    data_start = os.lseek(fd, offset, os.SEEK_DATA)
+                except OSError as e:
+                    # 只有ENXIO表示后面已没有数据；文件系统不支持SEEK_DATA等其他错误时按数据读取剩余部分
+                    if e.errno != errno.ENXIO:
+                        yield offset, size
+                    return
+                data_end = os.lseek(fd, data_start, os.SEEK_HOLE)
+                yield data_start, min(data_end, size)
+                offset = data_end
+        except OSError:
+            yield offset, size
+
+    def _scan_raw(self):
+        """扫描原始镜像，识别全零块和重复4字节填充块"""
+        bs = self.block_size
+        size = self.source_path.stat().st_size
+        self.total_blocks = -(-size // bs)
+        zero_block = bytes(bs)
+        zero_window = bytes(self.SCAN_SIZE)
+        zero_type = CHUNK_TYPE_DONT_CARE if self.zero_as_dont_care else CHUNK_TYPE_FILL
+        zero_arg = None if self.zero_as_dont_care else b'\0\0\0\0'
+        covered = 0
+
+        with open(self.source_path, 'rb') as f:
+            for data_start, data_end in self._data_ranges(f, size):
+                first_block = data_start // bs
+                last_block = -(-data_end // bs)
+                if first_block * bs > covered:
+                    self._add_chunk(CHUNK_TYPE_DONT_CARE, covered // bs, first_block - covered // bs, None)
+                first_block = max(first_block, covered // bs)
+                f.seek(first_block * bs)
+                block = first_block
+                while block < last_block:
+                    window = f.read(min(self.SCAN_SIZE, (last_block - block) * bs))
+                    if not window:
+                        break
+                    if len(window) % bs:
+                        window += bytes(bs - len(window) % bs)
+                    count = len(window) // bs
+                    if window == zero_window[:len(window)]:
+                        # 整个窗口为零，不必逐块比较
+                        self._add_chunk(zero_type, block, count, zero_arg)
+                    else:
+                        view = memoryview(window)
+                        for i in range(count):
+                            data = view[i * bs:(i + 1) * bs]
+                            if data == zero_block:
+                                self._add_chunk(zero_type, block + i, 1, zero_arg)
+                            elif bytes(data[:4]) * (bs // 4) == data:
+                                self._add_chunk(CHUNK_TYPE_FILL, block + i, 1, bytes(data[:4]))
+                            else:
+                                self._add_chunk(CHUNK_TYPE_RAW, block + i, 1, (block + i) * bs)
+                    block += count
+                covered = last_block * bs
+        if covered // bs < self.total_blocks:
+            self._add_chunk(CHUNK_TYPE_DONT_CARE, covered // bs, self.total_blocks - covered // bs, None)
+
+    def _read_sparse(self):
+        """读取已有的sparse镜像，RAW分块的参数记录为其在文件中的偏移"""
+        with open(self.source_path, 'rb') as f:
+            header = SPARSE_HEADER.unpack(f.read(SPARSE_HEADER.size))
+            magic, major, minor, file_hdr_sz, chunk_hdr_sz, blk_sz, total_blks, total_chunks, _ = header
+            if major != 1:
+                raise ValueError(f"不支持的sparse版本: {major}.{minor}")
+            self.block_size = blk_sz
+            self.total_blocks = total_blks
+            f.seek(file_hdr_sz)
+            block = 0
+            for _ in range(total_chunks):
+                chunk_type, _, chunk_blocks, total_sz = SPARSE_CHUNK_HEADER.unpack(f.read(SPARSE_CHUNK_HEADER.size))
+                f.seek(chunk_hdr_sz - SPARSE_CHUNK_HEADER.size, 1)
+                data_size = total_sz - chunk_hdr_sz
+                if chunk_type == CHUNK_TYPE_RAW:
+                    self._add_chunk(CHUNK_TYPE_RAW, block, chunk_blocks, f.tell())
+                    f.seek(data_size, 1)
+                elif chunk_type == CHUNK_TYPE_FILL:
+                    self._add_chunk(CHUNK_TYPE_FILL, block, chunk_blocks, f.read(4))
+                    f.seek(data_size - 4, 1)
+                elif chunk_type == CHUNK_TYPE_DONT_CARE:
+                    self._add_chunk(CHUNK_TYPE_DONT_CARE, block, chunk_blocks, None)
+                elif chunk_type == CHUNK_TYPE_CRC32:
+                    f.seek(data_size, 1)
+                    continue
+                else:
+                    raise ValueError(f"未知的sparse分块类型: {chunk_type:#x}")
+                block += chunk_blocks
+
+    @staticmethod
+    def _chunk_size(chunk, block_size):
+        """分块在sparse文件中占用的字节数"""
+        chunk_type, _, blocks, _ = chunk
+        if chunk_type == CHUNK_TYPE_RAW:
+            return SPARSE_CHUNK_HEADER.size + blocks * block_size
+        if chunk_type == CHUNK_TYPE_FILL:
+            return SPARSE_CHUNK_HEADER.size + 4
+        return SPARSE_CHUNK_HEADER.size
+
+    def split(self, max_size):
+        """按max-download-size拆分为多个独立的sparse镜像，每段都覆盖完整分区（前后用DONT_CARE补齐）"""
+        bs = self.block_size
+        # 每段固定开销：文件头 + 前后两个DONT_CARE分块
+        overhead = SPARSE_HEADER.size + 2 * SPARSE_CHUNK_HEADER.size
+        if max_size <= overhead + SPARSE_CHUNK_HEADER.size + bs:
+            raise ValueError("max-download-size过小")
+        pieces = []
+        current, current_size = [], overhead
+        for chunk in self.chunks:
+            chunk_type, start, blocks, arg = chunk
+            while True:
+                size = self._chunk_size((chunk_type, start, blocks, arg), bs)
+                if current_size + size <= max_size:
+                    current.append((chunk_type, start, blocks, arg))
+                    current_size += size
+                    break
+                if chunk_type == CHUNK_TYPE_RAW:
+                    fit = (max_size - current_size - SPARSE_CHUNK_HEADER.size) // bs
+                    if fit > 0:
+                        current.append((chunk_type, start, fit, arg))
+                        start, blocks, arg = start + fit, blocks - fit, arg + fit * bs
+                if current:
+                    pieces.append(current)
+                current, current_size = [], overhead
+        if current or not pieces:
+            pieces.append(current)
+        return [self._pad_piece(piece) for piece in pieces]
+
+    def _pad_piece(self, piece):
+        """在分段前后补DONT_CARE，使其覆盖完整的分区块数"""
+        if not piece:
+            return [(CHUNK_TYPE_DONT_CARE, 0, self.total_blocks, None)] if self.total_blocks else []
+        padded = []
+        first_start = piece[0][1]
+        last_end = piece[-1][1] + piece[-1][2]
+        if first_start > 0:
+            padded.append((CHUNK_TYPE_DONT_CARE, 0, first_start, None))
+        padded.extend(piece)
+        if last_end < self.total_blocks:
+            padded.append((CHUNK_TYPE_DONT_CARE, last_end, self.total_blocks - last_end, None))
+        return padded
+
+    def piece_size(self, piece):
+        """分段序列化后的字节数"""
+        return SPARSE_HEADER.size + sum(self._chunk_size(chunk, self.block_size) for chunk in piece)
+
+    def iter_piece(self, piece, read_size=1024 * 1024):
+        """流式输出一个分段的sparse数据"""
+        bs = self.block_size
+        yield SPARSE_HEADER.pack(SPARSE_HEADER_MAGIC, 1, 0, SPARSE_HEADER.size, SPARSE_CHUNK_HEADER.size,
+                                 bs, self.total_blocks, len(piece), 0)
+        with open(self.source_path, 'rb') as f:
+            for chunk in piece:
+                chunk_type, _, blocks, arg = chunk
+                yield SPARSE_CHUNK_HEADER.pack(chunk_type, 0, blocks, self._chunk_size(chunk, bs))
+                if chunk_type == CHUNK_TYPE_FILL:
+                    yield arg
+                elif chunk_type == CHUNK_TYPE_RAW:
+                    f.seek(arg)
+                    remaining = blocks * bs
+                    while remaining:
+                        data = f.read(min(read_size, remaining))
+                        if not data:
+                            # 原始镜像最后一块不足block_size时补零
+                            data = bytes(min(read_size, remaining))
+                        remaining -= len(data)
+                        yield data
+
+    def write(self, out_path, piece=None):
+        """写出sparse文件（默认写出整个镜像）"""
+        piece = self.chunks if piece is None else piece
+        with open(out_path, 'wb') as out:
+            for data in self.iter_piece(piece):
+                out.write(data)
+
+    def write_raw(self, out_path):
+        """展开为原始镜像（DONT_CARE区域保留为文件空洞）"""
+        bs = self.block_size
+        with open(self.source_path, 'rb') as f, open(out_path, 'wb') as out:
+            for chunk_type, start, blocks, arg in self.chunks:
+                out.seek(start * bs)
+                if chunk_type == CHUNK_TYPE_RAW:
+                    f.seek(arg)
+                    remaining = blocks * bs
+                    while remaining:
+                        data = f.read(min(1024 * 1024, remaining)) or bytes(min(1024 * 1024, remaining))
+                        out.write(data)
+                        remaining -= len(data)
+                elif chunk_type == CHUNK_TYPE_FILL:
+                    fill = arg * (bs // 4)
+                    for _ in range(blocks):
+                        out.write(fill)
+            out.truncate(self.logical_size)
+
+    def plan(self, max_download_size):
+        """生成刷写计划：分段列表、逻辑大小与实际传输字节数"""
+        pieces = self.split(max_download_size)
+        return {
+            'pieces': pieces,
+            'logical_size': self.logical_size,
+            'transfer_size': sum(self.piece_size(piece) for piece in pieces),
+            'raw_blocks': sum(c[2] for c in self.chunks if c[0] == CHUNK_TYPE_RAW),
+            'fill_blocks': sum(c[2] for c in self.chunks if c[0] == CHUNK_TYPE_FILL),
+            'dont_care_blocks': sum(c[2] for c in self.chunks if c[0] == CHUNK_TYPE_DONT_CARE)
+        }
+
+# fastboot协议错误（设备返回FAIL或应答异常）
+class FastbootError(Exception):
+    pass
+
+# fastboot TCP传输层：FB01握手，之后每条消息带8字节大端长度前缀
+class FastbootTcpTransport:
+    DEFAULT_PORT = 5554
+    PROTOCOL_VERSION = 1
+
+    def __init__(self, host, port=None, timeout=30):
+        self.host = host
+        self.port = int(port or self.DEFAULT_PORT)
+        self.sock = socket.create_connection((self.host, self.port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._handshake()
+
+    def _recv_exact(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise FastbootError("连接被设备关闭")
+            data += chunk
+        return bytes(data)
+
+    def _handshake(self):
+        self.sock.sendall(b"FB%02d" % self.PROTOCOL_VERSION)
+        reply = self._recv_exact(4)
+        if reply[:2] != b"FB" or not reply[2:].isdigit() or int(reply[2:]) < self.PROTOCOL_VERSION:
+            self.close()
+            raise FastbootError(f"不支持的fastboot握手应答: {reply!r}")
+
+    def write(self, data):
+        """发送一条消息（data可以是bytes或memoryview）"""
+        self.sock.sendall(struct.pack('>Q', len(data)))
+        self.sock.sendall(data)
+
+    def read(self):
+        """读取一条完整消息"""
+        size, = struct.unpack('>Q', self._recv_exact(8))
+        return self._recv_exact(size)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+# 纯Python fastboot客户端 - 进程内直接收发协议，数据按大块流式下载
+class FastbootClient:
+    DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, transport, chunk_size=None, on_info=None):
+        self.transport = transport
+        self.chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+        self.on_info = on_info
+        self._max_download_size = None
+
+    @classmethod
+    def connect(cls, target, timeout=30, wait=0, **kwargs):
+        """按目标字符串连接，如 tcp:192.168.1.5 或 tcp:192.168.1.5:5554；wait为等待设备上线的秒数"""
+        scheme, _, address = target.partition(':')
+        if scheme != 'tcp' or not address:
+            raise FastbootError(f"不支持的fastboot目标: {target}（目前仅支持 tcp:主机[:端口]）")
+        host, _, port = address.partition(':')
+        deadline = time.time() + wait
+        while True:
+            try:
+                return cls(FastbootTcpTransport(host, port or None, timeout), **kwargs)
+            except OSError:
+                if time.time() >= deadline:
+                    raise
+                time.sleep(1)
+
+    def close(self):
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _send_command(self, command):
+        if len(command) > 64:
+            raise FastbootError(f"命令过长: {command}")
+        self.transport.write(command.encode())
+
+    def _read_response(self):
+        """读取应答直到OKAY/FAIL/DATA，INFO/TEXT交给回调并收集"""
+        info = []
+        while True:
+            reply = self.transport.read()
+            status, payload = reply[:4], reply[4:].decode(errors='replace')
+            if status in (b'INFO', b'TEXT'):
+                info.append(payload)
+                if self.on_info:
+                    self.on_info(payload)
+            elif status == b'OKAY':
+                return 'OKAY', payload, info
+            elif status == b'DATA':
+                return 'DATA', payload, info
+            elif status == b'FAIL':
+                raise FastbootError(f"设备返回FAIL: {payload}")
+            else:
+                raise FastbootError(f"未知的fastboot应答: {reply[:64]!r}")
+
+    def command(self, command):
+        """执行简单命令，返回OKAY附带的内容"""
+        self._send_command(command)
+        status, payload, _ = self._read_response()
+        if status != 'OKAY':
+            raise FastbootError(f"命令 {command} 的应答异常: {status}")
+        return payload
+
+    def getvar(self, name):
+        return self.command(f"getvar:{name}")
+
+    def getvar_all(self):
+        """getvar:all 的结果以INFO消息返回，解析为字典"""
+        self._send_command("getvar:all")
+        status, _, info = self._read_response()
+        variables = {}
+        for line in info:
+            name, sep, value = line.rpartition(':')
+            if sep:
+                variables[name.strip()] = value.strip()
+        return variables
+
+    def max_download_size(self):
+        """协商单次下载上限；设备未提供时按协议上限处理"""
+        if self._max_download_size is None:
+            try:
+                self._max_download_size = int(self.getvar("max-download-size"), 0)
+            except (FastbootError, ValueError):
+                self._max_download_size = 0xFFFFFFFF
+        return self._max_download_size
+
+    def _iter_chunks(self, source):
+        """把bytes、文件对象或数据块迭代器整理成chunk_size大小的块"""
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            view = memoryview(source)
+            for offset in range(0, len(view), self.chunk_size):
+                yield view[offset:offset + self.chunk_size]
+            return
+        if hasattr(source, 'readinto'):
+            buffer = bytearray(self.chunk_size)
+            view = memoryview(buffer)
+            while True:
+                n = source.readinto(buffer)
+                if not n:
+                    return
+                yield view[:n]
+        pending = bytearray()
+        for data in source:
+            pending += data
+            if len(pending) >= self.chunk_size:
+                yield pending
+                pending = bytearray()
+        if pending:
+            yield pending
+
+    def download(self, source, size=None, progress=None):
+        """download:%08x 后流式发送数据，source为bytes、文件对象或数据块迭代器（后两者需给出size）"""
+        if size is None:
+            size = len(source)
+        if size > self.max_download_size():
+            raise FastbootError(f"数据大小 {size} 超过设备的max-download-size {self.max_download_size()}")
+        self._send_command(f"download:{size:08x}")
+        status, payload, _ = self._read_response()
+        if status != 'DATA' or int(payload, 16) != size:
+            raise FastbootError(f"设备未接受下载请求: {status} {payload}")
+        sent = 0
+        for chunk in self._iter_chunks(source):
+            if sent + len(chunk) > size:
+                raise FastbootError("数据长度超过声明的大小")
+            self.transport.write(chunk)
+            sent += len(chunk)
+            if progress:
+                progress(sent, size)
+        if sent != size:
+            raise FastbootError(f"数据不完整: {sent}/{size}")
+        status, payload, _ = self._read_response()
+        return payload
+
+    def flash(self, partition):
+        return self.command(f"flash:{partition}")
+
+    def erase(self, partition):
+        return self.command(f"erase:{partition}")
+
+    def reboot(self, target=None):
+        """重启设备；target为bootloader时重启到bootloader"""
+        return self.command(f"reboot-{target}" if target else "reboot")
+
+    def flash_image(self, partition, image_path, progress=None):
+        """刷写镜像：不超过max-download-size时直接流式发送，否则拆分为sparse分段逐段发送"""
+        image_path = Path(image_path)
+        limit = self.max_download_size()
+        size = image_path.stat().st_size
+        if size <= limit:
+            with open(image_path, 'rb') as f:
+                self.download(f, size, progress)
+            return [self.flash(partition)]
+        sparse = SparseImage(image_path)
+        results = []
+        for piece in sparse.split(limit):
+            self.download(sparse.iter_piece(piece, self.chunk_size), sparse.piece_size(piece), progress)
+            results.append(self.flash(partition))
+        return results
+
+    def flash_sender(self, partition, source, size, index, count):
+        """供FlashPipeline使用的发送端：source为数据块迭代器，边读边发送"""
+        self.download(source, size)
+        self.flash(partition)
+
+# 压缩镜像的流式解压器（按后缀选择）
+COMPRESSED_IMAGE_SUFFIXES = ('.gz', '.xz', '.bz2', '.zst')
+
+def open_image_stream(path):
+    """打开镜像文件，压缩格式返回解压后的流"""
+    path = Path(path)
+    if path.suffix == '.gz':
+        return gzip.open(path, 'rb')
+    if path.suffix == '.xz':
+        return lzma.open(path, 'rb')
+    if path.suffix == '.bz2':
+        return bz2.open(path, 'rb')
+    if path.suffix == '.zst':
+        if zstandard is None:
+            raise RuntimeError("解压 .zst 镜像需要安装 zstandard 模块")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+# 在固件所在目录及其 images/ 子目录中查找各分区的镜像文件
+def find_partition_images(firmware_info):
+    file_path = firmware_info.get('file_path')
+    if not file_path:
+        return {}
+    file_path = Path(file_path)
+    images = {}
+    if file_path.suffix == '.img':
+        images[file_path.stem] = file_path
+    for folder in (file_path.parent, file_path.parent / "images"):
+        if folder.is_dir():
+            for image in folder.glob("*.img"):
+                images.setdefault(image.stem, image)
+            for suffix in COMPRESSED_IMAGE_SUFFIXES:
+                for image in folder.glob(f"*.img{suffix}"):
+                    images.setdefault(image.name[:-len(f".img{suffix}")], image)
+    return images
+
+# 刷写预算：限制已排队但尚未发送的分段字节数（分段以迭代器形式排队，发送时才读取数据）
+class ByteBudget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, size, stop_event=None):
+        """申请预算；队列为空时允许单个超出上限的分段通过，避免死锁"""
+        with self.cond:
+            while self.used and self.used + size > self.limit:
+                if stop_event is not None and stop_event.is_set():
+                    return False
+                self.cond.wait(0.2)
+            self.used += size
+            self.peak = max(self.peak, self.used)
+            return True
+
+    def release(self, size):
+        with self.cond:
+            self.used -= size
+            self.cond.notify_all()
+
+def simulated_flash_sender(partition, source, size, index, count, log=print):
+    """默认发送端：读完分段数据并打印日志，不与设备通信"""
+    for _ in source:
+        pass
+    log(f"  {partition}: 写入分段 {index + 1}/{count} ({size / 1024 / 1024:.1f} MB)... OKAY")
+
+# 流水线刷写：后台线程解压并规划后续分区的sparse分段，当前线程边读边发送
+class FlashPipeline:
+    def __init__(self, sender=None, workers=2, max_buffer_bytes=512 * 1024 * 1024,
+                 max_download_size=256 * 1024 * 1024, work_dir=None, on_piece=None):
+        self.sender = sender or simulated_flash_sender
+        # on_piece(分区, 段序号, 段数, 字节数) 在每段发送完成后回调
+        self.on_piece = on_piece
+        self.workers = max(1, workers)
+        self.budget = ByteBudget(max_buffer_bytes)
+        self.max_download_size = max_download_size
+        self.work_dir = work_dir
+        self.stop_event = threading.Event()
+
+    def _decompress(self, partition, image_path, temp_dir):
+        """压缩镜像解压到临时文件；SparseImage需要可随机读取的源文件"""
+        image_path = Path(image_path)
+        if image_path.suffix not in COMPRESSED_IMAGE_SUFFIXES:
+            return image_path, None
+        spool = Path(temp_dir) / f"{partition}.img"
+        with open_image_stream(image_path) as src, open(spool, 'wb') as out:
+            shutil.copyfileobj(src, out, 4 * 1024 * 1024)
+        return spool, spool
+
+    def _produce(self, partition, image_path, temp_dir, output):
+        """生产者：解压、sparse分段，并把每个分段的数据迭代器放入队列"""
+        stats = {'partition': partition, 'image': str(image_path), 'decompress_s': 0.0,
+                 'encode_s': 0.0, 'send_s': 0.0, 'pieces': 0, 'transfer_size': 0, 'logical_size': 0,
+                 'spool': None}
+        with TELEMETRY.span('flash_prepare', partition=partition, image=str(image_path)) as span:
+            try:
+                self._prepare(partition, image_path, temp_dir, output, stats)
+            except Exception as e:
+                stats['error'] = e
+                span.set(status='error', error=str(e))
+            span.add_bytes(stats['transfer_size'])
+        # 无论成功、失败还是被取消，都要通知消费者该分区已结束
+        output.put({'partition': partition, 'done': stats})
+
+    def _prepare(self, partition, image_path, temp_dir, output, stats):
+        if self.stop_event.is_set():
+            return
+        start = time.perf_counter()
+        # 解压出的临时文件要等所有分段发送完毕后由消费者删除
+        source, stats['spool'] = self._decompress(partition, image_path, temp_dir)
+        stats['decompress_s'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        sparse = SparseImage(source)
+        pieces = sparse.split(self.max_download_size)
+        stats['pieces'] = len(pieces)
+        stats['logical_size'] = sparse.logical_size
+        stats['encode_s'] = time.perf_counter() - start
+
+        for index, piece in enumerate(pieces):
+            size = sparse.piece_size(piece)
+            if not self.budget.acquire(size, self.stop_event):
+                return
+            stats['transfer_size'] += size
+            output.put({'partition': partition, 'index': index, 'count': len(pieces),
+                        'source': sparse.iter_piece(piece), 'size': size})
+
+    def run(self, jobs):
+        """按顺序提交 (分区名, 镜像路径) 任务，返回各分区耗时及重叠情况"""
+        jobs = list(jobs)
+        output = queue.Queue()
+        results = {}
+        wait_s = 0.0
+        error = None
+        self.stop_event.clear()
+        started = time.perf_counter()
+        temp_dir = tempfile.mkdtemp(prefix="flash_", dir=self.work_dir)
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            for partition, image_path in jobs:
+                executor.submit(self._produce, partition, image_path, temp_dir, output)
+
+            pending = len(jobs)
+            send_s = {}
+            while pending:
+                start = time.perf_counter()
+                item = output.get()
+                wait_s += time.perf_counter() - start
+                partition = item['partition']
+                if 'done' in item:
+                    pending -= 1
+                    spool = item['done'].pop('spool')
+                    if spool is not None:
+                        try:
+                            spool.unlink()
+                        except OSError:
+                            pass
+                    if 'error' in item['done']:
+                        error = error or item['done']['error']
+                        self.stop_event.set()
+                        continue
+                    item['done']['send_s'] = send_s.get(partition, 0.0)
+                    results[partition] = item['done']
+                    continue
+                size = item['size']
+                try:
+                    if error is None:
+                        start = time.perf_counter()
+                        with TELEMETRY.span('flash_send', partition=partition, piece=item['index']) as span:
+                            span.add_bytes(size)
+                            self.sender(partition, item['source'], size, item['index'], item['count'])
+                        if self.on_piece:
+                            self.on_piece(partition, item['index'], item['count'], size)
+                        send_s[partition] = send_s.get(partition, 0.0) + time.perf_counter() - start
+                except Exception as e:
+                    error = e
+                    self.stop_event.set()
+                finally:
+                    item['source'].close()
+                    self.budget.release(size)
+        finally:
+            self.stop_event.set()
+            executor.shutdown(wait=True)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        if error is not None:
+            raise error
+
+        partitions = [results[p] for p, _ in jobs if p in results]
+        prepare_total = sum(r['decompress_s'] + r['encode_s'] for r in partitions)
+        send_total = sum(r['send_s'] for r in partitions)
+        hidden = max(0.0, prepare_total - wait_s)
+        return {
+            'partitions': partitions,
+            'elapsed': time.perf_counter() - started,
+            'prepare_s': prepare_total,
+            'send_s': send_total,
+            'wait_s': wait_s,
+            'hidden_s': hidden,
+            'hidden_percent': hidden * 100 / prepare_total if prepare_total else 100.0,
+            'sequential_s': prepare_total + send_total,
+            'peak_buffer': self.budget.peak,
+            'transfer_size': sum(r['transfer_size'] for r in partitions),
+            'logical_size': sum(r['logical_size'] for r in partitions)
+        }
 
 # 设备检测模块 - 保留原有功能
 def device_check(firmware_info):
     clear_screen()
     legal_notice()
     print("正在检测设备...")
-    time.sleep(1)
+    ui_sleep(1)
     
     system = firmware_info.get('system', 'unknown')
     device = firmware_info.get('device', '未知设备')
@@ -1152,12 +6392,42 @@ def device_check(firmware_info):
     print("  Bootloader状态：已解锁")
     print("  USB调试模式：已启用")
     print("  电池电量：{}%".format(random.randint(50, 100)))
-    time.sleep(2)
+    ui_sleep(2)
     clear_screen()
 
+# 固件文件的大小与修改时间，用于判断已校验过的文件是否变化
+def firmware_stamp(file_path):
+    st = os.stat(file_path)
+    return [st.st_size, st.st_mtime_ns]
+
+# 刷写前后校验固件文件是否与记录的摘要一致；文件自上次校验后未变化时不重复计算
+def verify_firmware_integrity(firmware_manager):
+    info = firmware_manager.firmware_info
+    log = firmware_manager.log
+    file_path = info.get('file_path')
+    expected = info.get('sha256')
+    if not file_path or not expected or not Path(file_path).exists():
+        log("未记录固件摘要，跳过文件校验")
+        return True
+    stamp = firmware_stamp(file_path)
+    if info.get('verified_stamp') == stamp:
+        log("固件文件自校验后未变化，沿用已校验的摘要")
+        return True
+    result = firmware_manager.hasher.hash_file(
+        file_path, progress=lambda done, total: print_hash_progress(done, total, log))
+    log()
+    if result['sha256'] != expected:
+        info.pop('verified_stamp', None)
+        log(f"\033[91m固件校验失败！SHA-256不匹配\033[0m")
+        return False
+    info['verified_stamp'] = stamp
+    log(f"固件校验通过 ({result['mb_per_s']:.1f} MB/s)")
+    return True
+
 # 刷机核心流程 - 保留原有功能
-def flash_process(firmware_manager):
+def flash_process(firmware_manager, on_piece=None):
     system = firmware_manager.firmware_info.get('system', 'android')
+    log = firmware_manager.log
     
     partitions = [
         ("boot", 4096),
@@ -1167,31 +6437,282 @@ def flash_process(firmware_manager):
         ("recovery", 4096)
     ]
 
-    print("\n刷机日志：")
-    print(f"目标固件：{firmware_manager.firmware_info['name']}")
-    print(f"设备类型：{firmware_manager.firmware_info.get('device', '未知设备')}")
-    print(f"系统版本：{firmware_manager.firmware_info.get('version', '未知版本')}")
-    print(f"文件大小：{firmware_manager.firmware_info.get('size', '未知')}\n")
+    log("\n刷机日志：")
+    log(f"目标固件：{firmware_manager.firmware_info['name']}")
+    log(f"设备类型：{firmware_manager.firmware_info.get('device', '未知设备')}")
+    log(f"系统版本：{firmware_manager.firmware_info.get('version', '未知版本')}")
+    log(f"文件大小：{firmware_manager.firmware_info.get('size', '未知')}\n")
+    
+    # 写入设备之前校验主机上的固件文件，不匹配时不刷写也不重启
+    log("校验固件文件...")
+    with TELEMETRY.span('flash_stage', stage='verify') as span:
+        verified = verify_firmware_integrity(firmware_manager)
+        if not verified:
+            span.set(status='error')
+    if not verified:
+        log("\033[91m固件文件与记录的摘要不一致，已中止刷机\033[0m")
+        return False
+    log()
+    
+    images = find_partition_images(firmware_manager.firmware_info)
+    fastboot = firmware_manager.fastboot
+    if fastboot is None and os.environ.get('FLASH_FASTBOOT'):
+        fastboot = firmware_manager.connect_fastboot()
+    jobs = [(part, images[part]) for part, size in partitions if size > 0 and part in images]
+    
+    if jobs:
+        log(f"流水线刷写 {len(jobs)} 个分区镜像（后台解压/编码，前台传输）...")
+        if fastboot:
+            pipeline = FlashPipeline(sender=fastboot.flash_sender, on_piece=on_piece,
+                                     max_download_size=min(fastboot.max_download_size(), 256 * 1024 * 1024))
+        else:
+            sender = firmware_manager.flash_sender or (
+                lambda *piece: simulated_flash_sender(*piece, log=log))
+            pipeline = FlashPipeline(sender=sender, on_piece=on_piece)
+        try:
+            with TELEMETRY.span('flash_stage', stage='pipeline', partitions=len(jobs)) as span:
+                report = pipeline.run(jobs)
+                span.add_bytes(report['transfer_size'])
+                span.set(hidden_percent=round(report['hidden_percent'], 1))
+        except Exception as e:
+            log(f"\033[91m刷写失败: {e}\033[0m")
+            return False
+        for item in report['partitions']:
+            log(f"  {item['partition']}: 解压 {item['decompress_s']:.2f}s, 编码 {item['encode_s']:.2f}s, "
+                  f"传输 {item['send_s']:.2f}s, {item['transfer_size'] / 1024 / 1024:.1f} MB / "
+                  f"逻辑 {item['logical_size'] / 1024 / 1024:.1f} MB ({item['pieces']} 段)")
+        log(f"流水线耗时 {report['elapsed']:.2f}s（串行估计 {report['sequential_s']:.2f}s），"
+              f"准备工作被传输掩盖 {report['hidden_percent']:.0f}%，"
+              f"待发送峰值 {report['peak_buffer'] / 1024 / 1024:.1f} MB")
+        if report['logical_size']:
+            log(f"共传输 {report['transfer_size'] / 1024 / 1024:.1f} MB / 逻辑大小 {report['logical_size'] / 1024 / 1024:.1f} MB "
+                  f"(节省 {100 - report['transfer_size'] * 100 / report['logical_size']:.0f}%)\n")
     
+    flashed = {part for part, _ in jobs}
     for part, size in partitions:
-        if size > 0:
-            print(f"正在刷写 '{part}' 分区...")
-            time.sleep(0.3)
-            print(f"写入固件... OKAY")
-            time.sleep(0.2)
+        if part in flashed:
+            continue
+        if size > 0 and fastboot:
+            log(f"跳过 '{part}' 分区（未找到镜像文件）")
+        elif size > 0:
+            log(f"正在刷写 '{part}' 分区...")
+            ui_sleep(0.3)
+            log(f"写入固件... OKAY")
+            ui_sleep(0.2)
+        elif fastboot:
+            try:
+                with TELEMETRY.span('flash_stage', stage='erase', partition=part):
+                    fastboot.erase(part)
+            except (OSError, FastbootError) as e:
+                log(f"\033[91m擦除 '{part}' 失败: {e}\033[0m")
+                return False
+            log(f"擦除 '{part}'... OKAY")
         else:
-            print(f"擦除 '{part}'... OKAY")
-            time.sleep(0.1)
+            log(f"擦除 '{part}'... OKAY")
+            ui_sleep(0.1)
     
-    print("\n验证分区完整性...")
-    time.sleep(1)
-    print("重启到系统...")
-    time.sleep(1)
+    log("\n验证分区完整性...")
+    ui_sleep(1)
+    log("重启到系统...")
+    if fastboot:
+        try:
+            with TELEMETRY.span('flash_stage', stage='reboot'):
+                fastboot.reboot()
+        except (OSError, FastbootError) as e:
+            log(f"重启失败: {e}")
+        fastboot.close()
+        firmware_manager.fastboot = None
+    ui_sleep(1)
+    return True
+
+# 无人值守批处理 - 由 --batch 命令行参数驱动，跳过界面动画，进度以JSON Lines输出到标准输出，
+# 人类可读的刷写日志逐行写到标准错误（带设备序列号前缀），多台设备并行
+class BatchRunner:
+    STAGES = ('prepare', 'flash', 'verify')
+
+    def __init__(self, firmware_path, serials, stages=None, fastboot_targets=None, jobs=None,
+                 reboot_bootloader=False, fastboot_wait=30, out=None, err=None):
+        self.firmware_path = Path(firmware_path)
+        self.fastboot_targets = dict(fastboot_targets or {})
+        self.serials = list(serials) or list(self.fastboot_targets)
+        self.stages = list(stages or self.STAGES)
+        self.jobs = max(1, jobs or len(self.serials) or 1)
+        self.reboot_bootloader = reboot_bootloader
+        self.fastboot_wait = fastboot_wait
+        self.out = out or sys.stdout
+        self.err = err or sys.stderr
+        self.manager = None
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+    def emit(self, event, **fields):
+        """输出一行JSON进度事件"""
+        record = {'ts': round(time.time(), 3), 'elapsed': round(time.monotonic() - self._started, 3), 'event': event}
+        record.update(fields)
+        with self._lock:
+            self.out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            self.out.flush()
+
+    def logger(self, serial=None):
+        """返回替代print的日志函数：整行写到标准错误并加序列号前缀，进度条等不换行的输出丢弃"""
+        prefix = f"[{serial}] " if serial else ""
+
+        def log(*args, sep=' ', end='\n', flush=False):
+            if end != '\n':
+                return
+            text = sep.join(str(arg) for arg in args).strip('\n')
+            if not text:
+                return
+            with self._lock:
+                for line in text.split('\n'):
+                    self.err.write(prefix + line + "\n")
+                self.err.flush()
+        return log
+
+    def load_firmware(self):
+        """分析并校验固件，只计算一次摘要，所有设备共用校验结果"""
+        self.manager = FirmwareManager()
+        self.manager.log = self.logger()
+        self.manager.selected_firmware = str(self.firmware_path)
+        self.manager._analyze_firmware(self.firmware_path)
+        if not verify_firmware_integrity(self.manager):
+            raise ValueError("固件文件与索引记录的SHA-256不一致")
+        info = self.manager.firmware_info
+        self.emit('firmware', path=str(self.firmware_path), size=self.firmware_path.stat().st_size,
+                  sha256=info.get('sha256'), system=info.get('system'), device=info.get('device'),
+                  images=sorted(find_partition_images(info)))
+
+    def _device_manager(self, serial):
+        """为单台设备复制一份管理器，共享固件信息与ADB连接池"""
+        manager = copy.copy(self.manager)
+        manager.firmware_info = dict(self.manager.firmware_info)
+        manager.adb_manager = ADBManager()
+        manager.adb_manager.client = self.manager.adb_manager.client
+        manager.adb_manager.current_device = serial
+        manager.fastboot = None
+        manager.flash_sender = None
+        manager.log = self.logger(serial)
+        return manager
+
+    def _stage_prepare(self, serial, manager):
+        target = self.fastboot_targets.get(serial)
+        if serial not in self.fastboot_targets or self.reboot_bootloader:
+            state = manager.adb_manager.run_adb_command("get-state", serial=serial)
+            self.emit('device_state', serial=serial, state=state)
+            if state.startswith("Error") and not target:
+                return False
+            if self.reboot_bootloader:
+                result = manager.adb_manager.run_adb_command("reboot bootloader", serial=serial)
+                if result.startswith("Error"):
+                    self.emit('log', serial=serial, message=result)
+                    return False
+        if target:
+            if manager.connect_fastboot(target, wait=self.fastboot_wait) is None:
+                return False
+            self.emit('fastboot', serial=serial, target=target, **manager.fastboot_info())
+        return True
+
+    def _stage_flash(self, serial, manager):
+        def on_piece(partition, index, count, size):
+            self.emit('piece', serial=serial, partition=partition, index=index, count=count, bytes=size)
+        return flash_process(manager, on_piece=on_piece)
+
+    def _stage_verify(self, serial, manager):
+        return verify_firmware_integrity(manager)
+
+    def run_device(self, serial):
+        manager = self._device_manager(serial)
+        ok = True
+        try:
+            for stage in self.stages:
+                self.emit('stage_start', serial=serial, stage=stage)
+                start = time.monotonic()
+                with TELEMETRY.span('batch_stage', serial=serial, stage=stage) as span:
+                    try:
+                        ok = bool(getattr(self, f"_stage_{stage}")(serial, manager))
+                    except Exception as e:
+                        self.emit('log', serial=serial, message=f"{type(e).__name__}: {e}")
+                        ok = False
+                    if not ok:
+                        span.set(status='error')
+                self.emit('stage_end', serial=serial, stage=stage, ok=ok, seconds=round(time.monotonic() - start, 3))
+                if not ok:
+                    break
+        finally:
+            if manager.fastboot is not None:
+                manager.fastboot.close()
+        self.emit('device_done', serial=serial, ok=ok)
+        return ok
+
+    def run(self):
+        """执行全部设备，返回进程退出码（0为全部成功）"""
+        if not self.serials:
+            self.emit('error', message="未指定设备")
+            return 2
+        try:
+            self.load_firmware()
+        except (OSError, ValueError) as e:
+            self.emit('error', message=f"固件读取失败: {e}")
+            return 2
+        results = {}
+        with ThreadPoolExecutor(max_workers=min(self.jobs, len(self.serials))) as pool:
+            futures = {pool.submit(self.run_device, serial): serial for serial in self.serials}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        failed = sorted(serial for serial, ok in results.items() if not ok)
+        self.emit('summary', devices=len(results), succeeded=len(results) - len(failed), failed=failed,
+                  seconds=round(time.monotonic() - self._started, 3))
+        return 1 if failed else 0
+
+def run_batch(argv):
+    """命令行批处理入口"""
+    parser = argparse.ArgumentParser(prog=f"{Path(sys.argv[0]).name} --batch",
+                                     description="高级刷机工具 - 无人值守批处理模式")
+    parser.add_argument('--firmware', '-f', required=True, help="固件文件路径")
+    parser.add_argument('--serial', '-s', action='append', default=[], help="设备序列号，可重复指定")
+    parser.add_argument('--all-devices', action='store_true', help="刷写adb devices列出的全部设备")
+    parser.add_argument('--stages', default=",".join(BatchRunner.STAGES),
+                        help="执行的阶段，逗号分隔 (默认 prepare,flash,verify)")
+    parser.add_argument('--fastboot', action='append', default=[], metavar="[SERIAL=]tcp:HOST[:PORT]",
+                        help="设备的fastboot地址；只有一台设备时可省略序列号")
+    parser.add_argument('--reboot-bootloader', action='store_true', help="刷写前通过adb重启到bootloader")
+    parser.add_argument('--fastboot-wait', type=float, default=30, help="等待fastboot上线的秒数")
+    parser.add_argument('--jobs', '-j', type=int, help="并行设备数（默认全部并行）")
+    args = parser.parse_args(argv)
+
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = [s for s in stages if s not in BatchRunner.STAGES]
+    if unknown:
+        parser.error(f"未知的阶段: {', '.join(unknown)}")
+    serials = list(args.serial)
+    if args.all_devices:
+        serials += [s for s in ADBManager().check_devices() if s not in serials]
+    targets = {}
+    for value in args.fastboot:
+        serial, sep, target = value.partition('=')
+        if not sep:
+            if len(serials) > 1:
+                parser.error("多台设备时 --fastboot 需写成 SERIAL=tcp:HOST[:PORT]")
+            serial, target = (serials[0] if serials else value), value
+        targets[serial] = target
+    if not Path(args.firmware).is_file():
+        parser.error(f"固件文件不存在: {args.firmware}")
+
+    global UI_DELAYS
+    UI_DELAYS = False
+    # 标准输出只写JSON事件，刷写日志经BatchRunner.logger写到标准错误
+    return BatchRunner(args.firmware, serials, stages, targets, args.jobs,
+                       args.reboot_bootloader, args.fastboot_wait, sys.stdout, sys.stderr).run()
 
 # 主程序流程 - 保留原有结构
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        if sys.argv[1] != '--batch':
+            sys.exit(f"未知参数: {' '.join(sys.argv[1:])}\n"
+                     f"批处理模式: {sys.argv[0]} --batch --firmware 固件文件 --serial 序列号 [...]")
+        sys.exit(run_batch(sys.argv[2:]))
     legal_notice()
-    time.sleep(1)
+    ui_sleep(1)
     
     # 固件选择
     fm = FirmwareManager()
@@ -1204,6 +6725,10 @@ if __name__ == "__main__":
 
     # 刷机进度显示
     def show_progress(step, name, firmware_info):
+        with TELEMETRY.span('progress_stage', step=step, stage=name, firmware=firmware_info.get('name')):
+            run_progress_stage(step, name, firmware_info)
+
+    def run_progress_stage(step, name, firmware_info):
         legal_notice()
         print(f"刷机阶段 {step}/3: {name}")
         print(f"当前固件：{firmware_info['name']}")
@@ -1211,17 +6736,18 @@ if __name__ == "__main__":
         print(f"系统：{firmware_info.get('system', '未知系统').upper()}")
         
         if step == 2:
-            flash_process(fm)
-            time.sleep(1)
+            if not flash_process(fm):
+                sys.exit(1)
+            ui_sleep(1)
         
         for i in range(101):
             bar = f"\r[{'█' * (i//2)}{' ' * (50 - i//2)}] {i}% "
             color_code = 93 if i < 100 else 92
             print(f"\033[{color_code}m{bar}\033[0m", end='', flush=True)
-            time.sleep(0.02)
+            ui_sleep(0.02)
         
         print("\n\n阶段完成")
-        time.sleep(1)
+        ui_sleep(1)
         clear_screen()
 
     # 执行刷机流程
@@ -1240,9 +6766,9 @@ if __name__ == "__main__":
     print("\n设备将在10秒后重启...")
     for i in range(10, 0, -1):
         print(f"\r倒计时: {i:02d} 秒", end='')
-        time.sleep(1)
+        ui_sleep(1)
 
     clear_screen()
     print("\033[92m[设备已重启]\033[0m")
-    time.sleep(2)
+    ui_sleep(2)
     sys.exit()
\ No newline at end of file
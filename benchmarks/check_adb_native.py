@@ -0,0 +1,95 @@
+"""ADB主机协议客户端的行为检查（进程内模拟adb server，不需要真实设备）
+
+用法:
+    python benchmarks/check_adb_native.py
+
+逐项比较原生协议路径的结果与adb进程路径应有的行为，任一项不符时以非零状态退出。
+"""
+import socket
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from run_benchmarks import FakeADBServer, load_tool, write_devices_listing  # noqa: E402
+
+
+def free_port():
+    """取一个当前没有进程监听的端口"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    tool = load_tool()
+    failures = []
+
+    def check(name, condition, detail=""):
+        print(f"{'PASS' if condition else 'FAIL'} {name}" + (f" ({detail})" if detail and not condition else ""))
+        if not condition:
+            failures.append(name)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        devices_path = Path(work_dir) / "devices.txt"
+        write_devices_listing(devices_path, 3)
+        server = FakeADBServer(devices_path)
+        try:
+            manager = tool.ADBManager()
+            manager.client = tool.ADBClient('127.0.0.1', server.port)
+
+            devices = manager.check_devices()
+            check("devices输出与adb devices一致", devices == ["emulator-5556", "emulator-5558"], devices)
+
+            output = manager._run_native("shell getprop ro.product.model", "emulator-5556")
+            check("shell命令返回设备输出", output == "ok", output)
+            check("shell命令先切换到指定设备",
+                  server.requests[-2:] == ["host:transport:emulator-5556", "shell:getprop ro.product.model"],
+                  server.requests[-2:])
+
+            for command in ("shell ps | grep adbd", "shell ifconfig || ip addr", "shell cd /sdcard; ls",
+                            "shell sleep 1 &", "shell cat > /sdcard/x", "shell echo \"$PATH\""):
+                count = len(server.requests)
+                result = manager._run_native(command, "emulator-5556")
+                check(f"含宿主shell语法的命令交给adb进程: {command}",
+                      result is None and len(server.requests) == count, result)
+
+            outputs = set()
+            for _ in range(50):
+                manager.client.devices()
+                outputs.add(manager._run_native("shell getprop", "emulator-5556"))
+            check("主机查询后紧接着的设备命令不复用已被关闭的连接", outputs == {"ok"}, outputs)
+
+            output = manager._run_native("install -r app.apk", "emulator-5556")
+            check("未实现的命令交给adb进程", output is None, output)
+
+            output = manager._run_native("shell true", "no-such-device")
+            check("FAIL应答转换为Error字符串", output is not None and output.startswith("Error:"), output)
+
+            try:
+                manager.open_stream("screencap", "no-such-device", service='exec').close()
+                error = None
+            except Exception as e:
+                error = e
+            check("数据流打开失败时抛出RuntimeError", isinstance(error, RuntimeError), repr(error))
+
+            count = len(server.requests)
+            output = manager._run_native("shell reset", "emulator-5556")
+            check("命令执行中途断开时返回Error而不是重新执行",
+                  output is not None and output.startswith("Error:") and server.requests[count:].count("shell:reset") == 1,
+                  output)
+            manager.client.close()
+        finally:
+            server.close()
+
+        manager = tool.ADBManager()
+        manager.client = tool.ADBClient('127.0.0.1', free_port())
+        output = manager._run_native("shell getprop", "emulator-5556")
+        check("adb server未启动时交给adb进程", output is None, output)
+
+    print(f"\n{'全部通过' if not failures else f'{len(failures)} 项失败'}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,447 @@
+"""刷机工具热点路径的基准测试
+
+用法:
+    python benchmarks/run_benchmarks.py            # 运行全部基准并追加结果到 benchmarks/results.jsonl
+    python benchmarks/run_benchmarks.py --quick    # 缩小数据规模，适合本地快速检查
+    python benchmarks/run_benchmarks.py --only adb_subprocess,hash_sparse
+
+每次运行的结果追加为 results.jsonl 中的一行，并与同一主机上一次的结果比较，
+变慢超过阈值的项目会被标记出来。
+"""
+import argparse
+import importlib.util
+import io
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from contextlib import redirect_stdout
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_RESULTS = Path(__file__).resolve().parent / "results.jsonl"
+
+
+def load_tool():
+    """按文件路径加载 2.0.py（文件名不是合法的模块名）"""
+    spec = importlib.util.spec_from_file_location("flashtool", ROOT / "2.0.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["flashtool"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(func, number=1, repeat=5, setup=None):
+    """运行repeat轮、每轮number次，返回单次耗时统计（秒）"""
+    if setup:
+        setup()
+    times = [t / number for t in timeit.Timer(func).repeat(repeat=repeat, number=number)]
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'rounds': repeat,
+        'number': number
+    }
+
+
+# ---- 模拟adb ----
+FAKE_ADB_SCRIPT = """#!/bin/sh
+if [ "$1" = "-s" ]; then shift 2; fi
+case "$1" in
+    devices) cat "$FAKE_ADB_DEVICES" ;;
+    get-state) echo device ;;
+    *) echo ok ;;
+esac
+"""
+
+
+def write_devices_listing(path, count):
+    with open(path, 'w') as f:
+        f.write("List of devices attached\n")
+        for i in range(count):
+            state = "offline" if i % 17 == 0 else "device"
+            f.write(f"emulator-{5554 + i * 2}\t{state}\n")
+        f.write("\n")
+
+
+class FakeADBServer:
+    """最小的adb server：应答host:version/devices/features/transport和shell:
+
+    收到的请求依次记录在requests中；shell:reset 在应答OKAY后直接复位连接，模拟命令执行中途断开。
+    """
+
+    def __init__(self, devices_path):
+        self.devices_path = devices_path
+        self.requests = []
+        self.server = socket.socket()
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(64)
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    @staticmethod
+    def _recv_request(conn):
+        header = b''
+        while len(header) < 4:
+            chunk = conn.recv(4 - len(header))
+            if not chunk:
+                return None
+            header += chunk
+        size = int(header, 16)
+        data = b''
+        while len(data) < size:
+            data += conn.recv(size - len(data))
+        return data.decode()
+
+    @staticmethod
+    def _reply(conn, payload):
+        conn.sendall(b"OKAY" + b"%04x" % len(payload) + payload)
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                request = self._recv_request(conn)
+                if request is None:
+                    return
+                self.requests.append(request)
+                if request == "host:version":
+                    self._reply(conn, b"0029")
+                    return
+                if request.startswith("host:devices"):
+                    with open(self.devices_path, 'rb') as f:
+                        self._reply(conn, f.read().split(b"\n", 1)[1])
+                    return
+                if request.endswith("features"):
+                    self._reply(conn, b"cmd")
+                    return
+                if request.startswith("host:transport:") and not self._known(request.split(":", 2)[2]):
+                    message = f"device '{request.split(':', 2)[2]}' not found".encode()
+                    conn.sendall(b"FAIL" + b"%04x" % len(message) + message)
+                    return
+                if request.startswith("host:transport") or request.startswith("host-serial"):
+                    conn.sendall(b"OKAY")
+                    continue
+                if request == "shell:reset":
+                    conn.sendall(b"OKAY")
+                    conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+                    return
+                if request.startswith("shell:"):
+                    conn.sendall(b"OKAY" + b"ok\n")
+                    return
+                conn.sendall(b"FAIL0007unknown")
+                return
+
+    def _known(self, serial):
+        with open(self.devices_path) as f:
+            return any(line.split("\t")[0] == serial for line in f.read().splitlines()[1:])
+
+    def close(self):
+        self.server.close()
+
+
+# ---- 基准项目 ----
+class Benchmarks:
+    def __init__(self, tool, work_dir, quick=False):
+        self.tool = tool
+        self.work_dir = Path(work_dir)
+        self.quick = quick
+        self.devices_path = self.work_dir / "devices.txt"
+        write_devices_listing(self.devices_path, 50 if quick else 500)
+
+    def _fake_adb_env(self):
+        bin_dir = self.work_dir / "bin"
+        bin_dir.mkdir(exist_ok=True)
+        adb = bin_dir / "adb"
+        adb.write_text(FAKE_ADB_SCRIPT)
+        adb.chmod(0o755)
+        os.environ['PATH'] = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+        os.environ['FAKE_ADB_DEVICES'] = str(self.devices_path)
+
+    def adb_subprocess(self):
+        """run_adb_command 经adb进程往返（模拟adb二进制）"""
+        if os.name == 'nt':
+            return None
+        self._fake_adb_env()
+        manager = self.tool.ADBManager()
+        manager.use_native = False
+        result = measure(lambda: manager.run_adb_command("shell getprop ro.product.model", serial="emulator-5554"),
+                         number=5 if self.quick else 20)
+        result['unit'] = 's/call'
+        return result
+
+    def adb_native(self):
+        """run_adb_command 经ADB主机协议往返（进程内模拟adb server）"""
+        server = FakeADBServer(self.devices_path)
+        try:
+            manager = self.tool.ADBManager()
+            manager.client = self.tool.ADBClient('127.0.0.1', server.port)
+            manager.run_adb_command("shell true", serial="emulator-5554")
+            result = measure(lambda: manager.run_adb_command("shell getprop ro.product.model", serial="emulator-5554"),
+                             number=20 if self.quick else 200)
+            manager.client.close()
+        finally:
+            server.close()
+        result['unit'] = 's/call'
+        return result
+
+    def check_devices(self):
+        """解析数百台设备的 adb devices 输出（不含进程启动开销）"""
+        manager = self.tool.ADBManager()
+        output = self.devices_path.read_text().strip()
+        manager.run_adb_command = lambda command, device_specific=True, serial=None, timeout=30: output
+        devices = manager.check_devices()
+        result = measure(manager.check_devices, number=200 if self.quick else 2000)
+        result.update({'unit': 's/call', 'devices': len(devices)})
+        return result
+
+    def _sparse_file(self, size):
+        """生成带少量数据的大稀疏文件，避免写满磁盘"""
+        path = self.work_dir / f"sparse_{size}.img"
+        if not path.exists():
+            with open(path, 'wb') as f:
+                f.truncate(size)
+                for offset in range(0, size, 256 * 1024 * 1024):
+                    f.seek(offset)
+                    f.write(os.urandom(1024 * 1024))
+        return path
+
+    def _file_size(self):
+        return (256 if self.quick else 2048) * 1024 * 1024
+
+    def hash_sparse(self):
+        """FirmwareHasher 一次读取同时计算 md5/sha1/sha256 的吞吐量"""
+        size = self._file_size()
+        path = self._sparse_file(size)
+        hasher = self.tool.FirmwareHasher()
+        result = measure(lambda: hasher.hash_file(path), repeat=3)
+        result.update({'unit': 's/file', 'bytes': size, 'mb_per_s': size / 1024 / 1024 / result['median']})
+        return result
+
+    def calculate_md5(self):
+        """FirmwareManager.calculate_md5 的吞吐量"""
+        size = self._file_size()
+        path = self._sparse_file(size)
+        manager = self.tool.FirmwareManager()
+        result = measure(lambda: manager.calculate_md5(path), repeat=3)
+        result.update({'unit': 's/file', 'bytes': size, 'mb_per_s': size / 1024 / 1024 / result['median']})
+        return result
+
+    def _synthetic_tree(self):
+        """img/<system>/<device>/ 下的大量空固件文件"""
+        files = 500 if self.quick else 10000
+        root = self.work_dir / f"img_{files}"
+        if not root.exists():
+            extensions = ('.zip', '.img', '.bin', '.tgz', '.txt')
+            for i in range(files):
+                folder = root / f"system{i % 5}" / f"device{i % 97}"
+                folder.mkdir(parents=True, exist_ok=True)
+                (folder / f"firmware_{i}{extensions[i % len(extensions)]}").touch()
+        return root, files
+
+    def scan_cold(self):
+        """select_local_firmware 使用的索引扫描：没有索引文件时的首次扫描"""
+        root, files = self._synthetic_tree()
+        index_file = self.work_dir / "scan_index.json"
+
+        def run():
+            if index_file.exists():
+                index_file.unlink()
+            self.tool.FirmwareIndex(root, index_file).scan()
+
+        result = measure(run, repeat=3)
+        result.update({'unit': 's/scan', 'files': files})
+        return result
+
+    def scan_warm(self):
+        """索引文件已存在、文件未变化时的重新扫描"""
+        root, files = self._synthetic_tree()
+        index_file = self.work_dir / "scan_index_warm.json"
+        self.tool.FirmwareIndex(root, index_file).scan()
+        result = measure(lambda: self.tool.FirmwareIndex(root, index_file).scan(), repeat=5)
+        result.update({'unit': 's/scan', 'files': files})
+        return result
+
+    def menu_render(self):
+        """渲染主菜单并分发一次按键（不含清屏子进程）"""
+        tool = self.tool
+
+        class ScriptedInput:
+            def dispatch(self, handlers):
+                return None
+
+        manager = tool.FirmwareManager()
+        manager.input = ScriptedInput()
+        original_clear = tool.clear_screen
+        tool.clear_screen = lambda: None
+        sink = io.StringIO()
+        try:
+            with redirect_stdout(sink):
+                result = measure(manager.show_menu, number=200 if self.quick else 2000)
+        finally:
+            tool.clear_screen = original_clear
+        result['unit'] = 's/render'
+        return result
+
+    def clear_screen(self):
+        """clear_screen 的开销（每次启动一个系统命令）"""
+        saved = os.dup(1)
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        try:
+            result = measure(self.tool.clear_screen, number=5 if self.quick else 20)
+        finally:
+            os.dup2(saved, 1)
+            os.close(saved)
+            os.close(devnull)
+        result['unit'] = 's/call'
+        return result
+
+    def idle_cpu(self):
+        """菜单等待按键时每秒占用的CPU时间（应接近0）"""
+        dispatcher = self.tool.InputDispatcher('stdin')
+        read_fd, write_fd = os.pipe()
+        original_stdin = sys.stdin
+        sys.stdin = os.fdopen(read_fd, 'r')
+        seconds = 0.5 if self.quick else 2.0
+        try:
+            with redirect_stdout(io.StringIO()):
+                waiter = threading.Thread(target=dispatcher.wait_any_key, daemon=True)
+                waiter.start()
+                time.sleep(0.1)
+                cpu_start, wall_start = time.process_time(), time.perf_counter()
+                time.sleep(seconds)
+                cpu = time.process_time() - cpu_start
+                wall = time.perf_counter() - wall_start
+                os.write(write_fd, b"\n")
+                waiter.join(1)
+        finally:
+            sys.stdin.close()
+            sys.stdin = original_stdin
+            os.close(write_fd)
+        return {'min': cpu / wall, 'median': cpu / wall, 'mean': cpu / wall, 'stdev': 0.0,
+                'rounds': 1, 'number': 1, 'unit': 'cpu_s/s'}
+
+
+BENCHMARKS = ('adb_subprocess', 'adb_native', 'check_devices', 'hash_sparse', 'calculate_md5',
+              'scan_cold', 'scan_warm', 'menu_render', 'clear_screen', 'idle_cpu')
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def previous_run(results_path, host, quick):
+    """同一主机、同一规模的上一次结果"""
+    last = None
+    try:
+        with open(results_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    run = json.loads(line)
+                except ValueError:
+                    continue
+                if run.get('host') == host and run.get('quick') == quick:
+                    last = run
+    except OSError:
+        pass
+    return last
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="刷机工具基准测试")
+    parser.add_argument('--quick', action='store_true', help="缩小数据规模")
+    parser.add_argument('--only', help="逗号分隔的基准名称: " + ",".join(BENCHMARKS))
+    parser.add_argument('--results', default=str(DEFAULT_RESULTS), help="结果文件 (JSON Lines)")
+    parser.add_argument('--no-save', action='store_true', help="不写入结果文件")
+    parser.add_argument('--threshold', type=float, default=10.0, help="判定为变慢的百分比阈值")
+    parser.add_argument('--work-dir', help="测试数据目录（默认临时目录，运行后删除）")
+    args = parser.parse_args(argv)
+
+    names = [n.strip() for n in args.only.split(',')] if args.only else list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知的基准: {', '.join(unknown)}")
+
+    tool = load_tool()
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="flash_bench_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    results = {}
+    try:
+        suite = Benchmarks(tool, work_dir, quick=args.quick)
+        for name in names:
+            print(f"{name} ...", end=' ', flush=True)
+            try:
+                result = getattr(suite, name)()
+            except Exception as e:
+                print(f"失败: {e}")
+                results[name] = {'error': str(e)}
+                continue
+            if result is None:
+                print("跳过")
+                continue
+            results[name] = result
+            extra = f" ({result['mb_per_s']:.1f} MB/s)" if 'mb_per_s' in result else ""
+            print(f"{result['median'] * 1000:.3f} ms{extra}" if result['unit'] != 'cpu_s/s'
+                  else f"{result['median'] * 100:.2f}% CPU")
+    finally:
+        os.chdir(cwd)
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    run = {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'revision': git_revision(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'quick': args.quick,
+        'results': results
+    }
+
+    previous = previous_run(args.results, run['host'], args.quick)
+    if previous:
+        print(f"\n与上次结果比较 ({previous.get('revision')}, {previous.get('timestamp')}):")
+        for name, result in results.items():
+            old = previous['results'].get(name)
+            if not old or 'median' not in old or 'median' not in result or not old['median']:
+                continue
+            change = (result['median'] - old['median']) * 100 / old['median']
+            flag = "  <-- 变慢" if change > args.threshold else ""
+            print(f"  {name:16s} {change:+7.1f}%{flag}")
+
+    if not args.no_save:
+        with open(args.results, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(run, ensure_ascii=False) + "\n")
+        print(f"\n结果已追加到 {args.results}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())